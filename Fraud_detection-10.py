@@ -10,17 +10,19 @@ import pandas as pd
 import numpy as np
 import os
 import glob
-import joblib
 import json
 import traceback
 import matplotlib.pyplot as plt
 from datetime import datetime
 import io
 from PIL import Image
+from domain_check import DomainChecker
+from similarity_index import SimilarityIndex, similarity_index_path
+from model_registry import ModelRegistry, load_ensemble_dir, report_duplicates
+from thread_budget import ThreadBudget, predict_with_threads
+from fingerprint import artifact_fingerprint, code_fingerprint, fingerprint
 
-# 清除缓存，强制重新渲染
 if "debug" not in st.session_state:
-    st.cache_data.clear()
     st.session_state.debug = True
     st.session_state.decimal_test = 46.12  # 测试两位小数
 
@@ -273,6 +275,51 @@ if gas_button:
 st.markdown(f"<p style='text-align:center;'>当前模型: <b>{st.session_state.selected_model}</b></p>", unsafe_allow_html=True)
 st.markdown("</div>", unsafe_allow_html=True)
 
+def verify_ensemble_artifacts(artifacts):
+    """验证模型目录：子模型可预测，权重数量与子模型一致"""
+    models = artifacts['models']
+    if not all(hasattr(model, 'predict') for model in models):
+        raise ValueError("存在缺少predict方法的子模型")
+    weights = artifacts['model_weights']
+    if weights is not None and len(weights) != len(models):
+        raise ValueError(f"权重数量 ({len(weights)}) 与子模型数量 ({len(models)}) 不一致")
+
+@st.cache_resource
+def get_thread_budget():
+    """进程级共享的线程预算：并发会话按当前并发数分配CatBoost线程，避免线程超订"""
+    return ThreadBudget.from_env()
+
+@st.cache_resource
+def get_model_registry():
+    """进程级共享的模型注册表：各会话共用已加载的模型目录，目录内文件更新后在后台热替换"""
+    registry = ModelRegistry(verifier=verify_ensemble_artifacts, poll_interval=5.0)
+    # 启动时报告内容相同的模型目录（注册表按内容哈希让它们共用同一份已加载的产物）
+    report_duplicates(glob.glob("*_Model"))
+    registry.start_watching()
+    return registry
+
+# 以下缓存按模型目录内容（含metadata.json）和预测器代码的指纹失效，不再在重跑时清空整个缓存
+@st.cache_data
+def load_metadata(metadata_path, cache_fingerprint):
+    """读取模型元数据"""
+    with open(metadata_path, 'r') as f:
+        return json.load(f)
+
+@st.cache_resource
+def load_similarity_index(index_path, index_fingerprint):
+    """加载训练集近邻相似度索引（所有会话共享，索引文件重新构建后指纹变化时重新加载），不存在时返回None"""
+    return SimilarityIndex.load(index_path)
+
+@st.cache_data
+def cached_feature_importance(_predictor, cache_fingerprint):
+    """特征重要性表和计算日志（所有会话共享，模型目录或代码变化后重新计算）"""
+    return _predictor.compute_feature_importance()
+
+@st.cache_data
+def cached_model_info(_predictor, cache_fingerprint):
+    """模型信息摘要"""
+    return _predictor.build_model_info()
+
 class CorrectedEnsemblePredictor:
     """修复版集成模型预测器 - 解决子模型标准化器问题，支持多模型切换"""
     
@@ -287,7 +334,10 @@ class CorrectedEnsemblePredictor:
         self.model_dir = None
         self.feature_importance = None
         self.training_ranges = {}
+        self.domain_checker = None  # 训练范围适用域检查器
+        self.similarity_index = None  # 训练集近邻相似度索引
         self.model_loaded = False  # 新增：标记模型加载状态
+        self.cache_fingerprint = None  # 模型目录和预测器代码的指纹（缓存键）
         
         # 加载模型
         self.load_model()
@@ -357,47 +407,54 @@ class CorrectedEnsemblePredictor:
         return os.getcwd()
     
     def load_feature_importance(self):
-        """加载特征重要性数据"""
+        """加载特征重要性数据（按指纹缓存）"""
+        # 缓存函数内不能写入页面元素，日志随结果一起返回后再输出
+        self.feature_importance, messages = cached_feature_importance(self, self.cache_fingerprint)
+        for message in messages:
+            log(message)
+        return self.feature_importance is not None
+    
+    def compute_feature_importance(self):
+        """从CSV、元数据或子模型计算特征重要性，返回 (DataFrame或None, 日志消息列表)"""
+        messages = []
         try:
             # 尝试从CSV文件加载特征重要性
             importance_csv = os.path.join(self.model_dir, "feature_importance.csv")
             if os.path.exists(importance_csv):
                 importance_df = pd.read_csv(importance_csv)
-                self.feature_importance = importance_df
-                log(f"已加载特征重要性数据，共 {len(importance_df)} 个特征")
-                return True
+                messages.append(f"已加载特征重要性数据，共 {len(importance_df)} 个特征")
+                return importance_df, messages
             
             # 如果CSV不存在，尝试从元数据中加载
             if self.metadata and 'feature_importance' in self.metadata:
                 importance_data = self.metadata['feature_importance']
-                self.feature_importance = pd.DataFrame(importance_data)
-                log(f"从元数据加载特征重要性数据")
-                return True
+                messages.append("从元数据加载特征重要性数据")
+                return pd.DataFrame(importance_data), messages
             
             # 尝试通过加载的模型计算特征重要性
             if self.models and self.model_weights is not None and self.feature_names:
-                log("通过模型计算特征重要性")
+                messages.append("通过模型计算特征重要性")
                 importance = np.zeros(len(self.feature_names))
                 for i, model in enumerate(self.models):
                     try:
                         model_importance = model.get_feature_importance()
                         importance += model_importance * self.model_weights[i]
                     except Exception as e:
-                        log(f"获取模型 {i} 特征重要性时出错: {str(e)}")
+                        messages.append(f"获取模型 {i} 特征重要性时出错: {str(e)}")
                 
-                self.feature_importance = pd.DataFrame({
+                importance_df = pd.DataFrame({
                     'Feature': self.feature_names,
                     'Importance': importance
                 }).sort_values('Importance', ascending=False)
                 
-                log(f"计算得到特征重要性数据，最重要特征: {self.feature_importance['Feature'].iloc[0]}")
-                return True
+                messages.append(f"计算得到特征重要性数据，最重要特征: {importance_df['Feature'].iloc[0]}")
+                return importance_df, messages
                 
-            log("警告: 无法加载或计算特征重要性")
-            return False
+            messages.append("警告: 无法加载或计算特征重要性")
+            return None, messages
         except Exception as e:
-            log(f"加载特征重要性时出错: {str(e)}")
-            return False
+            messages.append(f"加载特征重要性时出错: {str(e)}")
+            return None, messages
     
     def extract_training_ranges(self):
         """从元数据中提取训练数据真实范围"""
@@ -410,6 +467,7 @@ class CorrectedEnsemblePredictor:
             for feature, range_info in self.training_ranges.items():
                 log(f"特征 {feature} 训练范围: {range_info['min']:.2f} - {range_info['max']:.2f}")
             
+            self.domain_checker = DomainChecker.from_ranges(self.training_ranges)
             return True
         else:
             log("警告: 元数据中没有特征范围信息")
@@ -430,6 +488,7 @@ class CorrectedEnsemblePredictor:
             }
             
             log("使用训练代码中提取的默认特征范围")
+            self.domain_checker = DomainChecker.from_ranges(self.training_ranges)
             return False
     
     def load_model(self):
@@ -446,11 +505,14 @@ class CorrectedEnsemblePredictor:
             self.model_dir = self.find_model_directory()
             log(f"使用{self.target_name}模型目录: {self.model_dir}")
             
-            # 2. 加载元数据
+            # 2. 加载元数据（缓存指纹：模型目录内容 + 预测器代码；找不到模型目录时只取元数据文件）
             metadata_path = os.path.join(self.model_dir, 'metadata.json')
+            artifact_path = self.model_dir if os.path.isdir(os.path.join(self.model_dir, 'models')) else metadata_path
+            self.cache_fingerprint = fingerprint(
+                self.target_name, artifact_fingerprint(artifact_path), code_fingerprint(CorrectedEnsemblePredictor)
+            )
             if os.path.exists(metadata_path):
-                with open(metadata_path, 'r') as f:
-                    self.metadata = json.load(f)
+                self.metadata = load_metadata(metadata_path, self.cache_fingerprint)
                 
                 # 获取特征名称和目标变量
                 self.feature_names = self.metadata.get('feature_names', None)
@@ -468,51 +530,43 @@ class CorrectedEnsemblePredictor:
                 ]
                 log(f"使用默认特征列表: {self.feature_names}")
             
-            # 3. 加载模型
+            # 3. 检查模型文件
             models_dir = os.path.join(self.model_dir, 'models')
-            if os.path.exists(models_dir):
-                model_files = sorted(glob.glob(os.path.join(models_dir, 'model_*.joblib')))
-                if model_files:
-                    for model_file in model_files:
-                        model = joblib.load(model_file)
-                        self.models.append(model)
-                        log(f"加载模型: {os.path.basename(model_file)}")
-                else:
-                    log(f"错误: 未找到模型文件在 {models_dir}")
-                    st.error(f"错误: 未找到{self.target_name}模型文件。请检查应用安装或联系管理员。")
-                    return False
-            else:
+            if not os.path.exists(models_dir):
                 log(f"错误: 模型目录不存在: {models_dir}")
                 st.error(f"错误: {self.target_name}模型目录不存在。请检查应用安装或联系管理员。")
                 return False
+            if not glob.glob(os.path.join(models_dir, 'model_*.joblib')):
+                log(f"错误: 未找到模型文件在 {models_dir}")
+                st.error(f"错误: 未找到{self.target_name}模型文件。请检查应用安装或联系管理员。")
+                return False
             
-            # 4. 加载每个子模型的标准化器 - 这是关键修复点
-            scalers_dir = os.path.join(self.model_dir, 'scalers')
-            if os.path.exists(scalers_dir):
-                scaler_files = sorted(glob.glob(os.path.join(scalers_dir, 'scaler_*.joblib')))
-                if scaler_files:
-                    for scaler_file in scaler_files:
-                        scaler = joblib.load(scaler_file)
-                        self.scalers.append(scaler)
-                        log(f"加载子模型标准化器: {os.path.basename(scaler_file)}")
-                else:
-                    log(f"警告: 未找到子模型标准化器文件在 {scalers_dir}")
+            # 4~6. 从共享模型注册表获取子模型、标准化器和权重（整个目录作为一个版本，更新后原子替换）
+            registry = get_model_registry()
+            artifacts = registry.load(self.model_dir, loader=load_ensemble_dir)
+            version = registry.get_version(self.model_dir)
+            log(f"模型目录版本: {version.number} (sha256 {version.digest[:10]})")
+            
+            self.models = list(artifacts['models'])
+            for model_file in artifacts['model_files']:
+                log(f"加载模型: {model_file}")
+            
+            self.scalers = list(artifacts['scalers'])
+            if self.scalers:
+                for scaler_file in artifacts['scaler_files']:
+                    log(f"加载子模型标准化器: {scaler_file}")
             else:
-                log(f"警告: 未找到标准化器目录: {scalers_dir}")
+                log(f"警告: 未找到子模型标准化器文件在 {os.path.join(self.model_dir, 'scalers')}")
             
-            # 5. 加载最终标准化器（作为备用）
-            final_scaler_path = os.path.join(self.model_dir, 'final_scaler.joblib')
-            if os.path.exists(final_scaler_path):
-                self.final_scaler = joblib.load(final_scaler_path)
-                log(f"加载最终标准化器: {final_scaler_path}")
+            self.final_scaler = artifacts['final_scaler']
+            if self.final_scaler is not None:
+                log(f"加载最终标准化器: {os.path.join(self.model_dir, 'final_scaler.joblib')}")
             else:
-                log(f"警告: 未找到最终标准化器文件 {final_scaler_path}")
+                log("警告: 未找到最终标准化器文件")
             
-            # 6. 加载权重
-            weights_path = os.path.join(self.model_dir, 'model_weights.npy')
-            if os.path.exists(weights_path):
-                self.model_weights = np.load(weights_path)
-                log(f"加载权重文件: {weights_path}")
+            self.model_weights = artifacts['model_weights']
+            if self.model_weights is not None:
+                log(f"加载权重文件: {os.path.join(self.model_dir, 'model_weights.npy')}")
             else:
                 # 如果没有权重文件，使用均等权重
                 self.model_weights = np.ones(len(self.models)) / len(self.models)
@@ -524,6 +578,13 @@ class CorrectedEnsemblePredictor:
             # 8. 加载特征重要性
             self.load_feature_importance()
             
+            # 9. 加载训练集近邻相似度索引（可选，由similarity_index.py构建）
+            # 按索引文件路径和内容指纹缓存，重跑时不再从磁盘重新加载KD树
+            similarity_path = similarity_index_path(self.model_dir)
+            self.similarity_index = load_similarity_index(similarity_path, artifact_fingerprint(similarity_path))
+            if self.similarity_index is not None:
+                log(f"使用相似度索引: k={self.similarity_index.k}，外推阈值 {self.similarity_index.threshold:.4f}")
+            
             # 验证加载状态
             if len(self.models) > 0:
                 log(f"成功加载 {len(self.models)} 个模型和 {len(self.scalers)} 个子模型标准化器")
@@ -553,19 +614,41 @@ class CorrectedEnsemblePredictor:
             log("警告: 没有训练数据范围信息，跳过范围检查")
             return warnings
         
-        for feature, range_info in self.training_ranges.items():
-            if feature in input_df.columns:
-                value = input_df[feature].iloc[0]
-                # 检查是否超出训练数据的真实范围
-                if value < range_info['min'] or value > range_info['max']:
-                    warning = f"{feature}: {value:.2f} (超出训练范围 {range_info['min']:.2f} - {range_info['max']:.2f})"
-                    warnings.append(warning)
-                    log(f"警告: {warning}")
+        # 一次向量化比较得到所有特征的越界情况（输入中缺失的特征不判为越界）
+        result = self.domain_checker.check(input_df)
+        warnings = result.warnings(0, decimals=2)
+        for warning in warnings:
+            log(f"警告: {warning}")
         
         return warnings
     
-    def predict(self, input_features, return_individual=False):
-        """使用每个子模型对应的标准化器进行预测"""
+    def get_tier(self, tier="full"):
+        """
+        返回预测档位使用的子模型序号和权重（档位由ensemble_tiers.py写入metadata.json）
+        full或未知档位使用全部子模型和model_weights.npy
+        """
+        tiers = (self.metadata or {}).get('tiers', {})
+        if tier != "full":
+            if tier in tiers:
+                members = [int(i) for i in tiers[tier]['members']]
+                if members and max(members) < len(self.models):
+                    return members, np.asarray(tiers[tier]['weights'], dtype=float)
+                log(f"警告: 档位 {tier} 的子模型序号超出已加载模型数量，使用全部子模型")
+            else:
+                log(f"警告: 元数据中没有档位 {tier}，使用全部子模型")
+        return list(range(len(self.models))), self.model_weights
+    
+    def available_tiers(self):
+        """返回可选的预测档位名称（按子模型数量从少到多，full在最后）"""
+        tiers = (self.metadata or {}).get('tiers', {})
+        names = sorted((name for name in tiers if name != "full"), key=lambda name: len(tiers[name]['members']))
+        return names + ["full"]
+    
+    def predict(self, input_features, return_individual=False, tier="full"):
+        """
+        使用每个子模型对应的标准化器进行预测
+        tier: 预测档位，fast/balanced只运行部分子模型（用于参数扫描），full运行全部子模型
+        """
         try:
             # 验证模型组件
             if not self.model_loaded or not self.models or len(self.models) == 0:
@@ -604,49 +687,55 @@ class CorrectedEnsemblePredictor:
             log(f"预测输入数据: {input_ordered.iloc[0].to_dict()}")
             
             # 使用每个子模型和对应的标准化器进行预测
+            members, tier_weights = self.get_tier(tier)
+            if tier != "full":
+                log(f"使用档位 {tier}: {len(members)} 个子模型 {members}")
             individual_predictions = []
-            all_predictions = np.zeros((input_ordered.shape[0], len(self.models)))
+            all_predictions = np.zeros((input_ordered.shape[0], len(members)))
             
             # 检查标准化器是否足够
             scalers_available = len(self.scalers) > 0
             
-            for i, model in enumerate(self.models):
-                try:
-                    # 使用对应的标准化器（如果可用）
-                    if scalers_available and i < len(self.scalers):
-                        X_scaled = self.scalers[i].transform(input_ordered)
-                        log(f"模型 {i} 使用对应的标准化器")
-                    else:
-                        # 如果没有对应的标准化器，使用最终标准化器
-                        if self.final_scaler:
-                            X_scaled = self.final_scaler.transform(input_ordered)
-                            log(f"模型 {i} 使用最终标准化器")
+            # 整个集成作为一次预测登记线程预算，每个子模型按分配的线程数预测
+            with get_thread_budget().reserve() as thread_count:
+                for col, i in enumerate(members):
+                    model = self.models[i]
+                    try:
+                        # 使用对应的标准化器（如果可用）
+                        if scalers_available and i < len(self.scalers):
+                            X_scaled = self.scalers[i].transform(input_ordered)
+                            log(f"模型 {i} 使用对应的标准化器")
                         else:
-                            # 如果没有任何标准化器可用，则使用原始特征
-                            log(f"警告: 模型 {i} 没有可用的标准化器，使用原始特征")
-                            X_scaled = input_ordered.values
+                            # 如果没有对应的标准化器，使用最终标准化器
+                            if self.final_scaler:
+                                X_scaled = self.final_scaler.transform(input_ordered)
+                                log(f"模型 {i} 使用最终标准化器")
+                            else:
+                                # 如果没有任何标准化器可用，则使用原始特征
+                                log(f"警告: 模型 {i} 没有可用的标准化器，使用原始特征")
+                                X_scaled = input_ordered.values
                     
-                    # 执行预测并确保返回的是标量值 (修复 invalid index to scalar variable 错误)
-                    pred = model.predict(X_scaled)
-                    # 确保预测值是标量，不是数组
-                    pred_value = float(pred[0]) if isinstance(pred, (np.ndarray, list)) else float(pred)
-                    all_predictions[:, i] = pred_value
-                    individual_predictions.append(pred_value)
-                    log(f"模型 {i} 预测结果: {pred_value:.2f}")
-                except Exception as e:
-                    log(f"模型 {i} 预测时出错: {str(e)}")
-                    # 如果某个模型失败，使用其他模型的平均值
-                    if i > 0:
-                        avg_pred = np.mean(all_predictions[:, :i], axis=1)
-                        avg_value = float(avg_pred[0]) if len(avg_pred) > 0 else 0.0
-                        all_predictions[:, i] = avg_value
-                        individual_predictions.append(avg_value)
-                        log(f"模型 {i} 使用之前模型的平均值: {avg_value:.2f}")
+                        # 执行预测并确保返回的是标量值 (修复 invalid index to scalar variable 错误)
+                        pred = predict_with_threads(model, X_scaled, thread_count)
+                        # 确保预测值是标量，不是数组
+                        pred_value = float(pred[0]) if isinstance(pred, (np.ndarray, list)) else float(pred)
+                        all_predictions[:, col] = pred_value
+                        individual_predictions.append(pred_value)
+                        log(f"模型 {i} 预测结果: {pred_value:.2f}")
+                    except Exception as e:
+                        log(f"模型 {i} 预测时出错: {str(e)}")
+                        # 如果某个模型失败，使用其他模型的平均值
+                        if col > 0:
+                            avg_pred = np.mean(all_predictions[:, :col], axis=1)
+                            avg_value = float(avg_pred[0]) if len(avg_pred) > 0 else 0.0
+                            all_predictions[:, col] = avg_value
+                            individual_predictions.append(avg_value)
+                            log(f"模型 {i} 使用之前模型的平均值: {avg_value:.2f}")
             
             # 计算加权平均 - 修复：确保不会出现维度不匹配的问题
-            if len(self.models) > 0:
+            if len(members) > 0:
                 # 确保权重数组维度正确
-                weights = self.model_weights
+                weights = tier_weights
                 if weights.ndim == 1:
                     weights = weights.reshape(1, -1)
                 
@@ -661,7 +750,7 @@ class CorrectedEnsemblePredictor:
                 log(f"{self.target_name}最终加权预测结果: {weighted_pred[0]:.2f}")
             else:
                 weighted_pred = np.array([0.0])
-                log(f"警告: 没有可用模型，返回默认值0")
+                log("警告: 没有可用模型，返回默认值0")
             
             # 计算评估指标 - 动态计算RMSE和R²
             std_dev = np.std(individual_predictions) if len(individual_predictions) > 0 else 0
@@ -705,7 +794,11 @@ class CorrectedEnsemblePredictor:
                 return np.array([0.0])
     
     def get_model_info(self):
-        """获取模型信息摘要"""
+        """获取模型信息摘要（按指纹和加载状态缓存）"""
+        return cached_model_info(self, fingerprint(self.cache_fingerprint, self.model_loaded))
+    
+    def build_model_info(self):
+        """构建模型信息摘要"""
         info = {
             "模型类型": "CatBoost集成模型",
             "模型数量": len(self.models),
@@ -751,6 +844,24 @@ else:
 model_info_html += "</div>"
 st.sidebar.markdown(model_info_html, unsafe_allow_html=True)
 
+# 预测档位选择（metadata.json中有ensemble_tiers.py生成的档位时显示）
+tier_options = predictor.available_tiers()
+if len(tier_options) > 1:
+    tier_info = predictor.metadata.get('tiers', {})
+    selected_tier = st.sidebar.radio(
+        "预测档位",
+        tier_options,
+        index=len(tier_options) - 1,
+        key="prediction_tier",
+        format_func=lambda name: (
+            f"{name}（{len(tier_info[name]['members'])} 个子模型，约 {tier_info[name]['latency_ms']:.1f} ms）"
+            if name in tier_info else name
+        ),
+        help="fast/balanced只运行部分子模型，适合参数扫描；最终报告请使用full"
+    )
+else:
+    selected_tier = "full"
+
 # 性能指标显示区域（在预测后动态更新）
 performance_container = st.sidebar.container()
 
@@ -933,9 +1044,14 @@ with col1:
         warnings = predictor.check_input_range(input_df)
         st.session_state.warnings = warnings
         
+        # 训练集近邻相似度
+        st.session_state.similarity_info = None
+        if predictor.similarity_index is not None:
+            st.session_state.similarity_info = predictor.similarity_index.query(input_df).iloc[0].to_dict()
+        
         # 执行预测
         try:
-            result, individual_preds = predictor.predict(input_df, return_individual=True)
+            result, individual_preds = predictor.predict(input_df, return_individual=True, tier=selected_tier)
             # 确保结果不为空，修复预测值不显示的问题
             if result is not None and len(result) > 0:
                 st.session_state.prediction_result = float(result[0])
@@ -984,6 +1100,20 @@ if st.session_state.prediction_result is not None:
         warnings_html += "</ul><p>预测结果可能不太可靠。</p></div>"
         result_container.markdown(warnings_html, unsafe_allow_html=True)
     
+    # 显示训练集相似度
+    similarity_info = st.session_state.get("similarity_info")
+    if similarity_info and not np.isnan(similarity_info["knn_distance"]):
+        if similarity_info["extrapolation"]:
+            result_container.markdown(
+                f"<div class='warning-box'><b>⚠️ 外推提示：</b> 输入点位于训练数据稀疏区域"
+                f"（近邻距离 {similarity_info['knn_distance']:.3f}，相似度 {similarity_info['similarity']:.2f}），"
+                f"预测结果可能不太可靠。</div>",
+                unsafe_allow_html=True
+            )
+        else:
+            result_container.caption(f"训练集相似度: {similarity_info['similarity']:.2f}"
+                                     f"（k近邻平均距离 {similarity_info['knn_distance']:.3f}）")
+    
     # 标准化器状态
     if len(predictor.scalers) < len(predictor.models):
         result_container.markdown(
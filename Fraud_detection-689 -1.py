@@ -10,13 +10,29 @@ import pandas as pd
 import numpy as np
 import os
 import glob
-import joblib
+import time
 import traceback
 from datetime import datetime
 import requests
-import tempfile
 import warnings
 
+from batch_jobs import BatchJobManager, read_input_table
+from domain_check import DomainChecker
+from similarity_index import SimilarityIndex
+from model_registry import ModelRegistry, report_duplicates
+from download_cache import DownloadCache
+from partial_dependence import PartialDependence, make_grid
+from prediction_store import PredictionStore
+from result_export import EXPORT_FORMATS, available_formats, deferred_download
+from float32_inference import make_array_predict, predict_array
+from feature_schema import compile_schema
+from thread_budget import ThreadBudget
+from degraded_mode import DegradedTables
+from distill_student import load_student, student_paths
+from multioutput_forest import is_native_multioutput, native_paths
+from fingerprint import artifact_fingerprint, code_fingerprint, fingerprint
+from static_assets import asset_url, background_image_declarations
+
 # 抑制 scikit-learn 版本兼容性警告
 warnings.filterwarnings('ignore', category=UserWarning, module='sklearn')
 warnings.filterwarnings('ignore', message='.*version.*when using version.*')
@@ -35,8 +51,9 @@ except Exception as e:
     CATBOOST_AVAILABLE = False
     print(f"⚠️ CatBoost import error - CAT models will be disabled. Error: {e}")
 
-# 清除缓存，强制重新渲染
-st.cache_data.clear()
+# 记录本次脚本重跑的开始时间，用于统计重跑耗时
+_rerun_start = time.perf_counter()
+
 
 # 页面设置
 st.set_page_config(
@@ -60,7 +77,7 @@ st.markdown(
 
     /* 主应用背景 */
     .stApp {
-        background-image: url('https://raw.githubusercontent.com/HwyzsyHwy/APP-/main/背景.png');
+        """ + background_image_declarations("背景.png") + """
         background-size: cover;
         background-position: center;
         background-repeat: no-repeat;
@@ -572,9 +589,9 @@ if 'current_page' not in st.session_state:
 # 创建侧边栏导航
 with st.sidebar:
     # 用户信息区域
-    st.markdown("""
+    st.markdown(f"""
     <div class="user-info">
-        <img src="https://raw.githubusercontent.com/HwyzsyHwy/APP-/main/用户.png" class="user-avatar" alt="用户头像">
+        <img src="{asset_url('用户.png', width=128)}" class="user-avatar" alt="用户头像">
         <p class="user-name">用户：wy1122</p>
     </div>
     """, unsafe_allow_html=True)
@@ -586,30 +603,16 @@ with st.sidebar:
         # 创建导航按钮 - 使用更直接的方法处理状态
         current_page = st.session_state.current_page
 
-        # 预测模型按钮
-        if st.button("预测模型", key="nav_predict", use_container_width=True, type="primary" if current_page == "预测模型" else "secondary"):
-            st.session_state.current_page = "预测模型"
-            st.rerun()
-
-        # 执行日志按钮
-        if st.button("执行日志", key="nav_log", use_container_width=True, type="primary" if current_page == "执行日志" else "secondary"):
-            st.session_state.current_page = "执行日志"
-            st.rerun()
-
-        # 模型信息按钮
-        if st.button("模型信息", key="nav_info", use_container_width=True, type="primary" if current_page == "模型信息" else "secondary"):
-            st.session_state.current_page = "模型信息"
-            st.rerun()
+        def switch_page(page):
+            """导航按钮回调 - 在重跑前切换页面，避免再调用st.rerun()造成二次重跑"""
+            st.session_state.current_page = page
 
-        # 技术说明按钮
-        if st.button("技术说明", key="nav_tech", use_container_width=True, type="primary" if current_page == "技术说明" else "secondary"):
-            st.session_state.current_page = "技术说明"
-            st.rerun()
-
-        # 使用指南按钮
-        if st.button("使用指南", key="nav_guide", use_container_width=True, type="primary" if current_page == "使用指南" else "secondary"):
-            st.session_state.current_page = "使用指南"
-            st.rerun()
+        # 预测模型、预测历史、执行日志、模型信息、技术说明、使用指南按钮
+        for page, nav_key in [("预测模型", "nav_predict"), ("预测历史", "nav_history"), ("执行日志", "nav_log"),
+                              ("模型信息", "nav_info"), ("技术说明", "nav_tech"), ("使用指南", "nav_guide")]:
+            st.button(page, key=nav_key, use_container_width=True,
+                      type="primary" if current_page == page else "secondary",
+                      on_click=switch_page, args=(page,))
 
 # 创建日志区域（仅在执行日志页面显示）
 if st.session_state.current_page == "执行日志":
@@ -639,6 +642,15 @@ def log(message):
             unsafe_allow_html=True
         )
 
+def record_rerun_timing(kind, seconds):
+    """记录一次重跑（整页或片段）的耗时，在执行日志页面汇总显示"""
+    if 'rerun_timings' not in st.session_state:
+        st.session_state.rerun_timings = []
+    st.session_state.rerun_timings.append((kind, seconds * 1000.0))
+    # 只保留最近的200条耗时记录
+    if len(st.session_state.rerun_timings) > 200:
+        st.session_state.rerun_timings = st.session_state.rerun_timings[-200:]
+
 # 记录启动日志
 log("应用启动 - 重金属预测模型")
 log("目标变量：Cd, Pb, Hg")
@@ -653,10 +665,6 @@ if 'selected_target' not in st.session_state:
     st.session_state.selected_target = "All"  # 默认预测所有目标
     log(f"初始化选定目标: {st.session_state.selected_target}")
 
-# 添加模型缓存 - 避免重复加载相同模型
-if 'model_cache' not in st.session_state:
-    st.session_state.model_cache = {}
-    
 # 只在预测模型页面显示标题和模型选择器
 if st.session_state.current_page == "预测模型":
     # 简洁的Streamlit样式标题 - 调整间距平衡
@@ -803,35 +811,28 @@ if st.session_state.current_page == "预测模型":
     # 模型选择卡片 - 根据训练代码的模型类型
     col1, col2, col3 = st.columns(3)
 
+    def select_model_category(model_category):
+        """模型分类卡片回调 - 分类变化会更换预测器，因此保留整页重跑，但不再额外调用st.rerun()"""
+        if st.session_state.selected_model != model_category:
+            st.session_state.selected_model = model_category
+            st.session_state.prediction_result = None
+            st.session_state.warnings = []
+            log(f"切换到模型: {model_category}")
+
     with col1:
-        if st.button("🎯\n\nSingle Target", key="single_card", use_container_width=True,
-                    type="primary" if st.session_state.selected_model == "Single Target" else "secondary"):
-            if st.session_state.selected_model != "Single Target":
-                st.session_state.selected_model = "Single Target"
-                st.session_state.prediction_result = None
-                st.session_state.warnings = []
-                log(f"切换到模型: {st.session_state.selected_model}")
-                st.rerun()
+        st.button("🎯\n\nSingle Target", key="single_card", use_container_width=True,
+                  type="primary" if st.session_state.selected_model == "Single Target" else "secondary",
+                  on_click=select_model_category, args=("Single Target",))
 
     with col2:
-        if st.button("🎯🎯🎯\n\nMulti Target", key="multi_card", use_container_width=True,
-                    type="primary" if st.session_state.selected_model == "Multi Target" else "secondary"):
-            if st.session_state.selected_model != "Multi Target":
-                st.session_state.selected_model = "Multi Target"
-                st.session_state.prediction_result = None
-                st.session_state.warnings = []
-                log(f"切换到模型: {st.session_state.selected_model}")
-                st.rerun()
+        st.button("🎯🎯🎯\n\nMulti Target", key="multi_card", use_container_width=True,
+                  type="primary" if st.session_state.selected_model == "Multi Target" else "secondary",
+                  on_click=select_model_category, args=("Multi Target",))
 
     with col3:
-        if st.button("🔗\n\nEnsemble", key="ensemble_card", use_container_width=True,
-                    type="primary" if st.session_state.selected_model == "Ensemble" else "secondary"):
-            if st.session_state.selected_model != "Ensemble":
-                st.session_state.selected_model = "Ensemble"
-                st.session_state.prediction_result = None
-                st.session_state.warnings = []
-                log(f"切换到模型: {st.session_state.selected_model}")
-                st.rerun()
+        st.button("🔗\n\nEnsemble", key="ensemble_card", use_container_width=True,
+                  type="primary" if st.session_state.selected_model == "Ensemble" else "secondary",
+                  on_click=select_model_category, args=("Ensemble",))
 
     # 添加CSS和JavaScript来强制改变按钮颜色
     selected_model = st.session_state.selected_model
@@ -1445,8 +1446,17 @@ if st.session_state.current_page == "预测模型":
 
 
 
+@st.cache_resource
+def get_download_cache():
+    """进程级共享的下载缓存：按内容哈希保存，内容相同的模型文件只下载一次"""
+    return DownloadCache()
+
 def download_model_from_github(model_filename):
-    """从GitHub下载模型文件"""
+    """从GitHub下载模型文件（经内容哈希缓存，清单中内容相同的文件复用已下载的副本）"""
+    return get_download_cache().fetch(model_filename, download_model_bytes)
+
+def download_model_bytes(model_filename):
+    """依次尝试GitHub地址下载模型文件，返回文件内容，全部失败时返回None"""
     github_urls = [
         f"https://raw.githubusercontent.com/HwyzsyHwy/APP-/main/{model_filename}",
         f"https://github.com/HwyzsyHwy/APP-/raw/main/{model_filename}",
@@ -1466,15 +1476,8 @@ def download_model_from_github(model_filename):
                 log(f"下载的文件太小 ({len(response.content)} bytes)，可能不是有效的模型文件")
                 continue
 
-            # 创建临时文件保存模型
-            temp_dir = tempfile.gettempdir()
-            local_model_path = os.path.join(temp_dir, model_filename)
-
-            with open(local_model_path, 'wb') as f:
-                f.write(response.content)
-
-            log(f"模型下载成功: {local_model_path} ({len(response.content)} bytes)")
-            return local_model_path
+            log(f"模型下载成功: {model_filename} ({len(response.content)} bytes)")
+            return response.content
 
         except requests.exceptions.Timeout:
             log(f"下载超时 (URL {i+1}): {model_url}")
@@ -1487,206 +1490,168 @@ def download_model_from_github(model_filename):
             if e.response.status_code == 404:
                 log(f"文件不存在 (404): {model_filename}")
             elif e.response.status_code == 403:
-                log(f"访问被拒绝 (403): 可能是私有仓库或权限问题")
+                log("访问被拒绝 (403): 可能是私有仓库或权限问题")
             continue
         except requests.exceptions.RequestException as e:
             log(f"请求异常 (URL {i+1}): {str(e)}")
             continue
         except Exception as e:
-            log(f"保存模型文件失败 (URL {i+1}): {str(e)}")
+            log(f"下载模型文件失败 (URL {i+1}): {str(e)}")
             continue
 
     log(f"所有下载尝试都失败了: {model_filename}")
     return None
 
+def verify_heavy_metal_model(model):
+    """验证模型：必须有predict方法，且对一条测试样本能输出有限的预测值"""
+    if not hasattr(model, 'predict'):
+        raise ValueError("加载的对象不是有效的模型（缺少predict方法）")
+    test_features = np.array([[6.5, -1.0, 300.0, 15.0, 15.0, 35.0, 4.5]])
+    test_prediction = np.asarray(model.predict(test_features), dtype=float)
+    if not np.all(np.isfinite(test_prediction)):
+        raise ValueError(f"模型测试预测输出无效: {test_prediction}")
+
+@st.cache_resource
+def get_model_registry():
+    """进程级共享的模型注册表：所有会话共用已加载的模型，模型文件更新后在后台热替换"""
+    registry = ModelRegistry(verifier=verify_heavy_metal_model, poll_interval=5.0)
+    # 启动时报告内容相同的模型文件（注册表按内容哈希让它们共用同一个已加载对象）
+    report_duplicates(glob.glob("*.joblib"))
+    registry.start_watching()
+    return registry
+
+@st.cache_resource
+def get_thread_budget():
+    """进程级共享的线程预算：并发会话按当前并发数分配CatBoost/XGBoost/BLAS线程，避免线程超订"""
+    return ThreadBudget.from_env()
+
+# 缓存按模型文件和预测器代码的指纹失效（见fingerprint.py），不再在每次重跑时清空整个缓存
+@st.cache_data
+def cached_model_info(_predictor, cache_fingerprint):
+    """模型信息摘要（所有会话共享，模型文件或预测器代码变化后重新生成）"""
+    return _predictor.get_model_info()
+
+def model_info_fingerprint(predictor):
+    """模型信息的缓存键：目标、模型文件内容、预测器代码和加载状态"""
+    model_path = getattr(predictor, 'model_path', None)
+    return fingerprint(
+        predictor.target_name, model_path, artifact_fingerprint(model_path),
+        code_fingerprint(type(predictor)), predictor.model_loaded
+    )
+
+# 降级模式预测表由 degraded_mode.py 离线生成（degraded_tables/<模型文件名>.npz）
+@st.cache_resource
+def get_degraded_tables():
+    """进程级共享的降级模式预测表（按模型文件名懒加载）"""
+    return DegradedTables()
+
+def degraded_table_for(predictor, default_file=None):
+    """预测器当前模型对应的预测表，没有时返回None"""
+    model_file = getattr(predictor, 'selected_model_file', None) or getattr(predictor, 'model_path', None) or default_file
+    return get_degraded_tables().get(model_file)
+
+def degraded_predict(predictor, features, default_file=None):
+    """
+    模型不可用时从预计算预测表查表（降级模式），没有预测表时返回None
+    查表信息保存在predictor.degraded_info中（每次predict开始时清空），界面据此把结果标注为近似值
+    """
+    table = degraded_table_for(predictor, default_file)
+    if table is None:
+        return None
+    prediction, distance = table.lookup(features)
+    predictor.degraded_info = dict(table.describe(), nearest_distance=float(distance[0]))
+    values = prediction[0]
+    log(f"降级模式: 模型不可用，使用预计算预测表 {table.source} 查表（近似值）: {np.round(values, 4)}")
+    return values if len(values) > 1 else float(values[0])
+
+ENSEMBLE_DEFAULT_FILE = "ensemble_multi.joblib"
+
 class EnsembleModelPredictor:
     """专门的Ensemble模型预测器"""
 
-    def __init__(self):
+    def __init__(self, selected_model_file=None):
+        """
+        参数:
+            selected_model_file: 具体的Ensemble模型文件（如 ensemble_single_Pb.joblib），为None时使用默认模型
+        """
         self.target_name = "Ensemble"
+        self.selected_model_file = selected_model_file
         self.feature_names = ['pH', 'V', 'T', 'LD', 'Ap', 'f', 'SP']
         self.target_cols = ['Cd', 'Pb', 'Hg']
         self.model_loaded = False
         self.pipeline = None
         self.model_path = None
 
+        # 定义训练数据范围（与ModelPredictor保持一致）
+        self.training_ranges = {
+            'pH': {'min': 2.0, 'max': 9.0},
+            'V': {'min': -1.6, 'max': -0.5},
+            'T': {'min': 18.0, 'max': 602.0},
+            'LD': {'min': 8.0, 'max': 23.8},
+            'Ap': {'min': 5.0, 'max': 25.0},
+            'f': {'min': 15.0, 'max': 59.0},
+            'SP': {'min': 4.0, 'max': 5.0}
+        }
+        self.domain_checker = DomainChecker.from_ranges(self.training_ranges, self.feature_names)
+
         # 尝试加载Ensemble模型
         self._load_ensemble_model()
 
     def _load_ensemble_model(self):
-        """加载Ensemble模型"""
+        """加载Ensemble模型（通过共享模型注册表，文件更新后自动热替换）"""
         # 如果指定了特定的模型文件，优先使用
         if hasattr(self, 'selected_model_file') and self.selected_model_file:
-            cache_key = f"Ensemble_{self.selected_model_file}"
-            # 首先尝试从缓存加载
-            if cache_key in st.session_state.model_cache:
-                log(f"从缓存加载指定的Ensemble模型: {self.selected_model_file}")
-                self.pipeline = st.session_state.model_cache[cache_key]
-                self.model_loaded = True
+            if self._load_registered_model(self.selected_model_file):
                 return
 
-            # 尝试加载指定的模型文件
-            if os.path.exists(self.selected_model_file):
-                try:
-                    log(f"从本地加载指定的Ensemble模型: {self.selected_model_file}")
-
-                    # 使用警告抑制来避免版本兼容性警告
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")
-                        self.pipeline = joblib.load(self.selected_model_file)
-
-                    self.model_path = self.selected_model_file
-
-                    # 验证模型结构并测试预测
-                    if hasattr(self.pipeline, 'predict'):
-                        # 测试模型预测功能
-                        test_features = np.array([[6.5, -1.0, 300.0, 15.0, 15.0, 35.0, 4.5]])
-                        test_prediction = self.pipeline.predict(test_features)
-
-                        log(f"指定Ensemble模型加载成功: {type(self.pipeline)}, 输出形状: {test_prediction.shape}")
-                        # 缓存模型
-                        st.session_state.model_cache[cache_key] = self.pipeline
-                        self.model_loaded = True
-                        return
-                    else:
-                        log(f"指定模型文件结构验证失败: {self.selected_model_file}")
-                except Exception as e:
-                    log(f"指定模型文件加载失败 {self.selected_model_file}: {str(e)}")
-
             # 尝试下载指定的模型文件
             downloaded_path = download_model_from_github(self.selected_model_file)
-            if downloaded_path and os.path.exists(downloaded_path):
-                try:
-                    log(f"加载下载的指定Ensemble模型: {downloaded_path}")
-                    self.pipeline = joblib.load(downloaded_path)
-                    self.model_path = downloaded_path
-
-                    # 验证模型结构
-                    if hasattr(self.pipeline, 'predict'):
-                        log(f"下载的指定Ensemble模型加载成功: {type(self.pipeline)}")
-                        # 缓存模型
-                        st.session_state.model_cache[cache_key] = self.pipeline
-                        self.model_loaded = True
-                        return
-                    else:
-                        log(f"下载的指定模型文件结构验证失败: {downloaded_path}")
-                except Exception as e:
-                    log(f"下载的指定模型文件加载失败 {downloaded_path}: {str(e)}")
+            if downloaded_path and self._load_registered_model(downloaded_path):
+                return
 
         # 如果没有指定模型文件或加载失败，使用默认逻辑
-        # 首先尝试从缓存加载
-        if "Ensemble" in st.session_state.model_cache:
-            log("从缓存加载Ensemble模型")
-            self.pipeline = st.session_state.model_cache["Ensemble"]
-            self.model_loaded = True
-            return
-
         # 检查本地是否有模型文件
-        local_files = ["ensemble_multi.joblib", "ensemble_model.joblib", "ensemble.joblib"]
+        local_files = [ENSEMBLE_DEFAULT_FILE, "ensemble_model.joblib", "ensemble.joblib"]
         for local_file in local_files:
-            if os.path.exists(local_file):
-                try:
-                    log(f"从本地加载Ensemble模型: {local_file}")
-
-                    # 使用警告抑制来避免版本兼容性警告
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")
-                        self.pipeline = joblib.load(local_file)
-
-                    self.model_path = local_file
-
-                    # 验证模型结构并测试预测
-                    if hasattr(self.pipeline, 'predict'):
-                        # 测试模型预测功能
-                        test_features = np.array([[6.5, -1.0, 300.0, 15.0, 15.0, 35.0, 4.5]])
-                        test_prediction = self.pipeline.predict(test_features)
-
-                        log(f"Ensemble模型加载成功: {type(self.pipeline)}, 输出形状: {test_prediction.shape}")
-                        # 缓存模型
-                        st.session_state.model_cache["Ensemble"] = self.pipeline
-                        self.model_loaded = True
-                        return
-                    else:
-                        log(f"本地模型文件结构验证失败: {local_file}")
-                except Exception as e:
-                    log(f"本地模型文件加载失败 {local_file}: {str(e)}")
-                    continue
+            if self._load_registered_model(local_file):
+                return
 
-        # 尝试下载ensemble_multi.joblib
-        model_file = "ensemble_multi.joblib"
+        # 尝试下载ensemble_multi.joblib（下载缓存中已有相同内容时直接复用）
+        model_file = ENSEMBLE_DEFAULT_FILE
         downloaded_path = download_model_from_github(model_file)
+        if downloaded_path and self._load_registered_model(downloaded_path):
+            return
 
-        if downloaded_path and os.path.exists(downloaded_path):
-            try:
-                log(f"加载下载的Ensemble模型: {downloaded_path}")
-                self.pipeline = joblib.load(downloaded_path)
-                self.model_path = downloaded_path
-
-                # 验证模型结构
-                if hasattr(self.pipeline, 'predict'):
-                    log(f"Ensemble模型加载成功: {type(self.pipeline)}")
-                    # 缓存模型
-                    st.session_state.model_cache["Ensemble"] = self.pipeline
-                    self.model_loaded = True
-                else:
-                    log("下载的Ensemble模型结构验证失败")
+        # 不在请求时训练备用模型：预测时使用预计算预测表（降级模式）
+        log("Ensemble模型下载失败，预测将使用降级模式（预计算预测表）")
 
-            except Exception as e:
-                log(f"下载的Ensemble模型加载失败: {str(e)}")
-                self.model_loaded = False
-        else:
-            log("Ensemble模型下载失败，尝试创建备用模型")
-            self._create_fallback_model()
-
-    def _create_fallback_model(self):
-        """创建备用的简单模型"""
+    def _load_registered_model(self, model_path):
+        """从共享模型注册表获取模型，首次使用时加载并验证"""
+        if not os.path.exists(model_path):
+            return False
         try:
-            from sklearn.ensemble import RandomForestRegressor
-            from sklearn.multioutput import MultiOutputRegressor
-            from sklearn.pipeline import Pipeline
-            from sklearn.preprocessing import StandardScaler
-
-            log("创建备用Ensemble模型")
-
-            # 创建简单的随机森林模型
-            rf_model = MultiOutputRegressor(RandomForestRegressor(
-                n_estimators=50,
-                random_state=42,
-                max_depth=10
-            ))
-
-            # 创建管道
-            self.pipeline = Pipeline([
-                ('scaler', StandardScaler()),
-                ('regressor', rf_model)
-            ])
-
-            # 使用默认参数训练一个简单模型
-            import numpy as np
-
-            # 创建一些示例数据进行训练
-            X_sample = np.random.rand(100, 7)  # 7个特征
-            y_sample = np.random.rand(100, 3)  # 3个目标
-
-            self.pipeline.fit(X_sample, y_sample)
-
-            log("备用Ensemble模型创建成功")
-            # 缓存模型
-            st.session_state.model_cache["Ensemble"] = self.pipeline
+            self.pipeline = get_model_registry().load(model_path)
+            self.model_path = model_path
             self.model_loaded = True
-
+            log(f"Ensemble模型加载成功: {model_path} ({type(self.pipeline).__name__})")
+            return True
         except Exception as e:
-            log(f"创建备用模型失败: {str(e)}")
-            self.model_loaded = False
+            log(f"Ensemble模型文件加载失败 {model_path}: {str(e)}")
+            return False
 
     def predict(self, features):
         """Ensemble模型预测"""
+        self.degraded_info = None
         if not self.model_loaded or self.pipeline is None:
             log("Ensemble模型未加载，尝试重新加载...")
             self._load_ensemble_model()
             if not self.model_loaded:
                 log("Ensemble模型重新加载失败")
-                return None
+                return degraded_predict(self, features, ENSEMBLE_DEFAULT_FILE)
+
+        # 使用注册表中的当前版本（模型文件热更新后自动切换）
+        if self.model_path:
+            self.pipeline = get_model_registry().get(self.model_path, self.pipeline)
 
         try:
             # 验证输入特征
@@ -1714,7 +1679,7 @@ class EnsembleModelPredictor:
             log(f"Ensemble预测输入: {features_df.values}")
 
             # 执行预测
-            prediction = self.pipeline.predict(features_df)
+            prediction = get_thread_budget().predict(self.pipeline, features_df)
 
             log(f"Ensemble预测输出: {prediction}")
             log(f"预测结果形状: {prediction.shape}")
@@ -1740,7 +1705,7 @@ class EnsembleModelPredictor:
             log(f"Ensemble预测失败: {str(e)}")
             log(f"错误类型: {type(e).__name__}")
             log(traceback.format_exc())
-            return None
+            return degraded_predict(self, features, ENSEMBLE_DEFAULT_FILE)
 
     def get_model_info(self):
         """获取Ensemble模型信息"""
@@ -1772,28 +1737,10 @@ class EnsembleModelPredictor:
         return info
 
     def check_input_range(self, features):
-        """检查输入值是否在训练数据范围内"""
-        warnings = []
-
-        # 定义训练数据范围（与ModelPredictor保持一致）
-        training_ranges = {
-            'pH': {'min': 2.0, 'max': 9.0},
-            'V': {'min': -1.6, 'max': -0.5},
-            'T': {'min': 18.0, 'max': 602.0},
-            'LD': {'min': 8.0, 'max': 23.8},
-            'Ap': {'min': 5.0, 'max': 25.0},
-            'f': {'min': 15.0, 'max': 59.0},
-            'SP': {'min': 4.0, 'max': 5.0}
-        }
-
-        for feature, value in features.items():
-            range_info = training_ranges.get(feature)
-
-            if range_info:
-                if value < range_info['min'] or value > range_info['max']:
-                    warning = f"{feature}: {value:.3f} (超出训练范围 {range_info['min']:.3f} - {range_info['max']:.3f})"
-                    warnings.append(warning)
-                    log(f"警告: {warning}")
+        """检查输入值是否在训练数据范围内（向量化适用域检查）"""
+        warnings = self.domain_checker.check(features).warnings(0, decimals=3)
+        for warning in warnings:
+            log(f"警告: {warning}")
 
         return warnings
 
@@ -1838,6 +1785,20 @@ class ModelPredictor:
             # 所有特征名称保持一致，无需映射
         }
 
+        # 由训练范围构建向量化适用域检查器
+        self.domain_checker = DomainChecker.from_ranges(self.training_ranges, self.feature_names)
+
+        # 特征映射和缺失特征默认值（训练数据均值）预编译为特征模式，进程内只编译一次
+        self.feature_schema = compile_schema(self.feature_names, self.ui_to_model_mapping, {
+            'pH': 4.913793,
+            'V': -1.158621,
+            'T': 264.666667,
+            'LD': 12.579310,
+            'Ap': 19.942529,
+            'f': 30.954023,
+            'SP': 4.252874
+        })
+
         self.last_features = {}  # 存储上次的特征值
         self.last_result = None  # 存储上次的预测结果
 
@@ -1853,17 +1814,14 @@ class ModelPredictor:
                 self._load_pipeline()
     
     def _get_cached_model(self):
-        """从缓存中获取模型"""
-        # 尝试使用更具体的缓存键
+        """从共享模型注册表中获取已加载的模型"""
         cache_key = f"{self.target_name}_{getattr(self, 'selected_model_file', 'default')}"
-        if cache_key in st.session_state.model_cache:
-            log(f"从缓存加载{self.target_name}模型: {cache_key}")
-            return st.session_state.model_cache[cache_key]
-
-        # 回退到旧的缓存键
-        if self.target_name in st.session_state.model_cache:
-            log(f"从缓存加载{self.target_name}模型 (旧键)")
-            return st.session_state.model_cache[self.target_name]
+        registry = get_model_registry()
+        model_path = registry.resolve(cache_key)
+        if model_path:
+            log(f"从模型注册表获取{self.target_name}模型: {cache_key}")
+            self.model_path = model_path
+            return registry.get(model_path)
         return None
         
     def _find_model_file(self):
@@ -2056,10 +2014,9 @@ class ModelPredictor:
         try:
             log(f"加载Pipeline模型: {self.model_path}")
 
-            # 使用警告抑制来避免版本兼容性警告
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                self.pipeline = joblib.load(self.model_path)
+            # 通过共享模型注册表加载（已加载时直接复用，模型文件更新后自动热替换）
+            cache_key = f"{self.target_name}_{getattr(self, 'selected_model_file', 'default')}"
+            self.pipeline = get_model_registry().load(self.model_path, alias=cache_key)
 
             # 验证Pipeline结构
             if hasattr(self.pipeline, 'predict'):
@@ -2090,10 +2047,7 @@ class ModelPredictor:
                     log(f"模型测试预测成功，输出形状: {test_prediction.shape}")
 
                     self.model_loaded = True
-                    # 将模型保存到缓存中
-                    cache_key = f"{self.target_name}_{getattr(self, 'selected_model_file', 'default')}"
-                    st.session_state.model_cache[cache_key] = self.pipeline
-                    log(f"✅ {self.target_name}模型加载成功并缓存: {cache_key}")
+                    log(f"✅ {self.target_name}模型加载成功并注册: {cache_key}")
                     return True
 
                 except Exception as pred_error:
@@ -2110,61 +2064,25 @@ class ModelPredictor:
             return False
     
     def check_input_range(self, features):
-        """检查输入值是否在训练数据范围内"""
-        warnings = []
-        
-        for feature, value in features.items():
-            # 获取映射后的特征名
-            mapped_feature = self.ui_to_model_mapping.get(feature, feature)
-            range_info = self.training_ranges.get(mapped_feature)
-            
-            if range_info:
-                if value < range_info['min'] or value > range_info['max']:
-                    warning = f"{feature}: {value:.3f} (超出训练范围 {range_info['min']:.3f} - {range_info['max']:.3f})"
-                    warnings.append(warning)
-                    log(f"警告: {warning}")
+        """检查输入值是否在训练数据范围内（向量化适用域检查）"""
+        result = self.domain_checker.check(features, name_mapping=self.ui_to_model_mapping)
+        model_to_ui = {model: ui for ui, model in self.ui_to_model_mapping.items() if ui in features}
+        warnings = result.warnings(0, decimals=3, display_names=model_to_ui)
+        for warning in warnings:
+            log(f"警告: {warning}")
         
         return warnings
     
     def _prepare_features(self, features):
-        """准备特征，确保顺序与训练时一致"""
-        # 创建特征字典，按训练时的顺序
-        model_features = {}
-        
-        # 首先将UI特征映射到模型特征名称
-        for ui_feature, value in features.items():
-            model_feature = self.ui_to_model_mapping.get(ui_feature, ui_feature)
-            if model_feature in self.feature_names:
-                model_features[model_feature] = value
-                if ui_feature != model_feature:
-                    log(f"特征映射: '{ui_feature}' -> '{model_feature}'")
-        
-        # 确保所有特征都存在，缺失的设为默认值（根据训练数据的均值）
-        feature_defaults = {
-            'pH': 4.913793,
-            'V': -1.158621,
-            'T': 264.666667,
-            'LD': 12.579310,
-            'Ap': 19.942529,
-            'f': 30.954023,
-            'SP': 4.252874
-        }
-        
-        for feature in self.feature_names:
-            if feature not in model_features:
-                default_value = feature_defaults.get(feature, 0.0)
-                model_features[feature] = default_value
-                log(f"警告: 特征 '{feature}' 缺失，设为默认值: {default_value}")
-        
-        # 创建DataFrame并按照正确顺序排列列
-        df = pd.DataFrame([model_features])
-        df = df[self.feature_names]  # 确保列顺序与训练时一致
-        
-        log(f"准备好的特征DataFrame形状: {df.shape}, 列: {list(df.columns)}")
-        return df
+        """按预编译的特征模式把输入整理为训练时顺序的C连续特征矩阵（不构建DataFrame）"""
+        for feature in self.feature_schema.missing(features.keys()):
+            default_value = self.feature_schema.default_row[self.feature_schema.position[feature]]
+            log(f"警告: 特征 '{feature}' 缺失，设为默认值: {default_value}")
+        return self.feature_schema.transform(features)
     
     def predict(self, features):
         """预测方法 - 使用Pipeline进行预测"""
+        self.degraded_info = None
         # 检查输入是否有变化
         features_changed = False
         if self.last_features:
@@ -2185,20 +2103,25 @@ class ModelPredictor:
         
         # 准备特征数据
         log(f"开始准备{len(features)}个特征数据进行预测")
-        features_df = self._prepare_features(features)
+        features_matrix = self._prepare_features(features)
+        
+        # 使用注册表中的当前版本（模型文件热更新后自动切换）
+        if self.model_path:
+            self.pipeline = get_model_registry().get(self.model_path, self.pipeline)
         
         # 使用Pipeline进行预测
         if self.model_loaded and self.pipeline is not None:
             try:
-                log(f"使用Pipeline进行预测（包含RobustScaler预处理）")
+                log("使用Pipeline进行预测（包含RobustScaler预处理）")
                 log(f"模型类型: {self.target_name}, 具体目标: {getattr(self, 'specific_target', 'None')}")
                 log(f"模型文件: {getattr(self, 'selected_model_file', 'None')}")
                 log(f"Pipeline类型: {type(self.pipeline)}")
-                log(f"输入特征形状: {features_df.shape}")
-                log(f"输入特征值: {features_df.values[0]}")
+                log(f"输入特征形状: {features_matrix.shape}")
+                log(f"输入特征值: {features_matrix[0]}")
 
-                # Pipeline会自动进行预处理（RobustScaler）然后预测
-                prediction = self.pipeline.predict(features_df)
+                # 逐步执行Pipeline（RobustScaler预处理）然后按线程预算预测
+                with get_thread_budget().reserve() as thread_count:
+                    prediction = predict_array(self.pipeline, features_matrix, thread_count)
                 log(f"原始预测输出: {prediction}")
                 log(f"预测输出形状: {prediction.shape}")
 
@@ -2233,7 +2156,8 @@ class ModelPredictor:
                 # 尝试重新加载模型
                 if self._find_model_file() and self._load_pipeline():
                     try:
-                        prediction = self.pipeline.predict(features_df)
+                        with get_thread_budget().reserve() as thread_count:
+                            prediction = predict_array(self.pipeline, features_matrix, thread_count)
                         if len(prediction.shape) > 1 and prediction.shape[1] > 1:
                             result = prediction[0]
                         else:
@@ -2248,8 +2172,11 @@ class ModelPredictor:
                     except Exception as new_e:
                         log(f"重新加载后预测仍然失败: {str(new_e)}")
         
-        # 如果到这里，说明预测失败
+        # 如果到这里，说明预测失败；有预计算预测表时返回近似值（降级模式）
         log("所有预测尝试都失败")
+        result = degraded_predict(self, features)
+        if result is not None:
+            return result
         raise ValueError(f"模型预测失败。请确保模型文件存在且格式正确。当前模型: {self.target_name}")
     
     def get_model_info(self):
@@ -2265,12 +2192,21 @@ class ModelPredictor:
             pipeline_steps = list(self.pipeline.named_steps.keys())
             info["Pipeline组件"] = " → ".join(pipeline_steps)
             
+            info["模型类型"] = f"{self.target_name} Pipeline ({' + '.join(type(step).__name__ for step in self.pipeline.named_steps.values())})"
+            
             # 如果有模型组件，显示其参数
             if 'model' in self.pipeline.named_steps:
                 model = self.pipeline.named_steps['model']
                 model_type = type(model).__name__
                 info["回归器类型"] = model_type
                 
+                # 多输出方式：MultiOutputRegressor每个目标一个模型，原生多输出森林每行只遍历一次
+                if model_type == "MultiOutputRegressor":
+                    info["多输出方式"] = f"每个目标一个模型（{len(model.estimators_)}个）"
+                    model = model.estimators_[0]
+                elif is_native_multioutput(model):
+                    info["多输出方式"] = f"原生多输出（{model.n_outputs_}个目标共用一片森林）"
+                
                 # 显示部分关键超参数
                 if hasattr(model, 'n_estimators'):
                     info["树的数量"] = model.n_estimators
@@ -2281,6 +2217,66 @@ class ModelPredictor:
                     
         return info
 
+def create_predictor_for_model(model_category, model_info):
+    """根据模型分类和具体模型信息创建预测器（用于切换具体模型和批量预测）"""
+    current_model_key = f"{model_category}_{model_info['name']}"
+    if model_category == "Ensemble":
+        # 模型文件在构造时传入，加载的就是所选的具体模型而不是默认的ensemble_multi.joblib
+        new_predictor = EnsembleModelPredictor(selected_model_file=model_info["file"])
+        new_predictor.current_model_key = current_model_key
+        return new_predictor
+
+    # 对于Single Target和Multi Target模型，需要正确设置目标名称
+    target_name = model_info.get("target", "All")
+    new_predictor = ModelPredictor(target_model=model_category)
+    new_predictor.current_model_key = current_model_key
+    new_predictor.selected_model_file = model_info["file"]
+    new_predictor.specific_target = target_name  # 设置具体目标
+
+    # 强制重新加载模型
+    new_predictor.model_loaded = False
+    new_predictor.pipeline = None
+
+    # 重新查找模型文件（现在selected_model_file已经设置）
+    new_predictor.model_path = new_predictor._find_model_file()
+    if new_predictor.model_path:
+        new_predictor._load_pipeline()
+
+    log(f"设置模型目标: {target_name}, 模型文件: {model_info['file']}")
+    log("强制重新加载模型以确保使用正确的模型文件")
+    return new_predictor
+
+@st.cache_resource
+def get_batch_job_manager():
+    """进程级共享的批量预测任务管理器，任务状态不随会话重跑丢失"""
+    return BatchJobManager(max_workers=2)
+
+@st.cache_resource
+def get_partial_dependence():
+    """进程级共享的PDP/ICE计算器，结果按模型哈希、特征、网格和背景数据缓存"""
+    return PartialDependence()
+
+# 重金属模型共用同一训练集，相似度索引由 similarity_index.py 离线构建
+HEAVY_METAL_SIMILARITY_INDEX = "heavy_metal_similarity_index.joblib"
+
+@st.cache_resource
+def get_similarity_index():
+    """加载训练集近邻相似度索引，未构建时返回None"""
+    index = SimilarityIndex.load(HEAVY_METAL_SIMILARITY_INDEX)
+    if index is not None:
+        log(f"加载相似度索引: {HEAVY_METAL_SIMILARITY_INDEX} (k={index.k})")
+    return index
+
+@st.cache_resource
+def get_student(teacher_file, student_fingerprint):
+    """加载模型文件对应的蒸馏学生模型和报告（按学生文件指纹缓存，重新蒸馏后自动重新加载），没有时返回(None, None)"""
+    return load_student(teacher_file)
+
+@st.cache_resource
+def get_prediction_store():
+    """进程级共享的预测历史存储（SQLite），所有会话的预测批量写入同一数据库"""
+    return PredictionStore("heavy_metal_predictions.db")
+
 # 初始化预测器 - 使用当前选择的模型
 if st.session_state.selected_model == "Ensemble":
     predictor = EnsembleModelPredictor()
@@ -2290,7 +2286,7 @@ else:
 # 根据当前页面显示不同内容
 if st.session_state.current_page == "模型信息":
     # 只显示模型信息内容，不显示标题和其他内容
-    model_info = predictor.get_model_info()
+    model_info = cached_model_info(predictor, model_info_fingerprint(predictor))
 
     # 构建完整的HTML内容
     info_content = '<div class="page-content">'
@@ -2312,6 +2308,58 @@ elif st.session_state.current_page == "执行日志":
     else:
         st.markdown('<div class="log-container">暂无日志记录</div>', unsafe_allow_html=True)
 
+    # 重跑耗时统计（整页重跑 vs 片段重跑）
+    if st.session_state.get('rerun_timings'):
+        timing_df = pd.DataFrame(st.session_state.rerun_timings, columns=["类型", "耗时(ms)"])
+        timing_summary = timing_df.groupby("类型")["耗时(ms)"].agg(
+            次数="count", 平均="mean", P95=lambda x: x.quantile(0.95)
+        ).round(1)
+        st.markdown("<div class='page-content'><h3>重跑耗时统计</h3></div>", unsafe_allow_html=True)
+        st.dataframe(timing_summary, use_container_width=True)
+
+    # 共享模型注册表状态（热更新版本）
+    model_registry = get_model_registry()
+    registry_status = model_registry.status()
+    if registry_status:
+        st.markdown("<div class='page-content'><h3>已加载模型</h3></div>", unsafe_allow_html=True)
+        st.dataframe(pd.DataFrame(registry_status), use_container_width=True, hide_index=True)
+        if model_registry.events:
+            st.markdown(
+                f'<div class="log-container">{"<br>".join(model_registry.events)}</div>',
+                unsafe_allow_html=True
+            )
+
+    # 线程预算状态
+    st.markdown("<div class='page-content'><h3>线程预算</h3></div>", unsafe_allow_html=True)
+    st.dataframe(pd.DataFrame([get_thread_budget().status()]), use_container_width=True, hide_index=True)
+
+elif st.session_state.current_page == "预测历史":
+    # 预测历史：按目标筛选、分页浏览和导出，不重新计算
+    prediction_store = get_prediction_store()
+    history_targets = prediction_store.targets()
+    history_filter = st.selectbox("预测目标", ["全部"] + history_targets, key="history_target")
+    filter_target = None if history_filter == "全部" else history_filter
+    history_total = prediction_store.count(filter_target)
+
+    if history_total == 0:
+        st.markdown('<div class="page-content">暂无预测历史</div>', unsafe_allow_html=True)
+    else:
+        page_size = 50
+        page_count = (history_total + page_size - 1) // page_size
+        history_page = st.number_input(f"页码（共 {page_count} 页，{history_total} 条记录）",
+                                       min_value=1, max_value=page_count, value=1, step=1, key="history_page")
+        history_df = prediction_store.page(int(history_page) - 1, page_size, filter_target)
+        st.dataframe(history_df, use_container_width=True, hide_index=True)
+        # 全部历史按批次从数据库流式导出，点击下载时才生成
+        history_format = st.radio("导出格式", available_formats(), horizontal=True, key="history_export_format")
+        extension, mime = EXPORT_FORMATS[history_format]
+        st.download_button(
+            f"⬇️ 导出历史 ({history_format.upper()}, {history_total} 条)",
+            data=deferred_download(lambda target=filter_target: prediction_store.iter_batches(target=target),
+                                   history_format),
+            file_name=f"prediction_history{extension}", mime=mime, key="history_download"
+        )
+
 elif st.session_state.current_page == "技术说明":
     # 只显示技术说明内容，不显示标题和其他内容
     tech_content = """
@@ -2397,12 +2445,12 @@ elif st.session_state.current_page == "预测模型":
     # 显示预测模型页面（原有的主要功能）
 
     # 初始化会话状态
-    if 'clear_pressed' not in st.session_state:
-        st.session_state.clear_pressed = False
     if 'prediction_result' not in st.session_state:
         st.session_state.prediction_result = None
     if 'warnings' not in st.session_state:
         st.session_state.warnings = []
+    if 'similarity_info' not in st.session_state:
+        st.session_state.similarity_info = None
     if 'prediction_error' not in st.session_state:
         st.session_state.prediction_error = None
     if 'feature_values' not in st.session_state:
@@ -2451,6 +2499,13 @@ elif st.session_state.current_page == "预测模型":
         ]
     }
 
+    # multioutput_forest.py导出的原生多输出随机森林存在时作为可选模型
+    native_rf_file = native_paths("multi_RF.joblib")[0]
+    if os.path.exists(native_rf_file):
+        specific_models["Multi Target"].append(
+            {"name": "Random Forest (原生多输出)", "file": native_rf_file, "target": "All"}
+        )
+
     # 如果CatBoost可用且模型文件存在，添加CAT模型
     if CATBOOST_AVAILABLE:
         # 检查CAT模型文件是否存在
@@ -2677,159 +2732,15 @@ elif st.session_state.current_page == "预测模型":
         "Target Selection": "#cd5c5c"     # 橙红色 (第三列)
     }
 
-    # 创建三列布局
-    col1, col2, col3 = st.columns(3)
+    # 所有输入特征
+    all_features = ["pH", "V", "T", "LD", "Ap", "f", "SP"]
 
-    # 使用字典存储所有输入值
-    features = {}
-
-    # Model Selection - 第一列
-    with col1:
-        # 添加列标题
-        st.markdown("""
-        <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 12px; border-radius: 10px; margin-bottom: 15px; margin-top: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
-            <h3 style='margin: 0; color: #9370db; font-weight: bold;'>Model Selection</h3>
-        </div>
-        """, unsafe_allow_html=True)
-
-        # 显示当前选择的模型分类
-        st.markdown(f"""
-        <div style='background-color: rgba(147, 112, 219, 0.1); padding: 8px; border-radius: 6px; margin-bottom: 10px; border-left: 4px solid #9370db;'>
-            <strong>当前分类:</strong> {st.session_state.selected_model}
-        </div>
-        """, unsafe_allow_html=True)
-
-        # 如果CatBoost不可用，显示提示
-        if not CATBOOST_AVAILABLE:
-            st.markdown("""
-            <div style='background-color: rgba(255, 193, 7, 0.1); padding: 8px; border-radius: 6px; margin-bottom: 10px; border-left: 4px solid #ffc107;'>
-                <small>⚠️ <strong>注意:</strong> CatBoost库未安装，CAT模型不可用</small>
-            </div>
-            """, unsafe_allow_html=True)
-
-        # 显示该分类下的具体模型
-        models_in_category = specific_models.get(st.session_state.selected_model, [])
-
-        for model_info in models_in_category:
-            model_name = model_info["name"]
-            model_file = model_info["file"]
-            model_target = model_info["target"]
-
-            # 检查是否为当前选中的模型
-            is_selected = st.session_state.selected_specific_model == model_name
-
-            # 创建模型选择按钮
-            button_style = "primary" if is_selected else "secondary"
-
-            if st.button(
-                f"🤖 {model_name}\n📊 Target: {model_target}",
-                key=f"specific_model_{model_name}",
-                use_container_width=True,
-                type=button_style
-            ):
-                if st.session_state.selected_specific_model != model_name:
-                    st.session_state.selected_specific_model = model_name
-                    st.session_state.prediction_result = None
-                    st.session_state.warnings = []
-                    log(f"切换到具体模型: {model_name} ({model_file})")
-                    st.rerun()
-
-    # Input Features - 第二列 (显示所有输入特征)
-    with col2:
-        # 添加列标题
-        st.markdown("""
-        <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 12px; border-radius: 10px; margin-bottom: 15px; margin-top: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
-            <h3 style='margin: 0; color: #20b2aa; font-weight: bold;'>Input Features</h3>
-        </div>
-        """, unsafe_allow_html=True)
-
-        # 所有输入特征
-        all_features = ["pH", "V", "T", "LD", "Ap", "f", "SP"]
-        color = category_colors["Input Features"]
-
-        # 为每个特征创建独立的参数行
-        for feature in all_features:
-            if st.session_state.clear_pressed:
-                value = default_values[feature]
-            else:
-                value = st.session_state.feature_values.get(feature, default_values[feature])
-
-            # 创建水平布局：标签和输入框在同一行
-            label_col, input_col = st.columns([1, 1])
-
-            with label_col:
-                # 创建标签
-                st.markdown(f"""
-                <div style='background-color: {color}; width: 100%; text-align: center; margin: 0; padding: 10px 8px; border-radius: 6px; color: white; font-weight: bold; font-size: 14px; margin-bottom: 8px;'>
-                    {feature}
-                </div>
-                """, unsafe_allow_html=True)
-
-            with input_col:
-                # 使用number_input让用户可以直接输入
-                new_value = st.number_input(
-                    f"{feature}",
-                    value=float(value),
-                    step=0.001,
-                    format="%.3f",
-                    key=f"input_feature_{feature}",
-                    label_visibility="collapsed"
-                )
-                # 更新会话状态中的值
-                st.session_state.feature_values[feature] = new_value
-
-            # 存储特征值
-            features[feature] = st.session_state.feature_values.get(feature, default_values[feature])
-
-    # Target Selection - 第三列
-    with col3:
-        # 添加列标题
-        st.markdown("""
-        <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 12px; border-radius: 10px; margin-bottom: 15px; margin-top: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
-            <h3 style='margin: 0; color: #cd5c5c; font-weight: bold;'>Target Selection</h3>
-        </div>
-        """, unsafe_allow_html=True)
-
-        # 目标选择按钮
-        target_options = ["All", "Cd", "Pb", "Hg"]
-
-        for target in target_options:
-            if st.button(f"🎯 {target}", key=f"target_{target}", use_container_width=True,
-                        type="primary" if st.session_state.selected_target == target else "secondary"):
-                if st.session_state.selected_target != target:
-                    st.session_state.selected_target = target
-                    st.session_state.prediction_result = None
-                    st.session_state.warnings = []
-                    log(f"切换到目标: {st.session_state.selected_target}")
-                    st.rerun()
-
-        # 显示当前选择的目标
-        st.markdown(f"""
-        <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 10px; border-radius: 8px; margin-top: 15px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
-            <p style='margin: 0; color: #cd5c5c; font-weight: bold;'>当前目标: {st.session_state.selected_target}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    # 明确结束三列布局 - 添加一个空的容器来确保退出列上下文
-    st.empty()
-
-    # 立即显示当前输入值 - 紧贴特征输入区域
-    with st.expander("📊 显示当前输入值", expanded=False):
-        debug_info = """
-        <div style='
-            background-color: rgba(255, 255, 255, 0.8);
-            padding: 20px;
-            border-radius: 10px;
-            backdrop-filter: blur(5px);
-            margin: 10px 0;
-            columns: 3;
-            column-gap: 20px;
-        '>
-        """
-        for feature, value in features.items():
-            debug_info += f"<p style='color: #000 !important; margin: 5px 0;'><b>{feature}</b>: {value:.3f}</p>"
-        debug_info += "</div>"
-        st.markdown(debug_info, unsafe_allow_html=True)
+    # 输入框的初始值放在会话状态中，表单提交前的编辑不会触发重跑
+    for feature in all_features:
+        if f"input_feature_{feature}" not in st.session_state:
+            st.session_state[f"input_feature_{feature}"] = float(
+                st.session_state.feature_values.get(feature, default_values[feature])
+            )
 
     # 添加expander标题的自定义样式 - 使用所有可能的Streamlit expander选择器
     st.markdown("""
@@ -2928,273 +2839,660 @@ elif st.session_state.current_page == "预测模型":
     </style>
     """, unsafe_allow_html=True)
 
+    def select_specific_model(model_name, model_file):
+        """
+        具体模型按钮回调 - 在重跑前更新状态
+        按钮在Model Selection片段中，片段重跑不会刷新预测面板和批量区域，切换后由片段发起一次整页重跑，
+        否则上一个模型的预测结果会留在页面上
+        """
+        if st.session_state.selected_specific_model != model_name:
+            st.session_state.selected_specific_model = model_name
+            st.session_state.prediction_result = None
+            st.session_state.warnings = []
+            st.session_state.specific_model_switched = True
+            log(f"切换到具体模型: {model_name} ({model_file})")
 
+    def select_target(target):
+        """目标按钮回调"""
+        if st.session_state.selected_target != target:
+            st.session_state.selected_target = target
+            st.session_state.prediction_result = None
+            st.session_state.warnings = []
+            log(f"切换到目标: {target}")
 
-    # 重置状态
-    if st.session_state.clear_pressed:
+    def reset_inputs():
+        """重置输入按钮回调 - 回调中可以直接修改输入框的会话状态"""
+        st.session_state.bottom_button_selected = "reset"
+        log("重置所有输入值")
+        for feature in all_features:
+            st.session_state[f"input_feature_{feature}"] = float(default_values[feature])
         st.session_state.feature_values = {}
-        st.session_state.clear_pressed = False
+        st.session_state.prediction_result = None
+        st.session_state.warnings = []
+        st.session_state.prediction_error = None
 
-    # 预测结果显示区域
-    result_container = st.container()
+    def run_prediction(features):
+        """执行一次预测，结果写入会话状态"""
+        st.session_state.bottom_button_selected = "predict"
+        log("开始预测流程...")
 
-    # 添加间距
-    st.markdown("<div style='margin-top: 20px; margin-bottom: 15px;'></div>", unsafe_allow_html=True)
+        # 检查是否选择了具体模型
+        if st.session_state.selected_specific_model is None:
+            error_msg = f"""
+            ❌ **请选择具体模型**
 
-    # 预测按钮区域
-    st.markdown('<div class="main-buttons">', unsafe_allow_html=True)
-    col1, col2 = st.columns([1, 1])
+            当前选择的模型分类：**{st.session_state.selected_model}**
 
-    with col1:
-        predict_clicked = st.button("🔮 运行预测", use_container_width=True,
-                                   type="primary" if st.session_state.bottom_button_selected == "predict" else "secondary")
-        if predict_clicked:
-            st.session_state.bottom_button_selected = "predict"
-            log("开始预测流程...")
-
-            # 检查是否选择了具体模型
-            if st.session_state.selected_specific_model is None:
-                error_msg = f"""
-                ❌ **请选择具体模型**
-
-                当前选择的模型分类：**{st.session_state.selected_model}**
-
-                **操作步骤**：
-                1. 在左侧 "Model Selection" 列中选择一个具体的模型
-                2. 可选择的模型包括：GBDT、Random Forest""" + ("""、CatBoost""" if CATBOOST_AVAILABLE else """（CatBoost需要安装catboost库）""") + """ 等
-                3. 选择后再点击预测按钮
-
-                **提示**：每个模型都有不同的性能特点，建议尝试多个模型进行比较。
-                """
-                st.error(error_msg)
-                st.session_state.prediction_error = error_msg
-                st.rerun()
-            else:
-                # 获取选择的具体模型信息
-                selected_model_info = None
-                models_in_category = specific_models.get(st.session_state.selected_model, [])
-                for model_info in models_in_category:
-                    if model_info["name"] == st.session_state.selected_specific_model:
-                        selected_model_info = model_info
-                        break
-
-                if selected_model_info is None:
-                    error_msg = f"未找到选择的模型: {st.session_state.selected_specific_model}"
-                    st.error(error_msg)
-                    st.session_state.prediction_error = error_msg
-                    st.rerun()
-                else:
-                    # 切换模型后需要重新初始化预测器
-                    current_model_key = f"{st.session_state.selected_model}_{st.session_state.selected_specific_model}"
-                    if not hasattr(predictor, 'current_model_key') or predictor.current_model_key != current_model_key:
-                        log(f"检测到模型变更，重新初始化预测器: {st.session_state.selected_model} - {st.session_state.selected_specific_model}")
-                        if st.session_state.selected_model == "Ensemble":
-                            predictor = EnsembleModelPredictor()
-                            predictor.current_model_key = current_model_key
-                            predictor.selected_model_file = selected_model_info["file"]
-                        else:
-                            # 对于Single Target和Multi Target模型，需要正确设置目标名称
-                            target_name = selected_model_info.get("target", "All")
-                            predictor = ModelPredictor(target_model=st.session_state.selected_model)
-                            predictor.current_model_key = current_model_key
-                            predictor.selected_model_file = selected_model_info["file"]
-                            predictor.specific_target = target_name  # 设置具体目标
+            **操作步骤**：
+            1. 在左侧 "Model Selection" 列中选择一个具体的模型
+            2. 可选择的模型包括：GBDT、Random Forest""" + ("""、CatBoost""" if CATBOOST_AVAILABLE else """（CatBoost需要安装catboost库）""") + """ 等
+            3. 选择后再点击预测按钮
 
-                            # 强制重新加载模型
-                            predictor.model_loaded = False
-                            predictor.pipeline = None
+            **提示**：每个模型都有不同的性能特点，建议尝试多个模型进行比较。
+            """
+            st.session_state.prediction_error = error_msg
+            return
 
-                            # 重新查找模型文件（现在selected_model_file已经设置）
-                            predictor.model_path = predictor._find_model_file()
-                            if predictor.model_path:
-                                predictor._load_pipeline()
+        # 获取选择的具体模型信息
+        selected_model_info = None
+        models_in_category = specific_models.get(st.session_state.selected_model, [])
+        for model_info in models_in_category:
+            if model_info["name"] == st.session_state.selected_specific_model:
+                selected_model_info = model_info
+                break
 
-                            log(f"设置模型目标: {target_name}, 模型文件: {selected_model_info['file']}")
-                            log(f"强制重新加载模型以确保使用正确的模型文件")
+        if selected_model_info is None:
+            st.session_state.prediction_error = f"未找到选择的模型: {st.session_state.selected_specific_model}"
+            return
 
-            # 保存当前输入到会话状态
-            st.session_state.feature_values = features.copy()
+        # 切换模型后需要重新初始化预测器
+        active_predictor = predictor
+        current_model_key = f"{st.session_state.selected_model}_{st.session_state.selected_specific_model}"
+        if not hasattr(active_predictor, 'current_model_key') or active_predictor.current_model_key != current_model_key:
+            log(f"检测到模型变更，重新初始化预测器: {st.session_state.selected_model} - {st.session_state.selected_specific_model}")
+            active_predictor = create_predictor_for_model(st.session_state.selected_model, selected_model_info)
 
-            log(f"开始{st.session_state.selected_model}预测，输入特征数: {len(features)}")
+        # 保存当前输入到会话状态
+        st.session_state.feature_values = features.copy()
 
-            # 检查输入范围
-            warnings = predictor.check_input_range(features)
-            st.session_state.warnings = warnings
+        log(f"开始{st.session_state.selected_model}预测，输入特征数: {len(features)}")
 
-            # 执行预测
-            try:
-                # 确保预测器已正确加载
-                if not predictor.model_loaded:
-                    log("模型未加载，尝试重新加载")
-                    if st.session_state.selected_model == "Ensemble":
-                        # Ensemble模型重新加载
-                        predictor._load_ensemble_model()
-                        if predictor.model_loaded:
-                            log("Ensemble模型重新加载成功")
-                        else:
-                            error_msg = """
-                            ❌ **预测失败**
-
-                            **错误信息**: 无法加载Ensemble模型。
-
-                            **可能的解决方案**:
-
-                            • **确保模型文件存在**: 检查是否有本地模型文件 (joblib格式)
-                            • **检查网络连接**: 确保能够访问GitHub来下载模型
-                            • **验证输入格式**: 确认输入的特征值是否正确
-                            • **确认特征顺序**: Feature1-Feature9
-                            • **检查模型支持**: 确保模型支持多目标回归 (Cd, Pb, Hg)
-
-                            **技术详情**:
-                            - 模型类型: Ensemble多输出回归
-                            - 输入特征: pH, V, T, LD, Ap, f, SP (7个特征)
-                            - 输出目标: Cd, Pb, Hg (3个目标)
-                            """
-                            st.error(error_msg)
-                            st.session_state.prediction_error = error_msg
-                            st.rerun()
+        # 检查输入范围
+        st.session_state.warnings = active_predictor.check_input_range(features)
+
+        # 训练集近邻相似度（索引存在时）
+        similarity_index = get_similarity_index()
+        st.session_state.similarity_info = None
+        if similarity_index is not None:
+            st.session_state.similarity_info = similarity_index.query(features).iloc[0].to_dict()
+
+        # 执行预测
+        try:
+            # 确保预测器已正确加载
+            if not active_predictor.model_loaded:
+                log("模型未加载，尝试重新加载")
+                if st.session_state.selected_model == "Ensemble":
+                    # Ensemble模型重新加载
+                    active_predictor._load_ensemble_model()
+                    if active_predictor.model_loaded:
+                        log("Ensemble模型重新加载成功")
+                    elif degraded_table_for(active_predictor, ENSEMBLE_DEFAULT_FILE) is not None:
+                        log("Ensemble模型不可用，使用降级模式（预计算预测表）")
                     else:
-                        # 其他模型重新加载
-                        predictor.model_path = predictor._find_model_file()
-                        if predictor.model_path and predictor._load_pipeline():
-                            log("重新加载模型成功")
-                        else:
-                            if st.session_state.selected_model == "Single Target":
-                                error_msg = """
-                            ❌ **预测失败**
-
-                            **错误信息**: 无法加载Single Target模型。
-
-                            **可能的解决方案**:
-
-                            • **确保模型文件存在**: 检查是否有以下模型文件 (joblib格式)
-                              - single_Cd_GBDT.joblib (镉预测模型)
-                              - single_Pb_GBDT.joblib (铅预测模型)
-                              - single_Hg_GBDT.joblib (汞预测模型)
-                              - single_Cd_RF.joblib, single_Pb_RF.joblib, single_Hg_RF.joblib""" + ("""
-                              - single_Cd_CAT.joblib, single_Pb_CAT.joblib, single_Hg_CAT.joblib""" if CATBOOST_AVAILABLE else " (CatBoost模型需要安装catboost库)") + """
-
-                            • **检查网络连接**: 确保能够访问GitHub来下载模型
-                            • **验证输入格式**: 确认输入的特征值是否正确
-                            • **运行训练代码**: 如果没有模型文件，请先运行训练代码生成模型
-
-                            **技术详情**:
-                            - 模型类型: Single Target回归 (分别预测每个重金属)
-                            - 输入特征: pH, V, T, LD, Ap, f, SP (7个特征)
-                            - 输出目标: Cd, Pb, Hg (单独预测)
-                            """
-                            else:
-                                error_msg = f"无法加载{st.session_state.selected_model}模型。请确保模型文件存在于正确位置。"
+                        st.session_state.prediction_error = """
+                        ❌ **预测失败**
 
-                            st.error(error_msg)
-                            st.session_state.prediction_error = error_msg
-                            st.rerun()
+                        **错误信息**: 无法加载Ensemble模型。
 
-                # 执行预测
-                result = predictor.predict(features)
-                if result is not None:
-                    # 处理多目标和单目标预测结果
-                    if isinstance(result, (list, tuple, np.ndarray)) and len(result) > 1:
-                        # 多目标预测结果
-                        st.session_state.prediction_result = result
-                        log(f"多目标预测成功: Cd={result[0]:.4f}, Pb={result[1]:.4f}, Hg={result[2]:.4f}")
+                        **可能的解决方案**:
+
+                        • **确保模型文件存在**: 检查是否有本地模型文件 (joblib格式)
+                        • **检查网络连接**: 确保能够访问GitHub来下载模型
+                        • **验证输入格式**: 确认输入的特征值是否正确
+                        • **确认特征顺序**: Feature1-Feature9
+                        • **检查模型支持**: 确保模型支持多目标回归 (Cd, Pb, Hg)
+
+                        **技术详情**:
+                        - 模型类型: Ensemble多输出回归
+                        - 输入特征: pH, V, T, LD, Ap, f, SP (7个特征)
+                        - 输出目标: Cd, Pb, Hg (3个目标)
+                        """
+                        return
+                else:
+                    # 其他模型重新加载
+                    active_predictor.model_path = active_predictor._find_model_file()
+                    if active_predictor.model_path and active_predictor._load_pipeline():
+                        log("重新加载模型成功")
+                    elif degraded_table_for(active_predictor) is not None:
+                        log("模型不可用，使用降级模式（预计算预测表）")
                     else:
-                        # 单目标预测结果
-                        if isinstance(result, (list, tuple, np.ndarray)):
-                            st.session_state.prediction_result = float(result[0])
+                        if st.session_state.selected_model == "Single Target":
+                            error_msg = """
+                        ❌ **预测失败**
+
+                        **错误信息**: 无法加载Single Target模型。
+
+                        **可能的解决方案**:
+
+                        • **确保模型文件存在**: 检查是否有以下模型文件 (joblib格式)
+                          - single_Cd_GBDT.joblib (镉预测模型)
+                          - single_Pb_GBDT.joblib (铅预测模型)
+                          - single_Hg_GBDT.joblib (汞预测模型)
+                          - single_Cd_RF.joblib, single_Pb_RF.joblib, single_Hg_RF.joblib""" + ("""
+                          - single_Cd_CAT.joblib, single_Pb_CAT.joblib, single_Hg_CAT.joblib""" if CATBOOST_AVAILABLE else " (CatBoost模型需要安装catboost库)") + """
+
+                        • **检查网络连接**: 确保能够访问GitHub来下载模型
+                        • **验证输入格式**: 确认输入的特征值是否正确
+                        • **运行训练代码**: 如果没有模型文件，请先运行训练代码生成模型
+
+                        **技术详情**:
+                        - 模型类型: Single Target回归 (分别预测每个重金属)
+                        - 输入特征: pH, V, T, LD, Ap, f, SP (7个特征)
+                        - 输出目标: Cd, Pb, Hg (单独预测)
+                        """
                         else:
-                            st.session_state.prediction_result = float(result)
-                        log(f"单目标预测成功: {st.session_state.prediction_result:.4f}")
-                    st.session_state.prediction_error = None
+                            error_msg = f"无法加载{st.session_state.selected_model}模型。请确保模型文件存在于正确位置。"
+                        st.session_state.prediction_error = error_msg
+                        return
+
+            # 相同模型版本、相同目标、相同输入的预测直接从历史中读取
+            prediction_store = get_prediction_store()
+            model_version = get_model_registry().get_version(active_predictor.model_path) \
+                if active_predictor.model_path else None
+            model_hash = model_version.digest if model_version is not None else None
+            history_target = selected_model_info["target"]
+            history_record = prediction_store.lookup(features, history_target, model_hash) if model_hash else None
+
+            degraded_info = None
+            if history_record is not None:
+                result = history_record["outputs"]
+                log("命中预测历史（相同模型、目标和输入），跳过模型计算")
+            else:
+                # 执行预测
+                predict_start = time.perf_counter()
+                result = active_predictor.predict(features)
+                latency_ms = (time.perf_counter() - predict_start) * 1000.0
+                degraded_info = getattr(active_predictor, 'degraded_info', None)
+                # 降级模式的近似结果不写入预测历史
+                if result is not None and degraded_info is None:
+                    prediction_store.record(
+                        features, result, history_target,
+                        model_name=f"{st.session_state.selected_model} - {st.session_state.selected_specific_model}",
+                        model_hash=model_hash, latency_ms=latency_ms,
+                        warnings=st.session_state.warnings, app="heavy_metal"
+                    )
+            if result is not None:
+                # 处理多目标和单目标预测结果
+                if isinstance(result, (list, tuple, np.ndarray)) and len(result) > 1:
+                    # 多目标预测结果
+                    st.session_state.prediction_result = result
+                    log(f"多目标预测成功: Cd={result[0]:.4f}, Pb={result[1]:.4f}, Hg={result[2]:.4f}")
                 else:
-                    log("警告: 预测结果为空")
-                    st.session_state.prediction_error = "预测结果为空"
+                    # 单目标预测结果
+                    if isinstance(result, (list, tuple, np.ndarray)):
+                        st.session_state.prediction_result = float(result[0])
+                    else:
+                        st.session_state.prediction_result = float(result)
+                    log(f"单目标预测成功: {st.session_state.prediction_result:.4f}")
+                st.session_state.prediction_model_name = st.session_state.selected_specific_model
+                st.session_state.prediction_model_loaded = active_predictor.model_loaded
+                st.session_state.prediction_degraded = degraded_info
+                st.session_state.prediction_error = None
+            else:
+                log("警告: 预测结果为空")
+                st.session_state.prediction_error = "预测结果为空"
 
-            except Exception as e:
-                error_msg = f"预测过程中发生错误: {str(e)}"
-                st.session_state.prediction_error = error_msg
-                log(f"预测错误: {str(e)}")
-                log(traceback.format_exc())
-                st.error(error_msg)
-            st.rerun()
+        except Exception as e:
+            error_msg = f"预测过程中发生错误: {str(e)}"
+            st.session_state.prediction_error = error_msg
+            log(f"预测错误: {str(e)}")
+            log(traceback.format_exc())
 
-    with col2:
-        reset_clicked = st.button("🔄 重置输入", use_container_width=True,
-                                 type="primary" if st.session_state.bottom_button_selected == "reset" else "secondary")
-        if reset_clicked:
-            st.session_state.bottom_button_selected = "reset"
-            log("重置所有输入值")
-            st.session_state.clear_pressed = True
-            st.session_state.prediction_result = None
-            st.session_state.warnings = []
-            st.session_state.prediction_error = None
-            st.rerun()
-
-    st.markdown('</div>', unsafe_allow_html=True)
-
-    # 显示预测结果
-    if st.session_state.prediction_result is not None:
-        st.markdown("<div style='margin-top: 10px; margin-bottom: 10px;'></div>", unsafe_allow_html=True)
-        st.markdown("---")
-
-        # 显示主预测结果 - 支持多目标输出和目标选择
-        if isinstance(st.session_state.prediction_result, (list, tuple, np.ndarray)):
-            # 多目标预测结果
-            target_names = ['Cd', 'Pb', 'Hg']
-            results_html = "<div class='yield-result'>"
-            results_html += f"<h3>{st.session_state.selected_model} 预测结果：</h3>"
-
-            # 根据选择的目标显示结果
-            if st.session_state.selected_target == "All":
-                for i, (target, value) in enumerate(zip(target_names, st.session_state.prediction_result)):
-                    results_html += f"<p><strong>{target}:</strong> {value:.4f}</p>"
+    @st.fragment
+    def model_selector_fragment():
+        """Model Selection列 - 点击当前模型只重跑本片段，切换到其他模型时整页重跑"""
+        if st.session_state.pop("specific_model_switched", False):
+            st.rerun(scope="app")
+        fragment_start = time.perf_counter()
+
+        # 添加列标题
+        st.markdown("""
+        <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 12px; border-radius: 10px; margin-bottom: 15px; margin-top: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
+            <h3 style='margin: 0; color: #9370db; font-weight: bold;'>Model Selection</h3>
+        </div>
+        """, unsafe_allow_html=True)
+
+        # 显示当前选择的模型分类
+        st.markdown(f"""
+        <div style='background-color: rgba(147, 112, 219, 0.1); padding: 8px; border-radius: 6px; margin-bottom: 10px; border-left: 4px solid #9370db;'>
+            <strong>当前分类:</strong> {st.session_state.selected_model}
+        </div>
+        """, unsafe_allow_html=True)
+
+        # 如果CatBoost不可用，显示提示
+        if not CATBOOST_AVAILABLE:
+            st.markdown("""
+            <div style='background-color: rgba(255, 193, 7, 0.1); padding: 8px; border-radius: 6px; margin-bottom: 10px; border-left: 4px solid #ffc107;'>
+                <small>⚠️ <strong>注意:</strong> CatBoost库未安装，CAT模型不可用</small>
+            </div>
+            """, unsafe_allow_html=True)
+
+        # 显示该分类下的具体模型
+        models_in_category = specific_models.get(st.session_state.selected_model, [])
+
+        for model_info in models_in_category:
+            model_name = model_info["name"]
+
+            # 检查是否为当前选中的模型
+            is_selected = st.session_state.selected_specific_model == model_name
+
+            st.button(
+                f"🤖 {model_name}\n📊 Target: {model_info['target']}",
+                key=f"specific_model_{model_name}",
+                use_container_width=True,
+                type="primary" if is_selected else "secondary",
+                on_click=select_specific_model,
+                args=(model_name, model_info["file"])
+            )
+
+        record_rerun_timing("fragment:model_selector", time.perf_counter() - fragment_start)
+
+    @st.fragment
+    def prediction_panel_fragment():
+        """输入特征、目标选择和预测结果 - 编辑输入不触发重跑，只有提交表单时才预测"""
+        fragment_start = time.perf_counter()
+
+        col2, col3 = st.columns(2)
+
+        # Input Features - 表单内的输入在提交前不会触发重跑
+        with col2:
+            # 添加列标题
+            st.markdown("""
+            <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 12px; border-radius: 10px; margin-bottom: 15px; margin-top: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
+                <h3 style='margin: 0; color: #20b2aa; font-weight: bold;'>Input Features</h3>
+            </div>
+            """, unsafe_allow_html=True)
+
+            color = category_colors["Input Features"]
+
+            with st.form("feature_form", border=False):
+                # 为每个特征创建独立的参数行
+                for feature in all_features:
+                    # 创建水平布局：标签和输入框在同一行
+                    label_col, input_col = st.columns([1, 1])
+
+                    with label_col:
+                        # 创建标签
+                        st.markdown(f"""
+                        <div style='background-color: {color}; width: 100%; text-align: center; margin: 0; padding: 10px 8px; border-radius: 6px; color: white; font-weight: bold; font-size: 14px; margin-bottom: 8px;'>
+                            {feature}
+                        </div>
+                        """, unsafe_allow_html=True)
+
+                    with input_col:
+                        # 使用number_input让用户可以直接输入
+                        st.number_input(
+                            f"{feature}",
+                            step=0.001,
+                            format="%.3f",
+                            key=f"input_feature_{feature}",
+                            label_visibility="collapsed"
+                        )
+
+                # 预测按钮区域
+                st.markdown('<div class="main-buttons">', unsafe_allow_html=True)
+                button_col1, button_col2 = st.columns([1, 1])
+                with button_col1:
+                    predict_clicked = st.form_submit_button(
+                        "🔮 运行预测", use_container_width=True,
+                        type="primary" if st.session_state.bottom_button_selected == "predict" else "secondary"
+                    )
+                with button_col2:
+                    st.form_submit_button(
+                        "🔄 重置输入", use_container_width=True,
+                        type="primary" if st.session_state.bottom_button_selected == "reset" else "secondary",
+                        on_click=reset_inputs
+                    )
+                st.markdown('</div>', unsafe_allow_html=True)
+
+        # Target Selection - 切换目标只重跑本片段
+        with col3:
+            # 添加列标题
+            st.markdown("""
+            <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 12px; border-radius: 10px; margin-bottom: 15px; margin-top: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
+                <h3 style='margin: 0; color: #cd5c5c; font-weight: bold;'>Target Selection</h3>
+            </div>
+            """, unsafe_allow_html=True)
+
+            # 目标选择按钮
+            target_options = ["All", "Cd", "Pb", "Hg"]
+
+            for target in target_options:
+                st.button(f"🎯 {target}", key=f"target_{target}", use_container_width=True,
+                          type="primary" if st.session_state.selected_target == target else "secondary",
+                          on_click=select_target, args=(target,))
+
+            # 显示当前选择的目标
+            st.markdown(f"""
+            <div style='background-color: rgba(255,255,255,0.9); text-align: center; padding: 10px; border-radius: 8px; margin-top: 15px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
+                <p style='margin: 0; color: #cd5c5c; font-weight: bold;'>当前目标: {st.session_state.selected_target}</p>
+            </div>
+            """, unsafe_allow_html=True)
+
+        # 使用当前输入值（表单提交后才会更新）
+        features = {
+            feature: float(st.session_state[f"input_feature_{feature}"])
+            for feature in all_features
+        }
+
+        if predict_clicked:
+            run_prediction(features)
+
+        # 立即显示当前输入值 - 紧贴特征输入区域
+        with st.expander("📊 显示当前输入值", expanded=False):
+            debug_info = """
+            <div style='
+                background-color: rgba(255, 255, 255, 0.8);
+                padding: 20px;
+                border-radius: 10px;
+                backdrop-filter: blur(5px);
+                margin: 10px 0;
+                columns: 3;
+                column-gap: 20px;
+            '>
+            """
+            for feature, value in features.items():
+                debug_info += f"<p style='color: #000 !important; margin: 5px 0;'><b>{feature}</b>: {value:.3f}</p>"
+            debug_info += "</div>"
+            st.markdown(debug_info, unsafe_allow_html=True)
+
+        # 显示预测结果
+        if st.session_state.prediction_result is not None:
+            st.markdown("<div style='margin-top: 10px; margin-bottom: 10px;'></div>", unsafe_allow_html=True)
+            st.markdown("---")
+
+            result_model_name = st.session_state.get("prediction_model_name") or st.session_state.selected_model
+
+            # 显示主预测结果 - 支持多目标输出和目标选择
+            if isinstance(st.session_state.prediction_result, (list, tuple, np.ndarray)):
+                # 多目标预测结果
+                target_names = ['Cd', 'Pb', 'Hg']
+                results_html = "<div class='yield-result'>"
+                results_html += f"<h3>{st.session_state.selected_model} ({result_model_name}) 预测结果：</h3>"
+
+                # 根据选择的目标显示结果
+                if st.session_state.selected_target == "All":
+                    for i, (target, value) in enumerate(zip(target_names, st.session_state.prediction_result)):
+                        results_html += f"<p><strong>{target}:</strong> {value:.4f}</p>"
+                else:
+                    # 显示特定目标
+                    target_idx = target_names.index(st.session_state.selected_target)
+                    value = st.session_state.prediction_result[target_idx]
+                    results_html += f"<p><strong>{st.session_state.selected_target}:</strong> {value:.4f}</p>"
+
+                results_html += "</div>"
+                st.markdown(results_html, unsafe_allow_html=True)
             else:
-                # 显示特定目标
-                target_idx = target_names.index(st.session_state.selected_target)
-                value = st.session_state.prediction_result[target_idx]
-                results_html += f"<p><strong>{st.session_state.selected_target}:</strong> {value:.4f}</p>"
+                # 单目标预测结果
+                target_display = st.session_state.selected_target if st.session_state.selected_target != "All" else "预测值"
+                st.markdown(
+                    f"<div class='yield-result'>{target_display}: {st.session_state.prediction_result:.4f}</div>",
+                    unsafe_allow_html=True
+                )
 
-            results_html += "</div>"
-            result_container.markdown(results_html, unsafe_allow_html=True)
-        else:
-            # 单目标预测结果
-            target_display = st.session_state.selected_target if st.session_state.selected_target != "All" else "预测值"
-            result_container.markdown(
-                f"<div class='yield-result'>{target_display}: {st.session_state.prediction_result:.4f}</div>",
-                unsafe_allow_html=True
+            # 显示模型状态（降级模式的结果明确标注为近似值）
+            degraded_info = st.session_state.get("prediction_degraded")
+            if degraded_info:
+                st.markdown(
+                    f"<div class='warning-box'><b>⚠️ 降级模式（近似值）：</b> 模型文件当前不可用，结果由预计算预测表"
+                    f" {degraded_info['source']} 插值得到（{degraded_info['samples']} 个采样点，"
+                    f"留出点误差 {degraded_info['error']}）。模型恢复后请重新预测。</div>",
+                    unsafe_allow_html=True
+                )
+            elif not st.session_state.get("prediction_model_loaded", True):
+                st.markdown(
+                    "<div class='error-box'><b>⚠️ 错误：</b> 模型未成功加载，无法执行预测。请检查模型文件是否存在。</div>",
+                    unsafe_allow_html=True
+                )
+
+            # 显示警告
+            if st.session_state.warnings:
+                warnings_html = "<div class='warning-box'><b>⚠️ 输入警告</b><ul>"
+                for warning in st.session_state.warnings:
+                    warnings_html += f"<li>{warning}</li>"
+                warnings_html += "</ul><p><i>建议调整输入值以获得更准确的预测结果。</i></p></div>"
+                st.markdown(warnings_html, unsafe_allow_html=True)
+
+            # 显示训练集相似度
+            similarity_info = st.session_state.similarity_info
+            if similarity_info and not np.isnan(similarity_info["knn_distance"]):
+                if similarity_info["extrapolation"]:
+                    st.markdown(
+                        f"<div class='warning-box'><b>⚠️ 外推提示：</b> 输入点位于训练数据稀疏区域"
+                        f"（近邻距离 {similarity_info['knn_distance']:.3f}，相似度 {similarity_info['similarity']:.2f}），"
+                        f"预测结果可能不可靠。</div>",
+                        unsafe_allow_html=True
+                    )
+                else:
+                    st.caption(f"训练集相似度: {similarity_info['similarity']:.2f}"
+                               f"（k近邻平均距离 {similarity_info['knn_distance']:.3f}）")
+
+        elif st.session_state.prediction_error is not None:
+            st.markdown("---")
+            st.error(st.session_state.prediction_error)
+            error_html = """
+            <div class='error-box'>
+                <h3>❌ 预测失败</h3>
+                <p><b>可能的解决方案:</b></p>
+                <ul>
+                    <li>确保模型文件 (.joblib) 存在于应用目录中</li>
+                    <li>检查模型文件名是否包含对应的关键词 (gbdt/rf/cat)</li>
+                    <li>验证输入数据格式是否正确</li>
+                    <li>确认特征顺序：Feature1-Feature9</li>
+                    <li>检查模型是否支持多目标输出 (Cd, Pb, Hg)</li>
+                </ul>
+            </div>
+            """
+            st.markdown(error_html, unsafe_allow_html=True)
+
+        record_rerun_timing("fragment:prediction_panel", time.perf_counter() - fragment_start)
+
+    # 两列布局：左侧模型选择，右侧输入/目标/结果，各自独立重跑
+    col1, col_panel = st.columns([1, 2])
+
+    with col1:
+        model_selector_fragment()
+
+    with col_panel:
+        prediction_panel_fragment()
+
+    # 批量预测区域 - 任务在后台线程中运行，进度保存在任务管理器中
+    st.markdown("---")
+    with st.expander("📁 批量预测", expanded=False):
+        st.markdown("上传包含 pH、V、T、LD、Ap、f、SP 列的CSV或Excel文件，使用当前选择的具体模型进行批量预测。")
+
+        if 'batch_job_ids' not in st.session_state:
+            st.session_state.batch_job_ids = []
+
+        batch_manager = get_batch_job_manager()
+        uploaded_file = st.file_uploader("选择文件", type=["csv", "xlsx"], key="batch_upload_file")
+        use_float32 = st.checkbox(
+            "float32 推理（大文件）", key="batch_use_float32",
+            help="特征矩阵使用float32，内存减半；与float64结果的差异可用 float32_inference.py 生成容差报告确认"
+        )
+
+        selected_model_info = next(
+            (m for m in specific_models.get(st.session_state.selected_model, [])
+             if m["name"] == st.session_state.selected_specific_model),
+            None
+        )
+        # 当前单目标模型有蒸馏学生（distill_student.py 生成）时可选用学生模型做高吞吐筛选
+        student, student_report = None, None
+        if selected_model_info is not None and selected_model_info["target"] != "All":
+            student_path = student_paths(selected_model_info["file"])[0]
+            student, student_report = get_student(selected_model_info["file"], artifact_fingerprint(student_path))
+        use_student = False
+        if student is not None:
+            fidelity = (student_report or {}).get("fidelity", {})
+            speedup = (student_report or {}).get("throughput_rows_per_s", {}).get("speedup")
+            use_student = st.checkbox(
+                "使用蒸馏学生模型（高吞吐筛选）", key="batch_use_student",
+                help=f"单个浅层GBDT近似当前模型：相对原模型 RMSE {fidelity.get('rmse', float('nan')):.4f}，"
+                     f"吞吐量提升 {speedup or float('nan'):.1f}x；用于初筛，关键结果请用原模型复核"
             )
 
-        # 显示模型状态
-        if not predictor.model_loaded:
-            result_container.markdown(
-                "<div class='error-box'><b>⚠️ 错误：</b> 模型未成功加载，无法执行预测。请检查模型文件是否存在。</div>",
-                unsafe_allow_html=True
+        if st.button("📤 提交批量任务", key="batch_submit", use_container_width=True,
+                     disabled=uploaded_file is None):
+            if selected_model_info is None:
+                st.error("请先在 Model Selection 中选择具体模型")
+            else:
+                batch_predictor = create_predictor_for_model(st.session_state.selected_model, selected_model_info)
+                if not batch_predictor.model_loaded or batch_predictor.pipeline is None:
+                    st.error(f"无法加载模型: {selected_model_info['file']}")
+                else:
+                    # 只把模型对象交给工作线程，工作线程中不访问st.session_state
+                    batch_pipeline = batch_predictor.pipeline
+                    if selected_model_info["target"] == "All":
+                        output_names = batch_predictor.target_cols
+                    else:
+                        output_names = [selected_model_info["target"]]
+                    batch_dtype = "float32" if use_float32 else "float64"
+                    model_key = selected_model_info["file"]
+                    if use_student:
+                        batch_pipeline = student
+                        model_key = f"{model_key}#student"
+                    job_id = batch_manager.submit(
+                        uploaded_file.getvalue(),
+                        uploaded_file.name,
+                        model_key=model_key,
+                        score_fn=make_array_predict(batch_pipeline, batch_dtype, budget=get_thread_budget()),
+                        feature_names=batch_predictor.feature_names,
+                        output_names=output_names,
+                        domain_checker=batch_predictor.domain_checker,
+                        similarity_index=get_similarity_index(),
+                        dtype=batch_dtype
+                    )
+                    if job_id not in st.session_state.batch_job_ids:
+                        st.session_state.batch_job_ids.append(job_id)
+                    log(f"提交批量预测任务: {job_id} ({uploaded_file.name}, {model_key})")
+
+        # 有排队或运行中的任务时每2秒自动刷新任务列表，只重跑本片段
+        has_active_jobs = any(
+            (batch_manager.get(job_id) or {}).get('status') in ("queued", "running")
+            for job_id in st.session_state.batch_job_ids
+        )
+
+        @st.fragment(run_every=2 if has_active_jobs else None)
+        def batch_jobs_fragment():
+            """显示本会话提交的任务"""
+            export_format = None
+            if st.session_state.batch_job_ids:
+                export_format = st.radio("导出格式", available_formats(), horizontal=True, key="batch_export_format")
+            for job_id in reversed(st.session_state.batch_job_ids):
+                job = batch_manager.get(job_id)
+                if job is None:
+                    continue
+                status_text = f"任务 {job_id} · {job['file_name']} · {job['model_key']} · {job['status_label']}"
+                if job['cached']:
+                    status_text += "（命中缓存）"
+                st.markdown(status_text)
+                if job['status'] in ("queued", "running"):
+                    st.progress(job['progress'], text=f"{job['processed_rows']}/{job['total_rows']} 行")
+                elif job['status'] == "done":
+                    result_df = batch_manager.result(job_id)
+                    if result_df is not None:
+                        # 点击下载时才在后台线程中流式生成文件，相同结果相同格式只生成一次
+                        extension, mime = EXPORT_FORMATS[export_format]
+                        st.download_button(
+                            f"⬇️ 下载结果 ({export_format.upper()})",
+                            data=deferred_download(lambda df=result_df: df, export_format,
+                                                   cache_key=f"{job['input_hash']}|{export_format}"),
+                            file_name=f"batch_{job_id}{extension}",
+                            mime=mime,
+                            key=f"batch_download_{job_id}"
+                        )
+                    else:
+                        st.markdown("结果已从缓存中淘汰，请重新提交文件。")
+                elif job['status'] == "failed":
+                    st.markdown(f"<div class='error-box'>❌ {job['error']}</div>", unsafe_allow_html=True)
+
+            if st.session_state.batch_job_ids:
+                st.button("🔄 刷新任务状态", key="batch_refresh")
+
+            # run_every只在整页重跑时重新计算：最后一个任务结束后整页重跑一次，停止轮询
+            if has_active_jobs and not any(
+                (batch_manager.get(job_id) or {}).get('status') in ("queued", "running")
+                for job_id in st.session_state.batch_job_ids
+            ):
+                st.rerun(scope="app")
+
+        batch_jobs_fragment()
+
+    # 部分依赖 / ICE 分析 - 在批量预测路径上一次打分整个设计矩阵
+    with st.expander("📈 部分依赖 / ICE 分析", expanded=False):
+        st.markdown("分析某个特征在整批数据上如何影响预测。背景数据使用上方批量预测上传的文件，未上传时在训练范围内采样500行。")
+        pdp_features = predictor.feature_names
+        pdp_feature = st.selectbox("特征", pdp_features, key="pdp_feature")
+        pdp_feature2 = st.selectbox("交互特征（可选）", ["无"] + [f for f in pdp_features if f != pdp_feature],
+                                    key="pdp_feature2")
+        pdp_points = st.slider("网格点数", 5, 40, 20, key="pdp_grid_points")
+
+        if st.button("📈 计算部分依赖", key="pdp_compute", use_container_width=True):
+            selected_model_info = next(
+                (m for m in specific_models.get(st.session_state.selected_model, [])
+                 if m["name"] == st.session_state.selected_specific_model),
+                None
             )
+            pdp_predictor = create_predictor_for_model(st.session_state.selected_model, selected_model_info) \
+                if selected_model_info is not None else None
+            if pdp_predictor is None or not pdp_predictor.model_loaded or pdp_predictor.pipeline is None:
+                st.error("请先在 Model Selection 中选择可用的具体模型")
+            else:
+                rng = np.random.default_rng(0)
+                if uploaded_file is not None:
+                    background = read_input_table(uploaded_file.getvalue(), uploaded_file.name)
+                    background = background[pdp_predictor.feature_names].dropna().to_numpy(dtype=np.float64)
+                    if len(background) > 500:
+                        background = background[rng.choice(len(background), 500, replace=False)]
+                else:
+                    background = np.column_stack([
+                        rng.uniform(pdp_predictor.training_ranges[name]['min'], pdp_predictor.training_ranges[name]['max'], 500)
+                        for name in pdp_predictor.feature_names
+                    ])
+                model_version = get_model_registry().get_version(pdp_predictor.model_path)
+                model_hash = model_version.digest if model_version is not None else artifact_fingerprint(pdp_predictor.model_path)
+                output_names = pdp_predictor.target_cols if selected_model_info["target"] == "All" else [selected_model_info["target"]]
+                score_fn = make_array_predict(pdp_predictor.pipeline, "float64", budget=get_thread_budget())
+
+                def pdp_grid(name):
+                    column = background[:, pdp_predictor.feature_names.index(name)]
+                    return make_grid(column, pdp_points, pdp_predictor.training_ranges.get(name))
+
+                if pdp_feature2 == "无":
+                    st.session_state.pdp_result = get_partial_dependence().ice(
+                        score_fn, background, pdp_predictor.feature_names, pdp_feature, pdp_grid(pdp_feature),
+                        model_hash, output_names)
+                else:
+                    st.session_state.pdp_result = get_partial_dependence().interaction(
+                        score_fn, background, pdp_predictor.feature_names, [pdp_feature, pdp_feature2],
+                        [pdp_grid(pdp_feature), pdp_grid(pdp_feature2)], model_hash, output_names)
+                log(f"部分依赖: {' × '.join(st.session_state.pdp_result.features)}, "
+                    f"打分 {st.session_state.pdp_result.rows_scored} 行, 耗时 {st.session_state.pdp_result.seconds:.2f} 秒")
+
+        pdp_result = st.session_state.get("pdp_result")
+        if pdp_result is not None:
+            st.caption(f"{' × '.join(pdp_result.features)} · 打分 {pdp_result.rows_scored} 行 · "
+                       f"{pdp_result.seconds:.2f} 秒（相同模型、特征、网格和背景数据的结果已缓存）")
+            if len(pdp_result.features) == 1:
+                st.line_chart(pdp_result.average_frame())
+                if st.checkbox("显示ICE曲线（前30行，第一个输出）", key="pdp_show_ice"):
+                    ice = pdp_result.ice.reshape(pdp_result.ice.shape[0], len(pdp_result.grids[0]), -1)[:30, :, 0]
+                    st.line_chart(pd.DataFrame(ice.T, index=pd.Index(pdp_result.grids[0], name=pdp_result.features[0])))
+            else:
+                output_names = pdp_result.output_names or ["输出"]
+                output_index = st.radio("输出", range(len(output_names)), format_func=lambda i: output_names[i],
+                                        horizontal=True, key="pdp_surface_output")
+                st.dataframe(pdp_result.surface_frame(output_index).round(3), use_container_width=True)
 
-        # 显示警告
-        if st.session_state.warnings:
-            warnings_html = "<div class='warning-box'><b>⚠️ 输入警告</b><ul>"
-            for warning in st.session_state.warnings:
-                warnings_html += f"<li>{warning}</li>"
-            warnings_html += "</ul><p><i>建议调整输入值以获得更准确的预测结果。</i></p></div>"
-            result_container.markdown(warnings_html, unsafe_allow_html=True)
-
-
-
-    elif st.session_state.prediction_error is not None:
-        st.markdown("---")
-        error_html = f"""
-        <div class='error-box'>
-            <h3>❌ 预测失败</h3>
-            <p><b>错误信息:</b> {st.session_state.prediction_error}</p>
-            <p><b>可能的解决方案:</b></p>
-            <ul>
-                <li>确保模型文件 (.joblib) 存在于应用目录中</li>
-                <li>检查模型文件名是否包含对应的关键词 (gbdt/rf/cat)</li>
-                <li>验证输入数据格式是否正确</li>
-                <li>确认特征顺序：Feature1-Feature9</li>
-                <li>检查模型是否支持多目标输出 (Cd, Pb, Hg)</li>
-            </ul>
-        </div>
-        """
-        st.markdown(error_html, unsafe_allow_html=True)
\ No newline at end of file
+# 记录整页重跑耗时（片段重跑不会执行到这里）
+record_rerun_timing("full", time.perf_counter() - _rerun_start)
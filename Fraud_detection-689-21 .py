@@ -6,17 +6,24 @@ Biomass Pyrolysis Yield Forecast using GBDT Ensemble Models
 """
 
 import streamlit as st
-import pandas as pd
 import numpy as np
 import os
 import glob
 import joblib
+import json
+import time
 import traceback
 import matplotlib.pyplot as plt
 from datetime import datetime
 
-# 清除缓存，强制重新渲染
-st.cache_data.clear()
+from domain_check import DomainChecker
+from static_assets import asset_url, background_image_declarations
+from shadow_eval import ShadowEvaluator
+from feature_schema import compile_schema
+from float32_inference import predict_array
+from thread_budget import ThreadBudget
+from fingerprint import artifact_fingerprint, code_fingerprint, fingerprint
+
 
 # 页面设置
 st.set_page_config(
@@ -40,7 +47,7 @@ st.markdown(
 
     /* 主应用背景 */
     .stApp {
-        background-image: url('https://raw.githubusercontent.com/HwyzsyHwy/APP-/main/背景.png');
+        """ + background_image_declarations("背景.png") + """
         background-size: cover;
         background-position: center;
         background-repeat: no-repeat;
@@ -552,9 +559,9 @@ if 'current_page' not in st.session_state:
 # 创建侧边栏导航
 with st.sidebar:
     # 用户信息区域
-    st.markdown("""
+    st.markdown(f"""
     <div class="user-info">
-        <img src="https://raw.githubusercontent.com/HwyzsyHwy/APP-/main/用户.png" class="user-avatar" alt="用户头像">
+        <img src="{asset_url('用户.png', width=128)}" class="user-avatar" alt="用户头像">
         <p class="user-name">用户：wy1122</p>
     </div>
     """, unsafe_allow_html=True)
@@ -1420,6 +1427,38 @@ if st.session_state.current_page == "预测模型":
 
 
 
+# 影子评估配置：目标 -> 候选模型文件，通过环境变量以JSON设置，例如
+# SHADOW_CANDIDATE_MODELS='{"Char Yield": "GBDT-Char Yield-retrained.joblib"}'
+# 候选模型只在后台线程中评分，耗时和输出差值写入 shadow_metrics.jsonl，不影响返回的预测结果
+SHADOW_CANDIDATE_MODELS = json.loads(os.environ.get("SHADOW_CANDIDATE_MODELS", "{}"))
+
+@st.cache_resource
+def get_shadow_evaluator(target_name):
+    """获取目标对应的影子评估器（进程级共享），未配置候选模型时返回None"""
+    candidate_path = SHADOW_CANDIDATE_MODELS.get(target_name)
+    if not candidate_path:
+        return None
+    return ShadowEvaluator(candidate_path)
+
+@st.cache_resource
+def get_thread_budget():
+    """进程级共享的线程预算：并发会话按当前并发数分配线程，避免线程超订"""
+    return ThreadBudget.from_env()
+
+# 缓存按模型文件和预测器代码的指纹失效（见fingerprint.py），不再在每次重跑时清空整个缓存
+@st.cache_data
+def cached_model_info(_predictor, cache_fingerprint):
+    """模型信息摘要（所有会话共享，模型文件或预测器代码变化后重新生成）"""
+    return _predictor.get_model_info()
+
+def model_info_fingerprint(predictor):
+    """模型信息的缓存键：目标、模型文件内容、预测器代码和加载状态"""
+    model_path = getattr(predictor, 'model_path', None)
+    return fingerprint(
+        predictor.target_name, model_path, artifact_fingerprint(model_path),
+        code_fingerprint(type(predictor)), predictor.model_loaded
+    )
+
 class ModelPredictor:
     """根据图片特征统计信息正确调整的预测器类"""
     
@@ -1458,6 +1497,22 @@ class ModelPredictor:
             'HR(°C/min)': 'HR(℃/min)'
         }
         
+        # 由训练范围构建向量化适用域检查器
+        self.domain_checker = DomainChecker.from_ranges(self.training_ranges, self.feature_names)
+        
+        # 特征映射和缺失特征默认值（根据图片统计信息的均值）预编译为特征模式，进程内只编译一次
+        self.feature_schema = compile_schema(self.feature_names, self.ui_to_model_mapping, {
+            'M(wt%)': 6.430226,
+            'Ash(wt%)': 4.498340,
+            'VM(wt%)': 75.375509,
+            'O/C': 0.715385,
+            'H/C': 1.534106,
+            'N/C': 0.034083,
+            'FT(℃)': 505.811321,
+            'HR(℃/min)': 29.011321,
+            'FR(mL/min)': 93.962264
+        })
+        
         self.last_features = {}  # 存储上次的特征值
         self.last_result = None  # 存储上次的预测结果
         
@@ -1578,60 +1633,21 @@ class ModelPredictor:
             return False
     
     def check_input_range(self, features):
-        """检查输入值是否在训练数据范围内"""
-        warnings = []
-        
-        for feature, value in features.items():
-            # 获取映射后的特征名
-            mapped_feature = self.ui_to_model_mapping.get(feature, feature)
-            range_info = self.training_ranges.get(mapped_feature)
-            
-            if range_info:
-                if value < range_info['min'] or value > range_info['max']:
-                    warning = f"{feature}: {value:.3f} (超出训练范围 {range_info['min']:.3f} - {range_info['max']:.3f})"
-                    warnings.append(warning)
-                    log(f"警告: {warning}")
+        """检查输入值是否在训练数据范围内（向量化适用域检查）"""
+        result = self.domain_checker.check(features, name_mapping=self.ui_to_model_mapping)
+        model_to_ui = {model: ui for ui, model in self.ui_to_model_mapping.items() if ui in features}
+        warnings = result.warnings(0, decimals=3, display_names=model_to_ui)
+        for warning in warnings:
+            log(f"警告: {warning}")
         
         return warnings
     
     def _prepare_features(self, features):
-        """准备特征，确保顺序与训练时一致"""
-        # 创建特征字典，按训练时的顺序
-        model_features = {}
-        
-        # 首先将UI特征映射到模型特征名称
-        for ui_feature, value in features.items():
-            model_feature = self.ui_to_model_mapping.get(ui_feature, ui_feature)
-            if model_feature in self.feature_names:
-                model_features[model_feature] = value
-                if ui_feature != model_feature:
-                    log(f"特征映射: '{ui_feature}' -> '{model_feature}'")
-        
-        # 确保所有特征都存在，缺失的设为均值（根据图片统计信息）
-        feature_defaults = {
-            'M(wt%)': 6.430226,
-            'Ash(wt%)': 4.498340,
-            'VM(wt%)': 75.375509,
-            'O/C': 0.715385,
-            'H/C': 1.534106,
-            'N/C': 0.034083,
-            'FT(℃)': 505.811321,
-            'HR(℃/min)': 29.011321,
-            'FR(mL/min)': 93.962264
-        }
-        
-        for feature in self.feature_names:
-            if feature not in model_features:
-                default_value = feature_defaults.get(feature, 0.0)
-                model_features[feature] = default_value
-                log(f"警告: 特征 '{feature}' 缺失，设为默认值: {default_value}")
-        
-        # 创建DataFrame并按照正确顺序排列列
-        df = pd.DataFrame([model_features])
-        df = df[self.feature_names]  # 确保列顺序与训练时一致
-        
-        log(f"准备好的特征DataFrame形状: {df.shape}, 列: {list(df.columns)}")
-        return df
+        """按预编译的特征模式把输入整理为训练时顺序的C连续特征矩阵（不构建DataFrame）"""
+        for feature in self.feature_schema.missing(features.keys()):
+            default_value = self.feature_schema.default_row[self.feature_schema.position[feature]]
+            log(f"警告: 特征 '{feature}' 缺失，设为默认值: {default_value}")
+        return self.feature_schema.transform(features)
     
     def predict(self, features):
         """预测方法 - 使用Pipeline进行预测"""
@@ -1655,16 +1671,26 @@ class ModelPredictor:
         
         # 准备特征数据
         log(f"开始准备{len(features)}个特征数据进行预测")
-        features_df = self._prepare_features(features)
+        features_matrix = self._prepare_features(features)
         
         # 使用Pipeline进行预测
         if self.model_loaded and self.pipeline is not None:
             try:
                 log("使用Pipeline进行预测（包含RobustScaler预处理）")
-                # Pipeline会自动进行预处理（RobustScaler）然后预测
-                result = float(self.pipeline.predict(features_df)[0])
+                # 逐步执行Pipeline（RobustScaler预处理）然后预测
+                start_time = time.perf_counter()
+                with get_thread_budget().reserve() as thread_count:
+                    result = float(predict_array(self.pipeline, features_matrix, thread_count)[0])
+                live_ms = (time.perf_counter() - start_time) * 1000.0
                 log(f"预测成功: {result:.4f}")
                 self.last_result = result
+                
+                # 影子评估：候选模型在后台评分，不等待其结果
+                shadow_evaluator = get_shadow_evaluator(self.target_name)
+                if shadow_evaluator is not None:
+                    model_path = getattr(self, 'model_path', None)
+                    live_name = os.path.basename(model_path) if model_path else self.target_name
+                    shadow_evaluator.submit(self.feature_schema.to_frame(features_matrix), result, live_ms, live_name)
                 return result
             except Exception as e:
                 log(f"Pipeline预测失败: {str(e)}")
@@ -1673,7 +1699,8 @@ class ModelPredictor:
                 # 尝试重新加载模型
                 if self._find_model_file() and self._load_pipeline():
                     try:
-                        result = float(self.pipeline.predict(features_df)[0])
+                        with get_thread_budget().reserve() as thread_count:
+                            result = float(predict_array(self.pipeline, features_matrix, thread_count)[0])
                         log(f"重新加载后预测成功: {result:.4f}")
                         self.last_result = result
                         return result
@@ -1719,7 +1746,7 @@ predictor = ModelPredictor(target_model=st.session_state.selected_model)
 # 根据当前页面显示不同内容
 if st.session_state.current_page == "模型信息":
     # 只显示模型信息内容，不显示标题和其他内容
-    model_info = predictor.get_model_info()
+    model_info = cached_model_info(predictor, model_info_fingerprint(predictor))
 
     # 构建完整的HTML内容
     info_content = '<div class="page-content">'
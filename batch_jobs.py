@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+批量预测任务队列
+在后台线程池中执行大文件批量预测，任务进度保存在进程级注册表中（不依赖st.session_state），
+页面重跑或控件交互不会中断正在运行的任务；相同模型+相同输入文件的结果按内容哈希缓存，
+重复提交可立即返回。
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from float32_inference import to_float32_matrix
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# 状态在界面上的显示名称
+JOB_STATUS_LABELS = {
+    JOB_QUEUED: "排队中",
+    JOB_RUNNING: "运行中",
+    JOB_DONE: "已完成",
+    JOB_FAILED: "失败",
+}
+
+
+def compute_input_hash(file_bytes, model_key=""):
+    """计算输入文件内容（加上模型标识）的哈希值，用作结果缓存键"""
+    hasher = hashlib.sha256()
+    hasher.update(str(model_key).encode("utf-8"))
+    hasher.update(b"\0")
+    hasher.update(file_bytes)
+    return hasher.hexdigest()
+
+
+def read_input_table(file_bytes, file_name):
+    """根据文件扩展名读取CSV或Excel文件为DataFrame"""
+    ext = os.path.splitext(file_name)[1].lower()
+    buffer = io.BytesIO(file_bytes)
+    if ext in (".xlsx", ".xls"):
+        return pd.read_excel(buffer)
+    if ext in (".csv", ".txt"):
+        return pd.read_csv(buffer)
+    raise ValueError(f"不支持的文件格式: {ext}（仅支持 .csv / .xlsx）")
+
+
+def read_table(path):
+    """读取本地CSV或Excel文件为DataFrame（命令行工具使用，格式判断同read_input_table）"""
+    with open(path, "rb") as f:
+        return read_input_table(f.read(), path)
+
+
+class BatchJob:
+    """单个批量预测任务的状态记录"""
+
+    def __init__(self, job_id, input_hash, file_name, model_key, dtype="float64"):
+        self.job_id = job_id
+        self.input_hash = input_hash
+        self.file_name = file_name
+        self.model_key = model_key
+        self.dtype = dtype
+        self.status = JOB_QUEUED
+        self.total_rows = 0
+        self.processed_rows = 0
+        self.error = None
+        self.cached = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def progress(self):
+        """任务进度（0~1）"""
+        if self.status == JOB_DONE:
+            return 1.0
+        if self.total_rows <= 0:
+            return 0.0
+        return min(1.0, self.processed_rows / self.total_rows)
+
+    def snapshot(self):
+        """返回任务状态的只读字典，供界面轮询显示"""
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "job_id": self.job_id,
+            "input_hash": self.input_hash,
+            "file_name": self.file_name,
+            "model_key": self.model_key,
+            "dtype": self.dtype,
+            "status": self.status,
+            "status_label": JOB_STATUS_LABELS.get(self.status, self.status),
+            "progress": self.progress,
+            "total_rows": self.total_rows,
+            "processed_rows": self.processed_rows,
+            "error": self.error,
+            "cached": self.cached,
+            "elapsed": elapsed,
+        }
+
+
+class BatchJobManager:
+    """批量预测任务管理器 - 进程内共享，所有会话共用同一个线程池和结果缓存"""
+
+    def __init__(self, max_workers=2, chunk_size=2000, max_cached_results=20):
+        self.chunk_size = chunk_size
+        self.max_cached_results = max_cached_results
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-job")
+        self._lock = threading.Lock()
+        self._jobs = {}                  # job_id -> BatchJob
+        self._active = {}                # input_hash -> job_id（排队或运行中的任务）
+        self._results = OrderedDict()    # input_hash -> 结果DataFrame（LRU）
+
+    def submit(self, file_bytes, file_name, model_key, score_fn, feature_names, output_names,
+               domain_checker=None, similarity_index=None, dtype="float64"):
+        """
+        提交批量预测任务
+
+        参数:
+            file_bytes: 上传文件的原始字节
+            file_name: 文件名（用于判断格式）
+            model_key: 模型标识（文件名或哈希），参与结果缓存键
+            score_fn: 预测函数，输入按feature_names排列的DataFrame，返回预测数组
+            feature_names: 模型需要的特征列
+            output_names: 预测输出列名
+            domain_checker: 适用域检查器（可选），提供时结果中附加每行越界特征数和越界特征列
+            similarity_index: 训练集近邻相似度索引（可选），提供时结果中附加近邻距离、相似度和外推标记
+            dtype: "float64"（默认，score_fn接收DataFrame）或 "float32"（score_fn接收C连续的float32数组，
+                   见float32_inference.make_array_predict）；结果列始终为float64
+
+        返回:
+            任务ID
+        """
+        input_hash = compute_input_hash(file_bytes, f"{model_key}|{dtype}")
+        job = BatchJob(uuid.uuid4().hex[:12], input_hash, file_name, model_key, dtype)
+
+        with self._lock:
+            # 结果已缓存：直接标记完成
+            if input_hash in self._results:
+                self._results.move_to_end(input_hash)
+                result = self._results[input_hash]
+                job.status = JOB_DONE
+                job.cached = True
+                job.total_rows = job.processed_rows = len(result)
+                job.started_at = job.finished_at = time.time()
+                self._jobs[job.job_id] = job
+                return job.job_id
+
+            # 相同输入的任务正在运行：复用该任务
+            if input_hash in self._active:
+                return self._active[input_hash]
+
+            self._jobs[job.job_id] = job
+            self._active[input_hash] = job.job_id
+
+        self._executor.submit(self._run, job, file_bytes, score_fn, list(feature_names), list(output_names),
+                              domain_checker, similarity_index)
+        return job.job_id
+
+    def _run(self, job, file_bytes, score_fn, feature_names, output_names, domain_checker=None,
+             similarity_index=None):
+        """在工作线程中执行批量预测"""
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            data = read_input_table(file_bytes, job.file_name)
+            missing = [name for name in feature_names if name not in data.columns]
+            if missing:
+                raise ValueError(f"输入文件缺少以下特征列: {missing}")
+
+            features = data[feature_names].apply(pd.to_numeric, errors="coerce")
+            invalid_rows = features.isna().any(axis=1)
+            job.total_rows = len(features)
+            # float32路径：一次性整理为C连续的float32矩阵，分块时直接切片
+            matrix = to_float32_matrix(features) if job.dtype == "float32" else None
+
+            predictions = np.full((len(features), len(output_names)), np.nan)
+            valid_index = np.flatnonzero(~invalid_rows.to_numpy())
+            job.processed_rows = int(invalid_rows.sum())
+
+            # 分块预测，每块结束后更新进度
+            for start in range(0, len(valid_index), self.chunk_size):
+                rows = valid_index[start:start + self.chunk_size]
+                chunk = matrix[rows] if matrix is not None else features.iloc[rows]
+                chunk_pred = np.asarray(score_fn(chunk), dtype=float).reshape(len(rows), -1)
+                # 输出列数与输出名称不一致说明模型与所选目标不匹配，不能按位置贴标签
+                if chunk_pred.shape[1] != len(output_names):
+                    raise ValueError(f"模型输出 {chunk_pred.shape[1]} 列，与输出名称 {output_names} 不一致")
+                predictions[rows] = chunk_pred
+                job.processed_rows += len(rows)
+
+            result = data.copy()
+            for i, name in enumerate(output_names):
+                result[f"{name}_pred"] = predictions[:, i]
+            if domain_checker is not None:
+                domain = domain_checker.check(features)
+                result["越界特征数"] = domain.violation_count
+                result["越界特征"] = domain.out_of_range_labels()
+            if similarity_index is not None:
+                similarity = similarity_index.query(features)
+                result["近邻距离"] = similarity["knn_distance"].to_numpy()
+                result["训练集相似度"] = similarity["similarity"].to_numpy()
+                result["外推"] = similarity["extrapolation"].to_numpy()
+            if invalid_rows.any():
+                result["备注"] = np.where(invalid_rows, "特征值无效，未预测", "")
+
+            with self._lock:
+                self._results[job.input_hash] = result
+                self._results.move_to_end(job.input_hash)
+                while len(self._results) > self.max_cached_results:
+                    self._results.popitem(last=False)
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error = f"{str(e)}"
+            job.status = JOB_FAILED
+            print(f"批量任务 {job.job_id} 失败: {e}\n{traceback.format_exc()}")
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active.pop(job.input_hash, None)
+
+    def get(self, job_id):
+        """获取任务状态快照，任务不存在时返回None"""
+        job = self._jobs.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def result(self, job_id):
+        """获取已完成任务的结果DataFrame，未完成或已被淘汰时返回None"""
+        job = self._jobs.get(job_id)
+        if job is None or job.status != JOB_DONE:
+            return None
+        with self._lock:
+            return self._results.get(job.input_hash)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+静态资源构建脚本
+把应用使用的背景图和用户头像生成缩小尺寸的WebP/PNG版本，文件名带内容哈希，
+输出到 static/ 目录并写入 static/asset_manifest.json，供应用通过
+Streamlit静态文件服务（app/static/...）加载，不再依赖raw.githubusercontent.com。
+
+用法:
+    python build_static_assets.py
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT_DIR, "static")
+MANIFEST_NAME = "asset_manifest.json"
+
+# 源文件 -> (ASCII文件名前缀, 需要生成的宽度；None表示保持原始尺寸)
+ASSETS = {
+    "背景.png": ("background", [None, 640]),
+    "用户.png": ("user-avatar", [128, 64]),
+}
+
+WEBP_QUALITY = 80
+
+
+def _encode(image, fmt):
+    """把图片编码为指定格式的字节"""
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=6)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _resize(image, width):
+    """按宽度等比缩小图片，不放大"""
+    if width is None or width >= image.width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def build_assets(source_dir=ROOT_DIR, static_dir=STATIC_DIR):
+    """生成所有静态资源变体并写入清单，返回清单字典"""
+    os.makedirs(static_dir, exist_ok=True)
+    manifest = {}
+    produced = set()
+
+    for source_name, (prefix, widths) in ASSETS.items():
+        source_path = os.path.join(source_dir, source_name)
+        if not os.path.exists(source_path):
+            print(f"警告: 未找到源文件 {source_path}，跳过")
+            continue
+
+        with Image.open(source_path) as source:
+            source.load()
+            original_size = os.path.getsize(source_path)
+            variants = []
+            for width in widths:
+                resized = _resize(source, width)
+                for fmt in ("webp", "png"):
+                    data = _encode(resized, fmt)
+                    digest = hashlib.sha256(data).hexdigest()[:10]
+                    file_name = f"{prefix}.{resized.width}w.{digest}.{fmt}"
+                    file_path = os.path.join(static_dir, file_name)
+                    if not os.path.exists(file_path):
+                        with open(file_path, "wb") as f:
+                            f.write(data)
+                    produced.add(file_name)
+                    variants.append({
+                        "file": file_name,
+                        "format": fmt,
+                        "width": resized.width,
+                        "height": resized.height,
+                        "bytes": len(data),
+                        "hash": digest,
+                    })
+                    print(f"{source_name} -> {file_name} ({len(data) / 1024:.1f} KB，原始 {original_size / 1024:.1f} KB)")
+
+        manifest[source_name] = {"name": prefix, "variants": variants}
+
+    # 删除旧版本的哈希文件，避免static目录无限增长
+    prefixes = tuple(f"{prefix}." for prefix, _ in ASSETS.values())
+    for file_name in os.listdir(static_dir):
+        if file_name.startswith(prefixes) and file_name not in produced:
+            os.remove(os.path.join(static_dir, file_name))
+            print(f"删除过期资源: {file_name}")
+
+    with open(os.path.join(static_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成带内容哈希的WebP/PNG静态资源")
+    parser.add_argument("--source-dir", default=ROOT_DIR, help="源图片所在目录")
+    parser.add_argument("--static-dir", default=STATIC_DIR, help="输出目录（Streamlit静态文件目录）")
+    args = parser.parse_args()
+
+    build_assets(args.source_dir, args.static_dir)
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+降级模式：预计算预测表
+模型文件无法加载或下载时，应用不再在请求时用随机数据训练备用模型，而是查询离线生成的预测表：
+    - 在训练范围（training_ranges）内做拉丁超立方采样，用模型预测，采样点和输出以数组形式保存为.npz
+    - 查询时在归一化坐标上取k个最近采样点做反距离加权插值（KD树，单次查询几十微秒）
+    - 生成时用独立的留出点估计查表误差，随结果一起报告，界面上明确标注为近似值
+
+预测表按模型文件名保存在 degraded_tables/ 目录（如 degraded_tables/multi_GBDT.npz），与模型文件一起提交到仓库
+（Streamlit Cloud 部署没有构建步骤，应用只读取预测表）；模型文件更新后重新生成:
+    python degraded_mode.py --models multi_GBDT.joblib single_Cd_GBDT.joblib --ranges heavy_metal_ranges.json --targets Cd Pb Hg
+    python degraded_mode.py --models "multi_*.joblib" "single_*.joblib" --ranges heavy_metal_ranges.json --targets Cd Pb Hg --samples 8192
+"""
+
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from batch_jobs import read_table
+from distill_student import latin_hypercube
+from feature_schema import compile_schema
+from model_registry import content_digest, load_joblib
+
+TABLE_DIR = "degraded_tables"
+TABLE_VERSION = 1
+
+
+def table_path(model_file, table_dir=TABLE_DIR):
+    """模型文件（或目录）对应的预测表路径"""
+    name = os.path.splitext(os.path.basename(os.path.normpath(model_file)))[0]
+    return os.path.join(table_dir, f"{name}.npz")
+
+
+class PredictionTable:
+    """在训练范围内采样的预测表，按近邻反距离加权插值近似模型输出"""
+
+    def __init__(self, feature_names, lower, upper, points, outputs, target_names=None, errors=None,
+                 source=None, source_digest=None, created_at=None, k=8, power=2.0):
+        """
+        参数:
+            feature_names: 特征顺序
+            lower, upper: 各特征的采样范围
+            points: 归一化到[0, 1]的采样点 (n_samples, n_features)
+            outputs: 采样点上的模型输出 (n_samples, n_targets)
+            errors: 留出点上的查表误差 {"mae": [...], "p95_abs_error": [...], "max_abs_error": [...]}
+            k: 插值使用的近邻数
+            power: 反距离权重的幂次
+        """
+        self.feature_names = list(feature_names)
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.span = np.where(self.upper > self.lower, self.upper - self.lower, 1.0)
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        self.outputs = np.asarray(outputs, dtype=np.float64).reshape(len(self.points), -1)
+        self.target_names = list(target_names) if target_names is not None else \
+            [f"y{i}" for i in range(self.outputs.shape[1])]
+        self.errors = {name: np.asarray(values, dtype=np.float64) for name, values in (errors or {}).items()}
+        self.source = source
+        self.source_digest = source_digest
+        self.created_at = created_at
+        self.k = max(1, min(int(k), len(self.points)))
+        self.power = float(power)
+        self.tree = cKDTree(self.points)
+        # 字典/DataFrame输入的列映射，缺失特征取范围中点
+        self.schema = compile_schema(self.feature_names, defaults={
+            name: (low + high) / 2.0 for name, low, high in zip(self.feature_names, self.lower, self.upper)
+        })
+
+    @classmethod
+    def build(cls, predict_fn, feature_names, feature_ranges, n_samples=4096, n_holdout=512, seed=0,
+              extra_data=None, target_names=None, source=None, source_digest=None, k=8, power=2.0):
+        """
+        用模型在训练范围内的采样点上生成预测表，并在留出点上估计查表误差
+
+        参数:
+            predict_fn: 接受DataFrame（列为feature_names）并返回预测的函数
+            feature_ranges: {特征: {'min': .., 'max': ..}}
+            extra_data: 可选的真实输入样本（DataFrame），加入采样点；模型输出集中在训练数据附近变化剧烈时，
+                        均匀采样覆盖不到这些区域，加入真实输入可明显降低常用输入附近的查表误差
+        """
+        lower = np.array([feature_ranges[name]['min'] for name in feature_names], dtype=np.float64)
+        upper = np.array([feature_ranges[name]['max'] for name in feature_names], dtype=np.float64)
+        span = np.where(upper > lower, upper - lower, 1.0)
+
+        X = latin_hypercube(feature_ranges, feature_names, n_samples, seed)
+        if extra_data is not None:
+            X = pd.concat([X, extra_data[feature_names].dropna().clip(lower, upper, axis=1)], ignore_index=True)
+        outputs = np.asarray(predict_fn(X), dtype=np.float64).reshape(len(X), -1)
+        table = cls(feature_names, lower, upper, (X.to_numpy() - lower) / span, outputs,
+                    target_names=target_names, source=source, source_digest=source_digest,
+                    created_at=datetime.now().isoformat(timespec="seconds"), k=k, power=power)
+
+        if n_holdout > 0:
+            X_holdout = latin_hypercube(feature_ranges, feature_names, n_holdout, seed + 1)
+            truth = np.asarray(predict_fn(X_holdout), dtype=np.float64).reshape(n_holdout, -1)
+            error = np.abs(table.predict(X_holdout) - truth)
+            table.errors = {
+                "mae": error.mean(axis=0),
+                "p95_abs_error": np.quantile(error, 0.95, axis=0),
+                "max_abs_error": error.max(axis=0),
+            }
+        return table
+
+    def lookup(self, X):
+        """
+        查表
+
+        参数:
+            X: 单行字典、DataFrame或按特征顺序排列的数组
+
+        返回:
+            (predictions, nearest_distance): (n, n_targets) 近似预测、归一化坐标下到最近采样点的距离
+            超出采样范围的输入先截断到范围边界再查表
+        """
+        Z = np.clip((self.schema.transform(X) - self.lower) / self.span, 0.0, 1.0)
+        distances, indices = self.tree.query(Z, k=self.k)
+        if self.k == 1:
+            distances, indices = distances[:, None], indices[:, None]
+        weights = 1.0 / np.maximum(distances, 1e-12) ** self.power
+        weights /= weights.sum(axis=1, keepdims=True)
+        predictions = np.einsum("nk,nkt->nt", weights, self.outputs[indices])
+        return predictions, distances[:, 0]
+
+    def predict(self, X):
+        """近似预测（单目标时返回一维数组，与sklearn模型一致）"""
+        predictions, _ = self.lookup(X)
+        return predictions[:, 0] if predictions.shape[1] == 1 else predictions
+
+    def error_summary(self, decimals=4):
+        """留出点误差的简短说明，如 'Cd: 平均 0.12 / 最大 0.80'"""
+        if "mae" not in self.errors:
+            return "未评估"
+        parts = []
+        for i, name in enumerate(self.target_names):
+            mae = self.errors["mae"][i]
+            max_error = self.errors["max_abs_error"][i] if "max_abs_error" in self.errors else np.nan
+            parts.append(f"{name}: 平均 {mae:.{decimals}f} / 最大 {max_error:.{decimals}f}")
+        return "; ".join(parts)
+
+    def describe(self):
+        """预测表信息（供界面标注降级结果）"""
+        return {
+            "source": self.source,
+            "samples": len(self.points),
+            "targets": self.target_names,
+            "error": self.error_summary(),
+            "created_at": self.created_at,
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {f"error_{name}": values for name, values in self.errors.items()}
+        np.savez_compressed(
+            path,
+            version=np.array(TABLE_VERSION),
+            feature_names=np.array(self.feature_names),
+            target_names=np.array(self.target_names),
+            lower=self.lower,
+            upper=self.upper,
+            points=self.points.astype(np.float32),
+            outputs=self.outputs.astype(np.float32),
+            k=np.array(self.k),
+            power=np.array(self.power),
+            source=np.array(self.source or ""),
+            source_digest=np.array(self.source_digest or ""),
+            created_at=np.array(self.created_at or ""),
+            **arrays
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["version"])
+            if version != TABLE_VERSION:
+                raise ValueError(f"预测表版本不兼容: {version}（需要 {TABLE_VERSION}），请重新生成")
+            errors = {key[len("error_"):]: data[key] for key in data.files if key.startswith("error_")}
+            return cls(
+                data["feature_names"].tolist(), data["lower"], data["upper"], data["points"], data["outputs"],
+                target_names=data["target_names"].tolist(), errors=errors,
+                source=str(data["source"]) or None, source_digest=str(data["source_digest"]) or None,
+                created_at=str(data["created_at"]) or None, k=int(data["k"]), power=float(data["power"]),
+            )
+
+
+class DegradedTables:
+    """按模型文件名懒加载预测表，进程内共享；没有预测表的模型返回None"""
+
+    def __init__(self, table_dir=TABLE_DIR):
+        self.table_dir = table_dir
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_file):
+        if not model_file:
+            return None
+        path = table_path(model_file, self.table_dir)
+        with self._lock:
+            table = self._tables.get(path)
+        if table is None and os.path.exists(path):
+            try:
+                table = PredictionTable.load(path)
+            except Exception as e:
+                print(f"预测表加载失败 {path}: {str(e)}")
+                return None
+            with self._lock:
+                self._tables[path] = table
+        return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为模型生成降级模式预测表")
+    parser.add_argument("--models", nargs="+", required=True, help="joblib模型文件（支持通配符）")
+    parser.add_argument("--ranges", required=True, help="特征范围JSON（{特征: {min, max}}，或包含feature_ranges的metadata.json）")
+    parser.add_argument("--data", help="可选的真实输入样本（.csv / .xlsx），加入采样点")
+    parser.add_argument("--targets", nargs="+", help="多输出模型的目标名称，如 Cd Pb Hg（单目标模型按文件名推断）")
+    parser.add_argument("--samples", type=int, default=4096, help="采样点数")
+    parser.add_argument("--holdout", type=int, default=512, help="误差评估留出点数")
+    parser.add_argument("--k", type=int, default=8, help="插值近邻数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output-dir", default=TABLE_DIR, help="预测表输出目录")
+    args = parser.parse_args()
+
+    with open(args.ranges, 'r', encoding='utf-8') as f:
+        feature_ranges = json.load(f)
+    feature_ranges = feature_ranges.get('feature_ranges', feature_ranges)
+
+    extra_data = None
+    if args.data:
+        extra_data = read_table(args.data)
+
+    model_files = sorted({path for pattern in args.models for path in (glob.glob(pattern) or [pattern])})
+    for model_file in model_files:
+        try:
+            model = load_joblib(model_file)
+        except Exception as e:
+            print(f"跳过 {model_file}: 模型加载失败 ({type(e).__name__}: {str(e)})")
+            continue
+        names = getattr(model, 'feature_names_in_', None)
+        feature_names = list(names) if names is not None else list(feature_ranges)
+        missing = [name for name in feature_names if name not in feature_ranges]
+        if missing:
+            print(f"跳过 {model_file}: 缺少以下特征的范围 {missing}")
+            continue
+
+        # 单目标模型的目标名取自文件名（single_Cd_GBDT.joblib、ensemble_single_Cd.joblib -> Cd），多输出模型使用--targets
+        parts = os.path.splitext(os.path.basename(model_file))[0].split('_')
+        if parts[0] == 'ensemble':
+            parts = parts[1:]
+        target_names = [parts[1]] if parts[0] == 'single' and len(parts) > 1 else args.targets
+
+        start = time.perf_counter()
+        table = PredictionTable.build(
+            lambda X: model.predict(X[feature_names]), feature_names, feature_ranges,
+            n_samples=args.samples, n_holdout=args.holdout, seed=args.seed, extra_data=extra_data,
+            target_names=target_names,
+            source=os.path.basename(model_file), source_digest=content_digest(model_file), k=args.k
+        )
+        output_path = table_path(model_file, args.output_dir)
+        table.save(output_path)
+
+        sample = {name: (feature_ranges[name]['min'] + feature_ranges[name]['max']) / 2.0 for name in feature_names}
+        table.lookup(sample)
+        lookup_start = time.perf_counter()
+        for _ in range(200):
+            table.lookup(sample)
+        lookup_us = (time.perf_counter() - lookup_start) / 200 * 1e6
+
+        print(f"{model_file} -> {output_path} ({os.path.getsize(output_path) / 1024:.0f} KB, "
+              f"生成 {time.perf_counter() - start:.1f} 秒, 单次查表 {lookup_us:.0f} 微秒)")
+        print(f"  留出点误差: {table.error_summary()}")
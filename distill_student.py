@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+集成模型蒸馏
+在特征范围内做拉丁超立方采样，用教师模型（10成员CatBoost集成目录或Stacking等Pipeline文件）
+打标签，训练单个浅层GBDT学生模型，报告学生相对教师的保真度和吞吐量提升。
+学生模型作为备选产物保存在教师旁边，不替换原有模型；重金属应用的批量预测中可勾选使用学生模型做高吞吐筛选。
+
+用法:
+    python distill_student.py --teacher "Char_Yield%_Model"
+    python distill_student.py --teacher "Stacking-CatBoost-XGBoost-Char Yield-improved.joblib" \
+        --ranges ranges.json --samples 50000
+
+产物（与教师同级）:
+    模型目录教师: <模型目录>-student.joblib 和 <模型目录>-student.json
+    模型文件教师: <文件名>-student.joblib 和 <文件名>-student.json
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+
+from batch_jobs import read_table
+from float32_inference import EnsembleDirModel
+from model_registry import load_joblib
+
+
+class PipelineTeacher:
+    """单个joblib模型文件（如Stacking Pipeline），作为蒸馏教师"""
+
+    def __init__(self, model_path):
+        self.model = load_joblib(model_path)
+        names = getattr(self.model, 'feature_names_in_', None)
+        self.feature_names = list(names) if names is not None else None
+        self.feature_ranges = None
+
+    def predict(self, X):
+        if self.feature_names is not None:
+            X = X[self.feature_names]
+        return np.asarray(self.model.predict(X), dtype=float).ravel()
+
+
+def latin_hypercube(feature_ranges, feature_names, n_samples, seed=0):
+    """在各特征的[min, max]范围内做拉丁超立方采样"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name in feature_names:
+        low, high = feature_ranges[name]['min'], feature_ranges[name]['max']
+        strata = (rng.permutation(n_samples) + rng.random(n_samples)) / n_samples
+        columns[name] = low + strata * (high - low)
+    return pd.DataFrame(columns, columns=feature_names)
+
+
+def measure_throughput(predict_fn, X, repeats=3):
+    """测量批量预测吞吐量（行/秒，取最好的一次）"""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict_fn(X)
+        best = min(best, time.perf_counter() - start)
+    return len(X) / best if best > 0 else np.inf
+
+
+def measure_row_latency(predict_fn, X, repeats=30):
+    """测量单行预测延迟（毫秒，取中位数），对应交互式单次预测"""
+    row = X.iloc[:1]
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict_fn(row)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings))
+
+
+def fidelity_report(teacher_pred, student_pred):
+    """学生相对教师的保真度指标"""
+    error = student_pred - teacher_pred
+    total = np.sum((teacher_pred - teacher_pred.mean()) ** 2)
+    return {
+        "rmse": float(np.sqrt(np.mean(error ** 2))),
+        "mae": float(np.mean(np.abs(error))),
+        "max_abs_error": float(np.max(np.abs(error))),
+        "p99_abs_error": float(np.quantile(np.abs(error), 0.99)),
+        "r2": float(1.0 - np.sum(error ** 2) / total) if total > 0 else 0.0,
+    }
+
+
+def make_student(kind="gbdt", max_iter=300, max_depth=4, learning_rate=0.1, seed=0):
+    """
+    创建学生模型
+    gbdt: sklearn GradientBoostingRegressor，单行预测开销小，交互式和中小批量最快
+    hist: HistGradientBoostingRegressor，训练快，适合非常大的采样集，但单次预测有固定的线程调度开销
+    """
+    if kind == "hist":
+        return HistGradientBoostingRegressor(
+            max_iter=max_iter, max_depth=max_depth, learning_rate=learning_rate,
+            early_stopping=True, validation_fraction=0.1, n_iter_no_change=20, random_state=seed
+        )
+    return GradientBoostingRegressor(
+        n_estimators=max_iter, max_depth=max_depth, learning_rate=learning_rate,
+        n_iter_no_change=20, validation_fraction=0.1, random_state=seed
+    )
+
+
+def distill(teacher, feature_ranges, n_samples=20000, n_holdout=5000, seed=0, extra_data=None,
+            student_kind="gbdt", max_iter=300, max_depth=4, learning_rate=0.1):
+    """
+    蒸馏教师模型
+
+    参数:
+        teacher: 具有feature_names和predict(DataFrame)的教师对象
+        feature_ranges: {特征: {'min': .., 'max': ..}}
+        n_samples: 训练用采样点数
+        n_holdout: 评估保真度用的独立采样点数
+        extra_data: 可选的真实输入样本（DataFrame），与采样点一起由教师打标签用于训练
+        student_kind: 学生模型类型，见make_student
+
+    返回:
+        (student, report)
+    """
+    feature_names = teacher.feature_names
+    X_train = latin_hypercube(feature_ranges, feature_names, n_samples, seed)
+    if extra_data is not None:
+        X_train = pd.concat([X_train, extra_data[feature_names].dropna()], ignore_index=True)
+    X_holdout = latin_hypercube(feature_ranges, feature_names, n_holdout, seed + 1)
+
+    start = time.perf_counter()
+    y_train = teacher.predict(X_train)
+    label_seconds = time.perf_counter() - start
+
+    student = make_student(student_kind, max_iter, max_depth, learning_rate, seed)
+    start = time.perf_counter()
+    student.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    teacher_holdout = teacher.predict(X_holdout)
+    student_holdout = student.predict(X_holdout)
+    teacher_rps = measure_throughput(teacher.predict, X_holdout)
+    student_rps = measure_throughput(student.predict, X_holdout)
+    teacher_row_ms = measure_row_latency(teacher.predict, X_holdout)
+    student_row_ms = measure_row_latency(student.predict, X_holdout)
+
+    report = {
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "feature_names": list(feature_names),
+        "feature_ranges": {name: feature_ranges[name] for name in feature_names},
+        "train_samples": int(len(X_train)),
+        "holdout_samples": int(n_holdout),
+        "student": {
+            "type": type(student).__name__,
+            "max_depth": max_depth,
+            "learning_rate": learning_rate,
+            "n_iter": int(getattr(student, 'n_iter_', None) or student.n_estimators_),
+        },
+        "fidelity": fidelity_report(teacher_holdout, student_holdout),
+        "throughput_rows_per_s": {
+            "teacher": float(teacher_rps),
+            "student": float(student_rps),
+            "speedup": float(student_rps / teacher_rps) if teacher_rps > 0 else None,
+        },
+        "row_latency_ms": {
+            "teacher": teacher_row_ms,
+            "student": student_row_ms,
+            "speedup": teacher_row_ms / student_row_ms if student_row_ms > 0 else None,
+        },
+        "timing_s": {"label": label_seconds, "fit": fit_seconds},
+    }
+    return student, report
+
+
+def student_paths(teacher_path):
+    """
+    学生模型和报告的保存路径：放在教师旁边（<教师>-student.joblib / .json），
+    不写入模型目录，避免改变注册表的内容哈希和缓存指纹
+    """
+    teacher_path = os.path.normpath(teacher_path)
+    stem = teacher_path if os.path.isdir(teacher_path) else os.path.splitext(teacher_path)[0]
+    return f"{stem}-student.joblib", f"{stem}-student.json"
+
+
+def load_student(teacher_path):
+    """加载教师对应的学生模型和报告，不存在时返回(None, None)"""
+    model_path, report_path = student_paths(teacher_path)
+    if not os.path.exists(model_path):
+        return None, None
+    report = None
+    if os.path.exists(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    return load_joblib(model_path), report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把集成/Stacking教师模型蒸馏为单个浅层GBDT学生模型")
+    parser.add_argument("--teacher", required=True, help="教师：*_Yield%%_Model目录或joblib模型文件")
+    parser.add_argument("--ranges", help="特征范围JSON（{特征: {min, max}}），教师目录的metadata.json中有feature_ranges时可省略")
+    parser.add_argument("--data", help="可选的真实输入样本（.csv / .xlsx），加入训练集")
+    parser.add_argument("--samples", type=int, default=20000, help="训练采样点数")
+    parser.add_argument("--holdout", type=int, default=5000, help="保真度评估采样点数")
+    parser.add_argument("--student", choices=["gbdt", "hist"], default="gbdt", help="学生模型类型")
+    parser.add_argument("--max-depth", type=int, default=4, help="学生模型树深度")
+    parser.add_argument("--max-iter", type=int, default=300, help="学生模型最大迭代次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    teacher = EnsembleDirModel(args.teacher) if os.path.isdir(args.teacher) else PipelineTeacher(args.teacher)
+
+    feature_ranges = teacher.feature_ranges
+    if args.ranges:
+        with open(args.ranges, 'r', encoding='utf-8') as f:
+            feature_ranges = json.load(f)
+        feature_ranges = feature_ranges.get('feature_ranges', feature_ranges)
+    if teacher.feature_names is None:
+        raise SystemExit("教师模型没有feature_names_in_，无法确定特征顺序")
+    missing = [name for name in teacher.feature_names if not feature_ranges or name not in feature_ranges]
+    if missing:
+        raise SystemExit(f"缺少以下特征的范围，请通过 --ranges 提供: {missing}")
+
+    extra_data = None
+    if args.data:
+        extra_data = read_table(args.data)
+
+    student, report = distill(
+        teacher, feature_ranges, n_samples=args.samples, n_holdout=args.holdout, seed=args.seed,
+        extra_data=extra_data, student_kind=args.student, max_iter=args.max_iter, max_depth=args.max_depth
+    )
+    report["teacher"] = os.path.basename(os.path.normpath(args.teacher))
+
+    model_path, report_path = student_paths(args.teacher)
+    joblib.dump(student, model_path)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    fidelity = report["fidelity"]
+    throughput = report["throughput_rows_per_s"]
+    print(f"学生模型已保存: {model_path}")
+    print(f"保真度: RMSE {fidelity['rmse']:.4f}, MAE {fidelity['mae']:.4f}, "
+          f"最大误差 {fidelity['max_abs_error']:.4f}, R² {fidelity['r2']:.5f}")
+    latency = report["row_latency_ms"]
+    print(f"批量吞吐量: 教师 {throughput['teacher']:.0f} 行/秒, 学生 {throughput['student']:.0f} 行/秒, "
+          f"提升 {throughput['speedup']:.1f}x")
+    print(f"单行延迟: 教师 {latency['teacher']:.2f} ms, 学生 {latency['student']:.2f} ms, "
+          f"提升 {latency['speedup']:.1f}x")
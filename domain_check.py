@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+向量化适用域检查
+根据 metadata.json 中的 feature_ranges / training_ranges（{特征: {min, max}}）构建上下界数组，
+对N行输入一次NumPy运算得到每行每个特征的越界掩码、每行越界数和越界特征，
+替代各预测器中逐特征、逐行的字典循环。
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class DomainCheckResult:
+    """适用域检查结果"""
+
+    def __init__(self, feature_names, lower, upper, values, below, above):
+        self.feature_names = list(feature_names)
+        self.lower = lower
+        self.upper = upper
+        self.values = values
+        self.below = below                      # (n_rows, n_features) 低于下界
+        self.above = above                      # (n_rows, n_features) 高于上界
+        self.mask = below | above               # (n_rows, n_features) 越界掩码
+        self.violation_count = self.mask.sum(axis=1)   # 每行越界特征数
+        self.in_domain = self.violation_count == 0     # 每行是否全部在范围内
+
+    def __len__(self):
+        return self.mask.shape[0]
+
+    def out_of_range_columns(self, row=0):
+        """返回指定行越界的特征名称列表"""
+        return [self.feature_names[j] for j in np.flatnonzero(self.mask[row])]
+
+    def out_of_range_labels(self, separator=","):
+        """
+        返回每行越界特征名称拼接成的字符串数组（在范围内的行为空字符串）
+        按特征列逐列拼接，每一步对所有行做NumPy字符串运算，不按行循环
+        """
+        if not self.mask.any():
+            return np.full(len(self), "", dtype=object)
+        names = np.asarray(self.feature_names, dtype=str)
+        # 该行前面已有越界特征时在名称前加分隔符
+        earlier = (np.cumsum(self.mask, axis=1) - self.mask) > 0
+        cells = np.where(self.mask, np.where(earlier, np.char.add(separator, names), names), "")
+        labels = cells[:, 0]
+        for j in range(1, cells.shape[1]):
+            labels = np.char.add(labels, cells[:, j])
+        return labels.astype(object)
+
+    def column_summary(self):
+        """每个特征的越界行数统计"""
+        return pd.DataFrame({
+            "Feature": self.feature_names,
+            "Min": self.lower,
+            "Max": self.upper,
+            "Below": self.below.sum(axis=0),
+            "Above": self.above.sum(axis=0),
+        })
+
+    def warnings(self, row=0, decimals=3, display_names=None):
+        """
+        生成与原check_input_range一致格式的警告文本
+
+        参数:
+            row: 行号
+            decimals: 数值显示的小数位数
+            display_names: 模型特征名 -> 界面显示名的映射（可选）
+        """
+        messages = []
+        for j in np.flatnonzero(self.mask[row]):
+            name = self.feature_names[j]
+            if display_names:
+                name = display_names.get(name, name)
+            value = self.values[row, j]
+            messages.append(
+                f"{name}: {value:.{decimals}f} (超出训练范围 {self.lower[j]:.{decimals}f} - {self.upper[j]:.{decimals}f})"
+            )
+        return messages
+
+
+class DomainChecker:
+    """基于训练数据范围的向量化适用域检查器"""
+
+    def __init__(self, feature_names, lower, upper):
+        self.feature_names = list(feature_names)
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        if self.lower.shape != (len(self.feature_names),) or self.upper.shape != self.lower.shape:
+            raise ValueError("上下界数组长度必须与特征数量一致")
+        self._index = {name: j for j, name in enumerate(self.feature_names)}
+
+    @classmethod
+    def from_ranges(cls, ranges, feature_names=None):
+        """
+        由 {特征: {'min': .., 'max': ..}} 字典构建检查器
+
+        参数:
+            ranges: 特征范围字典
+            feature_names: 特征顺序（默认使用字典顺序）；没有范围信息的特征不做限制
+        """
+        if feature_names is None:
+            feature_names = list(ranges.keys())
+        lower = [ranges[name]['min'] if name in ranges else -np.inf for name in feature_names]
+        upper = [ranges[name]['max'] if name in ranges else np.inf for name in feature_names]
+        return cls(feature_names, lower, upper)
+
+    def _to_matrix(self, data, name_mapping=None):
+        """把字典、DataFrame或数组转换为按feature_names排列的二维数组，缺失列填NaN（不判为越界）"""
+        if isinstance(data, dict):
+            data = pd.DataFrame([data])
+
+        if isinstance(data, pd.DataFrame):
+            if name_mapping:
+                data = data.rename(columns=name_mapping)
+            matrix = np.full((len(data), len(self.feature_names)), np.nan)
+            for j, name in enumerate(self.feature_names):
+                if name in data.columns:
+                    matrix[:, j] = pd.to_numeric(data[name], errors='coerce').to_numpy(dtype=np.float64)
+            return matrix
+
+        matrix = np.asarray(data, dtype=np.float64)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        if matrix.shape[1] != len(self.feature_names):
+            raise ValueError(f"输入列数 {matrix.shape[1]} 与特征数量 {len(self.feature_names)} 不一致")
+        return matrix
+
+    def check(self, data, name_mapping=None):
+        """
+        检查输入是否在训练范围内
+
+        参数:
+            data: 单行字典、DataFrame（任意列顺序）或 (n_rows, n_features) 数组
+            name_mapping: 输入列名 -> 模型特征名的映射（如 'FT(°C)' -> 'FT(℃)'）
+
+        返回:
+            DomainCheckResult
+        """
+        values = self._to_matrix(data, name_mapping)
+        below = values < self.lower
+        above = values > self.upper
+        return DomainCheckResult(self.feature_names, self.lower, self.upper, values, below, above)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+按内容哈希去重的模型下载缓存
+从GitHub下载的模型以内容哈希命名保存（<缓存目录>/<sha256前16位>.joblib），内容相同的文件只保存一份。
+清单 artifact_manifest.json 记录仓库中各模型文件的内容哈希：下载前先按文件名查到哈希，
+缓存中已有相同内容（例如先下载过 single_Cu_GBDT.joblib，再请求 single_Hg_GBDT.joblib）时直接复用，不再下载；
+下载后校验哈希，与清单不一致时给出提示（远端文件已更新，需重新生成清单）。
+哈希与 model_registry.content_digest 一致，注册表据此在内存中共用同一个已加载对象。
+
+用法:
+    python download_cache.py --build-manifest "*.joblib"          # 生成/更新清单
+    python download_cache.py --duplicates "*.joblib" "*_Model"     # 报告内容相同的模型文件
+"""
+
+import argparse
+import glob
+import json
+import os
+import tempfile
+import threading
+
+from model_registry import content_digest, find_duplicates
+
+MANIFEST_FILE = "artifact_manifest.json"
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "model_download_cache")
+
+
+def load_manifest(path=MANIFEST_FILE):
+    """读取清单 {文件名: {"sha256": .., "size": ..}}，不存在或损坏时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("artifacts", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def build_manifest(paths, path=MANIFEST_FILE):
+    """计算各模型文件的内容哈希并写入清单，返回清单内容"""
+    artifacts = {os.path.basename(p): {"sha256": content_digest(p), "size": os.path.getsize(p)}
+                 for p in sorted(paths) if os.path.isfile(p)}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"artifacts": artifacts}, f, ensure_ascii=False, indent=4)
+    return artifacts
+
+
+def manifest_duplicates(manifest):
+    """清单中内容相同的文件名分组"""
+    groups = {}
+    for name, entry in manifest.items():
+        groups.setdefault(entry["sha256"], []).append(name)
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+class DownloadCache:
+    """内容寻址的下载缓存，进程内共享（并发请求同一内容时只下载一次）"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, manifest_path=MANIFEST_FILE):
+        self.cache_dir = cache_dir
+        self.manifest = load_manifest(manifest_path)
+        self._lock = threading.Lock()
+        self._fetch_locks = {}     # 内容哈希（清单中没有时为文件名） -> 下载锁
+        self._downloaded = {}      # 本进程已下载的文件名 -> 缓存路径（清单中没有的文件也能复用）
+
+    def _blob_path(self, digest, filename):
+        return os.path.join(self.cache_dir, digest[:16] + os.path.splitext(filename)[1])
+
+    def cached_path(self, filename):
+        """本进程下载过该文件，或清单中有该文件且缓存中已有相同内容时返回缓存路径，否则返回None"""
+        with self._lock:
+            path = self._downloaded.get(filename)
+        entry = self.manifest.get(filename)
+        if path is None and entry is not None:
+            path = self._blob_path(entry["sha256"], filename)
+        return path if path is not None and os.path.exists(path) else None
+
+    def fetch(self, filename, download):
+        """
+        获取模型文件：缓存命中时直接返回，否则调用download下载并按内容哈希保存
+
+        参数:
+            filename: 模型文件名
+            download: download(filename) -> bytes，失败时返回None
+
+        返回:
+            本地路径；下载失败时返回None
+        """
+        entry = self.manifest.get(filename)
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(entry["sha256"] if entry else filename, threading.Lock())
+
+        with fetch_lock:
+            path = self.cached_path(filename)
+            if path is not None:
+                print(f"下载缓存 {filename}: 命中 {os.path.basename(path)}（内容相同，跳过下载）")
+                return path
+
+            content = download(filename)
+            if content is None:
+                return None
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                digest = content_digest(temp_path)
+                if entry is not None and entry["sha256"] != digest:
+                    print(f"下载缓存 {filename}: 内容哈希与清单不一致（远端文件可能已更新，请重新生成 {MANIFEST_FILE}）")
+                path = self._blob_path(digest, filename)
+                if os.path.exists(path):
+                    os.remove(temp_path)
+                else:
+                    os.replace(temp_path, path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            with self._lock:
+                self._downloaded[filename] = path
+            print(f"下载缓存 {filename}: 已保存为 {os.path.basename(path)}")
+            return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模型文件内容哈希清单与重复检查")
+    parser.add_argument("--build-manifest", nargs="+", metavar="PATTERN", help="为匹配的模型文件生成清单")
+    parser.add_argument("--duplicates", nargs="+", metavar="PATTERN", help="报告匹配的文件/目录中内容相同的分组")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help="清单文件路径")
+    args = parser.parse_args()
+
+    def expand(patterns):
+        return sorted({path for pattern in patterns for path in (glob.glob(pattern) or [pattern])})
+
+    if args.build_manifest:
+        artifacts = build_manifest(expand(args.build_manifest), args.manifest)
+        print(f"已写入 {args.manifest}: {len(artifacts)} 个文件")
+        for group in manifest_duplicates(artifacts):
+            print(f"  内容相同: {', '.join(group)}")
+    if args.duplicates:
+        groups = find_duplicates(expand(args.duplicates))
+        for group in groups:
+            print(f"内容相同: {', '.join(group)}")
+        if not groups:
+            print("没有内容相同的文件")
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+集成模型分档（快速模式）
+在验证集上为 *_Yield%_Model 目录中的10个CatBoost子模型做贪心前向选择：每一步加入使验证RMSE
+最小的子模型，并对当前子集重新拟合非负且和为1的权重，得到每个子集大小的精度/延迟曲线。
+权重拟合和打分使用不同的数据：子集的验证RMSE按K折交叉拟合计算（每折的权重只在其余折上拟合），
+与full档位（model_weights.npy不依赖验证集）同样是样本外误差，容差比较不偏向缩减档位；
+档位最终权重在全部验证行上拟合，权重为0的子模型从档位中去掉，不计入延迟。
+按相对完整集成的RMSE容差选出 balanced / fast 档位，连同曲线写入 metadata.json 的 "tiers"，
+预测器可按请求选择档位：参数扫描和优化用fast，最终报告用full。
+
+用法:
+    python ensemble_tiers.py --model-dir "Char_Yield%_Model" --data 验证集.xlsx
+    python ensemble_tiers.py --model-dir "Oil_Yield%_Model" --data val.csv --target "Oil Yield(%)" --dry-run
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from batch_jobs import read_table
+from float32_inference import EnsembleDirModel
+
+# 档位名称 -> 相对完整集成验证RMSE的最大允许增幅
+DEFAULT_TIER_TOLERANCES = {"balanced": 0.0025, "fast": 0.01}
+DEFAULT_FOLDS = 5
+# 低于该值的权重视为0，对应子模型不进入档位
+ZERO_WEIGHT = 1e-6
+
+
+def fit_simplex_weights(predictions, y, ridge=1e-8):
+    """
+    拟合非负且和为1的集成权重（只依赖NumPy）
+    先解带等式约束的最小二乘（KKT方程），出现负权重时去掉最负的成员后重解。
+    这是启发式的有效集做法（被去掉的成员不会再加回），不是严格的NNLS，不保证得到约束下的最优解
+
+    参数:
+        predictions: (n_rows, n_members) 子模型预测
+        y: (n_rows,) 真实值
+
+    返回:
+        (n_members,) 权重
+    """
+    n_members = predictions.shape[1]
+    active = list(range(n_members))
+    weights = np.zeros(n_members)
+    while active:
+        A = predictions[:, active]
+        k = len(active)
+        kkt = np.zeros((k + 1, k + 1))
+        kkt[:k, :k] = 2.0 * A.T @ A + ridge * np.eye(k)
+        kkt[:k, k] = 1.0
+        kkt[k, :k] = 1.0
+        rhs = np.concatenate([2.0 * A.T @ y, [1.0]])
+        solution = np.linalg.lstsq(kkt, rhs, rcond=None)[0][:k]
+        if np.all(solution >= 0):
+            weights[:] = 0.0
+            weights[active] = solution
+            return weights
+        active.pop(int(np.argmin(solution)))
+    weights[:] = 1.0 / n_members
+    return weights
+
+
+def _rmse(y, pred):
+    return float(np.sqrt(np.mean((y - pred) ** 2)))
+
+
+def _r2(y, pred):
+    total = np.sum((y - np.mean(y)) ** 2)
+    return float(1.0 - np.sum((y - pred) ** 2) / total) if total > 0 else 0.0
+
+
+def member_predictions(models, scalers, X, repeats=20):
+    """
+    计算每个子模型在验证集上的预测，并测量单行预测延迟（毫秒，取中位数）
+
+    返回:
+        predictions: (n_rows, n_members)
+        latency_ms: (n_members,)
+    """
+    predictions = np.zeros((len(X), len(models)))
+    latency_ms = np.zeros(len(models))
+    single_row = X.iloc[:1]
+    for i, (model, scaler) in enumerate(zip(models, scalers)):
+        X_scaled = scaler.transform(X) if scaler is not None else X.values
+        predictions[:, i] = np.asarray(model.predict(X_scaled), dtype=float).ravel()
+
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            row_scaled = scaler.transform(single_row) if scaler is not None else single_row.values
+            model.predict(row_scaled)
+            timings.append((time.perf_counter() - start) * 1000.0)
+        latency_ms[i] = float(np.median(timings))
+    return predictions, latency_ms
+
+
+def fold_assignments(n_rows, n_folds=DEFAULT_FOLDS, seed=0):
+    """把验证行随机分到 min(n_folds, n_rows) 折，返回每行的折号"""
+    n_folds = max(2, min(n_folds, n_rows))
+    return np.random.RandomState(seed).permutation(n_rows) % n_folds
+
+
+def cross_fitted_predictions(predictions, y, folds):
+    """交叉拟合：每折的权重只在其余折上拟合，返回全部行的样本外集成预测"""
+    out_of_fold = np.zeros(len(y))
+    for fold in np.unique(folds):
+        held_out = folds == fold
+        weights = fit_simplex_weights(predictions[~held_out], y[~held_out])
+        out_of_fold[held_out] = predictions[held_out] @ weights
+    return out_of_fold
+
+
+def _prune(members, weights):
+    """去掉权重为0的子模型"""
+    kept = [(int(member), float(weight)) for member, weight in zip(members, weights) if weight > ZERO_WEIGHT]
+    return [member for member, _ in kept], [weight for _, weight in kept]
+
+
+def greedy_tier_curve(predictions, y, latency_ms, folds):
+    """
+    贪心前向选择：每一步加入使交叉拟合RMSE最小的子模型
+
+    返回:
+        列表，第k项为第k+1步的子集: members（去掉权重为0的子模型）、在全部验证行上拟合的weights、
+        交叉拟合的val_rmse / val_r2、latency_ms（只计保留的子模型）
+    """
+    n_members = predictions.shape[1]
+    selected = []
+    curve = []
+    for _ in range(n_members):
+        best = None
+        for candidate in range(n_members):
+            if candidate in selected:
+                continue
+            out_of_fold = cross_fitted_predictions(predictions[:, selected + [candidate]], y, folds)
+            rmse = _rmse(y, out_of_fold)
+            if best is None or rmse < best[0]:
+                best = (rmse, candidate, out_of_fold)
+
+        rmse, candidate, out_of_fold = best
+        selected.append(candidate)
+        members, weights = _prune(selected, fit_simplex_weights(predictions[:, selected], y))
+        curve.append({
+            "size": len(selected),
+            "members": members,
+            "weights": weights,
+            "val_rmse": rmse,
+            "val_r2": _r2(y, out_of_fold),
+            "latency_ms": float(latency_ms[members].sum()),
+        })
+    return curve
+
+
+def build_tiers(predictions, y, latency_ms, full_weights, tolerances=None, n_folds=DEFAULT_FOLDS, seed=0):
+    """
+    生成档位：full使用全部子模型和原有权重，其余档位取交叉拟合RMSE不超过 full*(1+容差) 的最小子集（没有时同full）
+
+    返回:
+        (tiers, curve)
+    """
+    tolerances = tolerances or DEFAULT_TIER_TOLERANCES
+    full_weights = np.asarray(full_weights, dtype=float).ravel()
+    full_pred = predictions @ full_weights
+    full_rmse = _rmse(y, full_pred)
+
+    tiers = {
+        "full": {
+            "members": list(range(predictions.shape[1])),
+            "weights": [float(w) for w in full_weights],
+            "val_rmse": full_rmse,
+            "val_r2": _r2(y, full_pred),
+            "latency_ms": float(latency_ms.sum()),
+        }
+    }
+
+    curve = greedy_tier_curve(predictions, y, latency_ms, fold_assignments(len(y), n_folds, seed))
+    for name, tolerance in sorted(tolerances.items(), key=lambda item: item[1]):
+        limit = full_rmse * (1.0 + tolerance)
+        # 没有子集满足容差时沿用full档位
+        chosen = next((point for point in curve if point["val_rmse"] <= limit), tiers["full"])
+        tier = {key: chosen[key] for key in ("members", "weights", "val_rmse", "val_r2", "latency_ms")}
+        tier["tolerance"] = tolerance
+        tiers[name] = tier
+    return tiers, curve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为10成员产率集成模型生成延迟/精度档位")
+    parser.add_argument("--model-dir", required=True, help="模型目录，如 Char_Yield%%_Model")
+    parser.add_argument("--data", required=True, help="验证集文件（.csv / .xlsx），包含特征列和目标列")
+    parser.add_argument("--target", help="目标列名（默认取metadata.json中的target_name）")
+    parser.add_argument("--fast-tolerance", type=float, default=DEFAULT_TIER_TOLERANCES["fast"],
+                        help="fast档位允许的RMSE相对增幅")
+    parser.add_argument("--balanced-tolerance", type=float, default=DEFAULT_TIER_TOLERANCES["balanced"],
+                        help="balanced档位允许的RMSE相对增幅")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS, help="交叉拟合的折数（权重拟合与打分使用不同的折）")
+    parser.add_argument("--seed", type=int, default=0, help="分折随机种子")
+    parser.add_argument("--dry-run", action="store_true", help="只打印结果，不写入metadata.json")
+    args = parser.parse_args()
+
+    metadata_path = os.path.join(args.model_dir, 'metadata.json')
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    feature_names = metadata['feature_names']
+    target = args.target or metadata.get('target_name')
+    data = read_table(args.data)
+    missing = [name for name in feature_names + [target] if name not in data.columns]
+    if missing:
+        raise SystemExit(f"验证集缺少以下列: {missing}")
+    data = data[feature_names + [target]].apply(pd.to_numeric, errors='coerce').dropna()
+
+    ensemble = EnsembleDirModel(args.model_dir)
+    models, scalers, full_weights = ensemble.models, ensemble.scalers, ensemble.weights
+
+    predictions, latency_ms = member_predictions(models, scalers, data[feature_names])
+    tiers, curve = build_tiers(
+        predictions, data[target].to_numpy(dtype=float), latency_ms, full_weights,
+        {"balanced": args.balanced_tolerance, "fast": args.fast_tolerance}, args.folds, args.seed
+    )
+
+    print(f"验证集: {args.data} ({len(data)} 行, 缩减档位RMSE为{args.folds}折交叉拟合)")
+    print(f"{'步数':>8} {'RMSE':>10} {'R²':>8} {'延迟(ms)':>10}  子模型")
+    for point in curve:
+        print(f"{point['size']:>8} {point['val_rmse']:>10.4f} {point['val_r2']:>8.4f} {point['latency_ms']:>10.2f}  {point['members']}")
+    for name, tier in tiers.items():
+        print(f"档位 {name}: {len(tier['members'])} 个子模型, RMSE {tier['val_rmse']:.4f}, 延迟 {tier['latency_ms']:.2f} ms")
+
+    if not args.dry_run:
+        metadata['tiers'] = tiers
+        metadata['tier_curve'] = curve
+        metadata['tier_validation'] = {
+            "data": os.path.basename(args.data),
+            "rows": int(len(data)),
+            "folds": args.folds,
+            "seed": args.seed,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(metadata_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=4)
+        print(f"档位信息已写入 {metadata_path}")
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+离线重新评估
+metadata.json 中的 performance（训练/测试 RMSE、R²）是训练时写入的固定数字，simple_predictor.plot_prediction
+只能串行地对单个模型重新打分并画KDE图。本脚本在一份留出数据集（.csv / .xlsx）上对所有产物重新评估:
+    - 每个产物是进程池中的一个任务，工作进程自己分块读取数据（CSV按 --chunk-rows 流式读取）
+    - 指标用流式累加器计算（行数、误差和、误差平方和、绝对误差和、目标值的和与平方和、最大误差），
+      不保留整列预测值
+    - 同一产物可以比较多个推理后端（pipeline / float32 / compiled），每个后端都报告对真实值的精度、
+      与第一个后端的最大差异和耗时，用于一次命令确认新后端的精度和加速
+    - 报告与metadata.json中记录的测试集RMSE/R²对比
+
+目标列与产物输出的对应关系:
+    多输出产物按 --target 顺序对应；单输出产物取 metadata.json 中的 target_name，
+    或文件名中出现的目标名（如 single_Cd_RF.joblib -> Cd），只给出一个目标时直接使用。
+
+用法:
+    python evaluate_artifacts.py --data heldout.xlsx --target "Char Yield(%)" --model-dir "Char_Yield%_Model"
+    python evaluate_artifacts.py --data heavy_metal_test.csv --target Cd Pb Hg --models "multi_*.joblib" "single_*.joblib" \\
+        --backends pipeline float32 compiled --jobs 4 --output evaluation_report
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from float32_inference import make_array_predict
+from permutation_importance import artifact_features, load_artifact
+from tree_compiler import compile_if_supported
+
+BACKENDS = ("pipeline", "float32", "compiled")
+
+
+class StreamingMetrics:
+    """可分块累加的回归指标（每个输出一列），只保存累加量，不保留预测值"""
+
+    def __init__(self, n_outputs):
+        self.count = 0
+        self.sum_error = np.zeros(n_outputs)
+        self.sum_squared_error = np.zeros(n_outputs)
+        self.sum_abs_error = np.zeros(n_outputs)
+        self.sum_target = np.zeros(n_outputs)
+        self.sum_squared_target = np.zeros(n_outputs)
+        self.max_abs_error = np.zeros(n_outputs)
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype=np.float64).reshape(len(y_true), -1)
+        error = np.asarray(y_pred, dtype=np.float64).reshape(y_true.shape) - y_true
+        self.count += len(y_true)
+        self.sum_error += error.sum(axis=0)
+        self.sum_squared_error += (error ** 2).sum(axis=0)
+        self.sum_abs_error += np.abs(error).sum(axis=0)
+        self.sum_target += y_true.sum(axis=0)
+        self.sum_squared_target += (y_true ** 2).sum(axis=0)
+        if len(y_true):
+            self.max_abs_error = np.maximum(self.max_abs_error, np.abs(error).max(axis=0))
+
+    def result(self):
+        """各输出的 rmse / mae / bias / r2 / max_abs_error"""
+        n = max(self.count, 1)
+        total = self.sum_squared_target - self.sum_target ** 2 / n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r2 = np.where(total > 0, 1.0 - self.sum_squared_error / total, np.nan)
+        return {
+            "rows": self.count,
+            "rmse": np.sqrt(self.sum_squared_error / n),
+            "mae": self.sum_abs_error / n,
+            "bias": self.sum_error / n,
+            "r2": r2,
+            "max_abs_error": self.max_abs_error,
+        }
+
+
+def read_chunks(path, columns, chunk_rows):
+    """分块读取数据中的指定列（CSV流式读取，Excel整表读取后切块）"""
+    if path.lower().endswith((".xlsx", ".xls")):
+        frame = pd.read_excel(path, usecols=lambda c: c in columns)
+        for start in range(0, len(frame), chunk_rows):
+            yield frame.iloc[start:start + chunk_rows]
+    else:
+        yield from pd.read_csv(path, usecols=lambda c: c in columns, chunksize=chunk_rows)
+
+
+def match_targets(artifact_path, model, n_outputs, targets):
+    """产物输出对应的目标列，无法确定时返回None"""
+    if n_outputs == len(targets) and n_outputs > 1:
+        return list(targets)
+    if n_outputs != 1:
+        return None
+    metadata = getattr(model, 'metadata', None) or {}
+    if metadata.get('target_name'):
+        return [metadata['target_name']] if metadata['target_name'] in targets else None
+    name = os.path.basename(os.path.normpath(artifact_path))
+    matches = [t for t in targets if f"_{t}_" in name or name.startswith(f"{t}_") or t in name]
+    if len(matches) == 1:
+        return matches
+    return list(targets) if len(targets) == 1 else None
+
+
+def _backend_predictors(model, backends):
+    """各后端的打分函数；不适用的后端（如无法编译的模型）记录原因"""
+    predictors, skipped = {}, {}
+    for backend in backends:
+        if backend == "pipeline":
+            predictors[backend] = make_array_predict(model, "float64")
+        elif backend == "float32":
+            predictors[backend] = make_array_predict(model, "float32")
+        elif backend == "compiled":
+            compiled = compile_if_supported(model)
+            if compiled is None:
+                skipped[backend] = "不是可编译的sklearn树集成"
+            else:
+                predictors[backend] = compiled.predict
+    return predictors, skipped
+
+
+def artifact_label(artifact_path):
+    """
+    产物在报告中的标识：相对当前目录的路径（当前目录之外的产物用绝对路径）
+    原始产物与重新训练的同名产物（如两个 Char_Yield%_Model）据此区分，不在报告中互相覆盖
+    """
+    path = os.path.abspath(artifact_path)
+    relative = os.path.relpath(path)
+    return path if relative == os.pardir or relative.startswith(os.pardir + os.sep) else relative
+
+
+def evaluate_artifact(artifact_path, data_path, targets, backends=BACKENDS, chunk_rows=50000):
+    """
+    在留出数据上评估一个产物（在工作进程中执行）
+
+    返回:
+        结果字典：各后端的指标和耗时；无法评估时包含error
+    """
+    name = artifact_label(artifact_path)
+    start = time.perf_counter()
+    try:
+        model = load_artifact(artifact_path)
+    except Exception as e:
+        return {"artifact": name, "error": f"无法加载: {type(e).__name__}: {str(e)[:80]}"}
+    load_seconds = time.perf_counter() - start
+
+    feature_names = artifact_features(model)
+    if not feature_names:
+        return {"artifact": name, "error": "没有记录特征名"}
+    predictors, skipped = _backend_predictors(model, backends)
+    metadata = getattr(model, 'metadata', None) or {}
+
+    accumulators, differences, timings = {}, {}, {backend: 0.0 for backend in predictors}
+    output_targets = None
+    for chunk in read_chunks(data_path, set(feature_names) | set(targets), chunk_rows):
+        missing = [c for c in feature_names if c not in chunk.columns]
+        if missing:
+            return {"artifact": name, "error": f"数据缺少特征列: {missing}"}
+        chunk = chunk.dropna(subset=feature_names)
+        X = chunk[feature_names].to_numpy(dtype=np.float64)
+        baseline = None
+        for backend, predict in predictors.items():
+            tick = time.perf_counter()
+            prediction = np.asarray(predict(X), dtype=np.float64).reshape(len(X), -1)
+            timings[backend] += time.perf_counter() - tick
+            if output_targets is None:
+                output_targets = match_targets(artifact_path, model, prediction.shape[1], targets)
+                if output_targets is None:
+                    return {"artifact": name, "error": f"无法确定 {prediction.shape[1]} 个输出对应的目标列"}
+                if any(target not in chunk.columns for target in output_targets):
+                    return {"artifact": name, "error": f"数据缺少目标列: {output_targets}"}
+            labelled = chunk[output_targets].notna().all(axis=1).to_numpy()
+            accumulators.setdefault(backend, StreamingMetrics(len(output_targets))).update(
+                chunk[output_targets].to_numpy(dtype=np.float64)[labelled], prediction[labelled])
+            if baseline is None:
+                baseline = prediction
+            elif len(prediction):
+                differences[backend] = max(differences.get(backend, 0.0), float(np.abs(prediction - baseline).max()))
+
+    performance = metadata.get('performance', {})
+    results = []
+    for backend, accumulator in accumulators.items():
+        metrics = accumulator.result()
+        rows = metrics["rows"]
+        for index, target in enumerate(output_targets):
+            results.append({
+                "backend": backend,
+                "target": target,
+                "rows": rows,
+                "rmse": float(metrics["rmse"][index]),
+                "mae": float(metrics["mae"][index]),
+                "bias": float(metrics["bias"][index]),
+                "r2": float(metrics["r2"][index]),
+                "max_abs_error": float(metrics["max_abs_error"][index]),
+                "recorded_test_rmse": performance.get('test_rmse'),
+                "recorded_test_r2": performance.get('test_r2'),
+                "max_diff_vs_first_backend": differences.get(backend, 0.0),
+                "predict_seconds": timings[backend],
+                "rows_per_s": rows / timings[backend] if timings[backend] > 0 else None,
+            })
+    return {"artifact": name, "load_seconds": load_seconds, "results": results, "skipped_backends": skipped,
+            "seconds": time.perf_counter() - start}
+
+
+def run_evaluation(artifact_paths, data_path, targets, backends=BACKENDS, n_jobs=1, chunk_rows=50000):
+    """并行评估所有产物，返回 (结果表DataFrame, 原始结果列表, 总耗时)"""
+    start = time.perf_counter()
+    arguments = [(path, data_path, targets, backends, chunk_rows) for path in artifact_paths]
+    if n_jobs == 1:
+        outcomes = [evaluate_artifact(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            outcomes = list(executor.map(evaluate_artifact, *zip(*arguments)))
+    rows = [dict(artifact=outcome["artifact"], load_seconds=outcome["load_seconds"], **result)
+            for outcome in outcomes if "results" in outcome for result in outcome["results"]]
+    table = pd.DataFrame(rows)
+    if not table.empty:
+        table["rmse_vs_recorded"] = table["rmse"] - pd.to_numeric(table["recorded_test_rmse"], errors="coerce")
+    return table, outcomes, time.perf_counter() - start
+
+
+def write_report(table, outcomes, elapsed, output_prefix, data_path):
+    """写出 <前缀>.csv（结果表）和 <前缀>.json（含跳过原因和总耗时）"""
+    table.to_csv(f"{output_prefix}.csv", index=False, encoding="utf-8-sig")
+    with open(f"{output_prefix}.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "data": os.path.basename(data_path),
+            "elapsed_s": elapsed,
+            "results": table.to_dict(orient="records"),
+            "errors": {o["artifact"]: o["error"] for o in outcomes if "error" in o},
+            "skipped_backends": {o["artifact"]: o["skipped_backends"] for o in outcomes if o.get("skipped_backends")},
+        }, f, ensure_ascii=False, indent=4, default=float)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在留出数据上并行重新评估所有产物，比较推理后端的精度和速度")
+    parser.add_argument("--data", required=True, help="留出数据（.csv / .xlsx），包含特征列和目标列")
+    parser.add_argument("--target", nargs="+", required=True, help="目标列（多输出产物按此顺序对应）")
+    parser.add_argument("--models", nargs="*", default=[], help="joblib模型文件（支持通配符）")
+    parser.add_argument("--model-dir", nargs="*", default=[], help="*_Yield%%_Model目录（支持通配符）")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["pipeline"],
+                        help="推理后端，第一个作为差异比较的基准")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="进程数")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="每块读取和打分的行数")
+    parser.add_argument("--output", default="evaluation_report", help="报告文件前缀（生成.csv和.json）")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.models for p in (glob.glob(pattern) or [pattern]) if os.path.isfile(p)})
+    paths += sorted({p for pattern in args.model_dir for p in (glob.glob(pattern) or [pattern]) if os.path.isdir(p)})
+    if not paths:
+        raise SystemExit("没有找到要评估的产物（--models / --model-dir）")
+
+    table, outcomes, elapsed = run_evaluation(paths, args.data, args.target, args.backends, args.jobs, args.chunk_rows)
+    for outcome in outcomes:
+        if "error" in outcome:
+            print(f"跳过 {outcome['artifact']}: {outcome['error']}")
+        for backend, reason in outcome.get("skipped_backends", {}).items():
+            print(f"{outcome['artifact']}: 跳过后端 {backend}（{reason}）")
+    if not table.empty:
+        columns = ["artifact", "backend", "target", "rows", "rmse", "r2", "recorded_test_rmse", "rmse_vs_recorded",
+                   "max_diff_vs_first_backend", "rows_per_s"]
+        with pd.option_context("display.max_columns", None, "display.width", 220):
+            print(table[columns].round(4).to_string(index=False))
+    print(f"\n{len(paths)} 个产物, 总耗时 {elapsed:.1f} 秒")
+    write_report(table, outcomes, elapsed, args.output, args.data)
+    print(f"报告已保存: {args.output}.csv / {args.output}.json")
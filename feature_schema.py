@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+预编译特征模式（FeatureSchema）
+每个模型只根据特征名、界面别名（如 'FT(°C)' -> 'FT(℃)'）和默认值编译一次，之后把字典、
+任意列顺序的DataFrame或数组直接整理为模型顺序的C连续输入矩阵：
+    - 列名到模型列位置的映射按输入列组合缓存为索引数组（LRU，最多MAX_CACHED_PLANS种组合），
+      重复调用只做一次NumPy花式索引
+    - 缺失特征由预先构建的默认值行填充
+    - 热路径不构建DataFrame；需要带列名的DataFrame时（如影子评估）再调用to_frame()
+
+示例:
+    schema = compile_schema(feature_names, aliases={'FT(°C)': 'FT(℃)'}, defaults=feature_defaults)
+    X = schema.transform({'FT(°C)': 500.0, ...})        # (1, n_features) float64
+    X = schema.transform(df, dtype=np.float32)           # 任意列顺序的DataFrame
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# 每个模式缓存的输入列组合数上限（上传文件的列组合不受控制，超过时淘汰最久未使用的映射）
+MAX_CACHED_PLANS = 64
+
+
+class FeatureSchema:
+    """模型输入特征的预编译映射：名称/别名 -> 列位置，缺失特征 -> 默认值"""
+
+    def __init__(self, feature_names, aliases=None, defaults=None):
+        """
+        参数:
+            feature_names: 模型训练时的特征顺序
+            aliases: 界面名称 -> 模型特征名
+            defaults: 模型特征名 -> 缺失时的默认值（未提供的特征默认为0.0）
+        """
+        self.feature_names = tuple(feature_names)
+        self.n_features = len(self.feature_names)
+        self.aliases = dict(aliases or {})
+        defaults = defaults or {}
+        self.default_row = np.array([float(defaults.get(name, 0.0)) for name in self.feature_names])
+
+        # 模型特征名和别名都映射到列位置
+        self.position = {name: i for i, name in enumerate(self.feature_names)}
+        for alias, name in self.aliases.items():
+            if name in self.position:
+                self.position[alias] = self.position[name]
+
+        self._plans = OrderedDict()    # 输入列组合 -> 映射（LRU）
+        self._plans_lock = threading.Lock()
+
+    def plan(self, columns):
+        """
+        计算（并缓存）一组输入列到模型列的映射
+
+        返回:
+            (source, target, missing): 输入列位置数组、对应的模型列位置数组、缺失的模型特征名
+            同一模型特征出现多次（原名和别名同时存在）时以最后一列为准
+        """
+        key = tuple(columns)
+        with self._plans_lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+
+        by_target = {}
+        for source, column in enumerate(key):
+            target = self.position.get(column)
+            if target is not None:
+                by_target[target] = source
+        target = np.fromiter(by_target.keys(), dtype=np.intp, count=len(by_target))
+        source = np.fromiter(by_target.values(), dtype=np.intp, count=len(by_target))
+        missing = tuple(name for i, name in enumerate(self.feature_names) if i not in by_target)
+        plan = (source, target, missing)
+        with self._plans_lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > MAX_CACHED_PLANS:
+                self._plans.popitem(last=False)
+        return plan
+
+    def missing(self, columns):
+        """输入列中缺失的模型特征名（这些特征会用默认值填充）"""
+        return list(self.plan(columns)[2])
+
+    def transform(self, data, dtype=np.float64):
+        """
+        把输入整理为模型顺序的C连续特征矩阵
+
+        参数:
+            data: 单行字典（界面名或模型名，可含多余键）、DataFrame（任意列顺序，可含多余列）或按模型顺序排列的数组
+            dtype: 输出矩阵的dtype
+
+        返回:
+            (n_rows, n_features) 矩阵
+        """
+        if isinstance(data, dict):
+            source, target, missing = self.plan(data.keys())
+            row = self.default_row.copy() if missing else np.empty(self.n_features)
+            # 只转换模式中的键对应的值，多余的键（如备注文本）不参与转换
+            values = list(data.values())
+            row[target] = np.fromiter((values[i] for i in source), dtype=np.float64, count=len(source))
+            return np.ascontiguousarray(row.reshape(1, -1), dtype=dtype)
+
+        if isinstance(data, pd.DataFrame):
+            source, target, missing = self.plan(data.columns)
+            if not missing and np.array_equal(target, np.arange(self.n_features)) \
+                    and np.array_equal(source, np.arange(self.n_features)) and data.shape[1] == self.n_features:
+                return np.ascontiguousarray(data.to_numpy(dtype=dtype))
+            matrix = np.empty((len(data), self.n_features), dtype=dtype)
+            if missing:
+                matrix[:] = self.default_row.astype(dtype)
+            matrix[:, target] = data.iloc[:, source].to_numpy(dtype=dtype)
+            return matrix
+
+        matrix = np.ascontiguousarray(data, dtype=dtype)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        if matrix.shape[1] != self.n_features:
+            raise ValueError(f"输入有 {matrix.shape[1]} 列，模型需要 {self.n_features} 个特征")
+        return matrix
+
+    def to_frame(self, matrix):
+        """把特征矩阵转换为带模型特征名的DataFrame（只在需要列名时使用）"""
+        return pd.DataFrame(matrix, columns=list(self.feature_names))
+
+
+_SCHEMAS = {}
+_SCHEMAS_LOCK = threading.Lock()
+
+
+def compile_schema(feature_names, aliases=None, defaults=None):
+    """
+    获取特征模式（相同特征名、别名和默认值的模式在进程内只编译一次）
+    预测器每次页面重跑都会重新创建，模式和其中缓存的列映射在重跑之间复用
+    """
+    key = (
+        tuple(feature_names),
+        tuple(sorted((aliases or {}).items())),
+        tuple(sorted((name, float(value)) for name, value in (defaults or {}).items())),
+    )
+    schema = _SCHEMAS.get(key)
+    if schema is None:
+        with _SCHEMAS_LOCK:
+            schema = _SCHEMAS.get(key)
+            if schema is None:
+                schema = FeatureSchema(feature_names, aliases, defaults)
+                _SCHEMAS[key] = schema
+    return schema
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+缓存指纹
+用模型文件（或模型目录，包含metadata.json）的内容哈希和预测器代码的哈希作为st.cache_data的键，
+替代每次重跑都执行的st.cache_data.clear()：缓存的元数据、特征重要性表和模型信息在它们依赖的文件或
+代码真正变化之前一直有效，所有会话共享。
+    - artifact_fingerprint: 先比较修改时间和大小，只有变化时才重新计算内容哈希（重复调用只做stat）
+    - code_fingerprint: 对函数/类中各方法的字节码做哈希，修改预测器代码后自动失效
+
+用法:
+    @st.cache_data
+    def cached_table(_predictor, fingerprint):
+        return _predictor.build_table()
+
+    key = fingerprint(artifact_fingerprint(model_dir), code_fingerprint(Predictor))
+"""
+
+import hashlib
+import marshal
+import os
+import threading
+
+from model_registry import content_digest, file_signature
+
+_DIGESTS = {}          # 绝对路径 -> (签名, 内容哈希)
+_DIGESTS_LOCK = threading.Lock()
+
+
+def fingerprint(*parts):
+    """把若干部分组合为一个短指纹"""
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(str(part).encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()[:16]
+
+
+def artifact_fingerprint(*paths):
+    """
+    模型文件/目录的内容指纹
+    签名（相对路径、修改时间、大小）不变时复用上次的内容哈希；路径为空或不存在时记为missing
+    """
+    digests = []
+    for path in paths:
+        if not path or not os.path.exists(path):
+            digests.append(f"missing:{path}")
+            continue
+        key = os.path.abspath(path)
+        signature = file_signature(key)
+        with _DIGESTS_LOCK:
+            cached = _DIGESTS.get(key)
+        if cached is None or cached[0] != signature:
+            cached = (signature, content_digest(key))
+            with _DIGESTS_LOCK:
+                _DIGESTS[key] = cached
+        digests.append(cached[1])
+    return fingerprint(*digests)
+
+
+def _update_code(hasher, obj):
+    code = getattr(obj, "__code__", None)
+    if code is not None:
+        hasher.update(marshal.dumps(code))
+    elif isinstance(obj, (staticmethod, classmethod)):
+        _update_code(hasher, obj.__func__)
+    elif isinstance(obj, property):
+        for accessor in (obj.fget, obj.fset, obj.fdel):
+            if accessor is not None:
+                _update_code(hasher, accessor)
+
+
+def code_fingerprint(*objects):
+    """
+    函数或类的代码指纹（类取其所有方法的字节码）
+    不读取源文件，对Streamlit以脚本方式执行的应用同样适用
+    """
+    hasher = hashlib.sha256()
+    for obj in objects:
+        hasher.update(getattr(obj, "__qualname__", repr(obj)).encode("utf-8"))
+        if isinstance(obj, type):
+            for name, member in sorted(vars(obj).items()):
+                hasher.update(name.encode("utf-8"))
+                _update_code(hasher, member)
+        else:
+            _update_code(hasher, obj)
+    return hasher.hexdigest()[:16]
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+float32推理路径
+批量预测和基于数组的评估可以选择float32路径：输入整理为C连续的float32特征矩阵，
+Pipeline中的预处理步骤（RobustScaler/StandardScaler）直接在float32上计算，树模型
+（sklearn/CatBoost/XGBoost）本身就以float32比较特征，不再经过float64 DataFrame；
+预测结果在出口统一转换为float64。默认仍然是float64路径，float32需要显式开启。
+
+tolerance_report() 对比同一模型在两条路径上的输出差异，确定每个模型是否可以使用float32:
+    python float32_inference.py --models multi_GBDT.joblib multi_RF.joblib --ranges heavy_metal_ranges.json
+    python float32_inference.py --model-dir "Char_Yield%_Model" --rows 200000
+"""
+
+import argparse
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+from model_registry import load_ensemble_dir, load_joblib
+from thread_budget import predict_with_threads
+
+# 判定float32路径可用的默认容差（与float64结果的最大绝对差）
+DEFAULT_ABS_TOLERANCE = 1e-3
+
+
+def to_float32_matrix(data, feature_names=None):
+    """
+    把DataFrame、字典或数组转换为C连续的float32特征矩阵
+
+    参数:
+        data: DataFrame（按feature_names取列）、单行字典或二维数组
+        feature_names: 特征顺序（DataFrame和字典输入时使用）
+    """
+    if isinstance(data, dict):
+        data = pd.DataFrame([data])
+    if isinstance(data, pd.DataFrame):
+        if feature_names is not None:
+            data = data[list(feature_names)]
+        return np.ascontiguousarray(data.to_numpy(dtype=np.float32))
+    matrix = np.ascontiguousarray(data, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    return matrix
+
+
+def predict_array(model, X, thread_count=None):
+    """
+    用数组直接预测（不构建DataFrame）
+    Pipeline的预处理步骤逐步执行并保持输入的dtype，最终估计器在同一dtype上预测；
+    输出在出口转换为float64。thread_count由线程预算分配（见thread_budget.py），None时使用库默认线程数
+    """
+    with warnings.catch_warnings():
+        # 模型用带列名的DataFrame训练，直接传数组时sklearn会提示缺少特征名
+        warnings.filterwarnings("ignore", message=".*feature names.*")
+        if isinstance(model, Pipeline):
+            for _, step in model.steps[:-1]:
+                if step is None or step == "passthrough":
+                    continue
+                X = step.transform(X)
+            X = np.ascontiguousarray(X)
+            prediction = predict_with_threads(model.steps[-1][1], X, thread_count)
+        else:
+            prediction = predict_with_threads(model, X, thread_count)
+    return np.asarray(prediction, dtype=np.float64)
+
+
+def make_array_predict(model, dtype="float32", budget=None):
+    """
+    返回接收DataFrame或数组、按指定dtype走数组路径的预测函数（供批量任务的score_fn使用）
+    提供budget（ThreadBudget）时每块预测按线程预算分配线程
+    """
+    np_dtype = np.float32 if dtype == "float32" else np.float64
+
+    def score(X):
+        if isinstance(X, pd.DataFrame):
+            X = X.to_numpy(dtype=np_dtype)
+        X = np.ascontiguousarray(X, dtype=np_dtype)
+        if budget is None:
+            return predict_array(model, X)
+        with budget.reserve() as thread_count:
+            return predict_array(model, X, thread_count)
+
+    return score
+
+
+class EnsembleDirModel:
+    """*_Yield%_Model目录中的加权集成，提供与Pipeline相同的数组预测接口（目录由model_registry.load_ensemble_dir加载）"""
+
+    def __init__(self, model_dir):
+        artifacts = load_ensemble_dir(model_dir)
+        if artifacts['metadata'] is None:
+            raise FileNotFoundError(f"元数据文件未找到: {os.path.join(model_dir, 'metadata.json')}")
+        self.metadata = artifacts['metadata']
+        self.feature_names = self.metadata['feature_names']
+        self.feature_ranges = self.metadata.get('feature_ranges')
+        self.models = artifacts['models']
+        self.scalers = artifacts['scalers'] + [artifacts['final_scaler']] * (len(self.models) - len(artifacts['scalers']))
+        weights = artifacts['model_weights']
+        self.weights = weights.ravel() if weights is not None else np.ones(len(self.models)) / len(self.models)
+
+    def predict(self, X):
+        """每个子模型使用各自的标准化器（保持输入dtype），再按权重加权；DataFrame输入按feature_names取列"""
+        if isinstance(X, pd.DataFrame):
+            X = X[self.feature_names]
+        result = np.zeros(len(X))
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=".*feature names.*")
+            for model, scaler, weight in zip(self.models, self.scalers, self.weights):
+                X_scaled = scaler.transform(X) if scaler is not None else X
+                result += weight * np.asarray(model.predict(np.ascontiguousarray(X_scaled)), dtype=np.float64).ravel()
+        return result
+
+
+def tolerance_report(model, X, abs_tolerance=DEFAULT_ABS_TOLERANCE, repeats=3):
+    """
+    对比float64与float32路径的输出
+
+    参数:
+        model: Pipeline、估计器或EnsembleDirModel
+        X: float64特征矩阵（按模型特征顺序）
+
+    返回:
+        字典：最大/平均绝对差、最大相对差、超出容差的行比例、两条路径的吞吐量和特征矩阵字节数
+    """
+    X64 = np.ascontiguousarray(X, dtype=np.float64)
+    X32 = to_float32_matrix(X64)
+
+    timings = {}
+    outputs = {}
+    for name, matrix in (("float64", X64), ("float32", X32)):
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            outputs[name] = predict_array(model, matrix)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+
+    diff = np.abs(outputs["float32"] - outputs["float64"]).reshape(len(X64), -1)
+    scale = np.maximum(np.abs(outputs["float64"]).reshape(len(X64), -1), 1e-12)
+    row_exceeds = (diff > abs_tolerance).any(axis=1)
+    return {
+        "rows": int(len(X64)),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "max_rel_diff": float((diff / scale).max()),
+        "rows_over_tolerance": float(row_exceeds.mean()),
+        "abs_tolerance": abs_tolerance,
+        "within_tolerance": bool(not row_exceeds.any()),
+        "rows_per_s_float64": float(len(X64) / timings["float64"]),
+        "rows_per_s_float32": float(len(X64) / timings["float32"]),
+        "matrix_bytes_float64": int(X64.nbytes),
+        "matrix_bytes_float32": int(X32.nbytes),
+    }
+
+
+def _sample_within_ranges(ranges, feature_names, n_rows, seed=0):
+    """在特征范围内均匀采样"""
+    rng = np.random.default_rng(seed)
+    columns = [rng.uniform(ranges[name]['min'], ranges[name]['max'], n_rows) for name in feature_names]
+    return np.column_stack(columns)
+
+
+if __name__ == "__main__":
+    from batch_jobs import read_table  # batch_jobs导入本模块，在此处导入避免循环
+
+    parser = argparse.ArgumentParser(description="对比模型在float64和float32推理路径上的输出差异")
+    parser.add_argument("--models", nargs="*", default=[], help="joblib模型文件")
+    parser.add_argument("--model-dir", nargs="*", default=[], help="*_Yield%%_Model目录（特征范围取自metadata.json）")
+    parser.add_argument("--ranges", help="模型文件的特征范围JSON（{特征: {min, max}}，按键顺序作为特征顺序）")
+    parser.add_argument("--data", help="可选：用真实输入数据（.csv / .xlsx）代替范围内采样")
+    parser.add_argument("--rows", type=int, default=100000, help="采样行数")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_ABS_TOLERANCE, help="最大允许绝对差")
+    parser.add_argument("--output", help="把报告保存为JSON")
+    args = parser.parse_args()
+
+    data = None
+    if args.data:
+        data = read_table(args.data)
+
+    targets = []
+    for model_dir in args.model_dir:
+        model = EnsembleDirModel(model_dir)
+        targets.append((os.path.basename(os.path.normpath(model_dir)), model, model.feature_names,
+                        model.metadata.get('feature_ranges')))
+    if args.models:
+        ranges = None
+        if args.ranges:
+            with open(args.ranges, 'r', encoding='utf-8') as f:
+                ranges = json.load(f)
+        for model_path in args.models:
+            model = load_joblib(model_path)
+            names = getattr(model, 'feature_names_in_', None)
+            feature_names = list(names) if names is not None else list(ranges or [])
+            targets.append((os.path.basename(model_path), model, feature_names, ranges))
+
+    reports = {}
+    for name, model, feature_names, ranges in targets:
+        if data is not None:
+            X = data[feature_names].apply(pd.to_numeric, errors='coerce').dropna().to_numpy(dtype=np.float64)
+        elif ranges and all(feature in ranges for feature in feature_names):
+            X = _sample_within_ranges(ranges, feature_names, args.rows)
+        else:
+            print(f"{name}: 缺少特征范围，跳过（请提供 --ranges 或 --data）")
+            continue
+        report = tolerance_report(model, X, args.tolerance)
+        reports[name] = report
+        status = "可用" if report["within_tolerance"] else "超出容差"
+        print(f"{name}: {status} | 最大绝对差 {report['max_abs_diff']:.3g}, 最大相对差 {report['max_rel_diff']:.3g}, "
+              f"超差行比例 {report['rows_over_tolerance']:.4%} | "
+              f"{report['rows_per_s_float64']:.0f} -> {report['rows_per_s_float32']:.0f} 行/秒 | "
+              f"特征矩阵 {report['matrix_bytes_float64'] / 1e6:.1f} -> {report['matrix_bytes_float32'] / 1e6:.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=4)
+        print(f"报告已保存: {args.output}")
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+网格插值代理模型
+重金属模型（multi_* / single_* / ensemble_*）只有7个有界输入（pH, V, T, LD, Ap, f, SP），
+在训练范围内的稀疏网格上预先计算模型输出，查询时做向量化多线性插值，代替完整的森林遍历，
+供交互式调参和优化器在微秒级延迟下反复调用。
+
+网格类型（--kind）:
+    - sparse:   Smolyak稀疏网格（组合技术），各层级为含边界的等距网格（l层 2^l+1 个节点），
+                满足 |l|_1 <= level 的分量网格按组合系数叠加
+    - adaptive: 维度自适应稀疏网格（Gerstner-Griebel，默认），从最粗网格开始，每次细化误差指标最大的
+                层级组合，直到达到模型调用次数预算；对模型变化剧烈的特征自动加密
+    - tensor:   完整张量网格（各特征层级可单独指定），作为对照
+所有分量网格合并保存为一个.npz文件；查询时所有分量一次向量化计算，没有Python层的逐分量循环，
+单点查询耗时与分量网格数成正比（自适应网格通常远少于同等精度的Smolyak网格）。
+生成时在独立的留出点（拉丁超立方采样）上比较代理与模型，报告最大误差（经验误差上界）、P99和平均误差。
+
+用法:
+    python grid_surrogate.py --models multi_GBDT.joblib --ranges heavy_metal_ranges.json --targets Cd Pb Hg
+    python grid_surrogate.py --models "single_*_GBDT.joblib" --ranges heavy_metal_ranges.json --budget 40000
+    python grid_surrogate.py --models multi_RF.joblib --ranges heavy_metal_ranges.json --targets Cd Pb Hg --kind sparse --level 3
+    python grid_surrogate.py --models multi_RF.joblib --ranges heavy_metal_ranges.json --kind tensor --tensor-levels 2 2 3 2 2 2 1
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from distill_student import latin_hypercube
+from feature_schema import compile_schema
+from model_registry import content_digest, load_joblib
+
+SURROGATE_DIR = "surrogates"
+SURROGATE_VERSION = 1
+
+# 单次向量化查询的行数（中间数组大小为 行数 x 分量数 x 2^d x 目标数）
+QUERY_CHUNK_ROWS = 256
+
+
+def surrogate_path(model_file, output_dir=SURROGATE_DIR):
+    """模型文件对应的代理模型路径"""
+    name = os.path.splitext(os.path.basename(os.path.normpath(model_file)))[0]
+    return os.path.join(output_dir, f"{name}.npz")
+
+
+def _corner_bits(n_dims):
+    """超立方体单元的 2^d 个角点偏移 (2^d, d)"""
+    return np.array(list(itertools.product((0, 1), repeat=n_dims)), dtype=np.int64)
+
+
+def combination_coefficients(index_set):
+    """
+    组合技术系数：对向下封闭的层级集合I，c_l = Σ_{z∈{0,1}^d, l+z∈I} (-1)^|z|
+    系数为0的分量不参与插值
+    """
+    index_set = set(index_set)
+    n_dims = len(next(iter(index_set)))
+    bits = _corner_bits(n_dims)
+    coefficients = {}
+    for levels in index_set:
+        coefficient = 0
+        for z in bits:
+            if tuple(int(l + b) for l, b in zip(levels, z)) in index_set:
+                coefficient += -1 if z.sum() % 2 else 1
+        if coefficient:
+            coefficients[levels] = coefficient
+    return coefficients
+
+
+def smolyak_index_set(n_dims, level, caps=None):
+    """|l|_1 <= level 的层级组合（可按特征限制最大层级）"""
+    caps = caps or [level] * n_dims
+    ranges = [range(min(level, cap) + 1) for cap in caps]
+    return [levels for levels in itertools.product(*ranges) if sum(levels) <= level]
+
+
+class ComponentSet:
+    """
+    一组分量网格的预计算查询计划：各分量的单元数、展平步长和 2^d 个角点的展平偏移只计算一次，
+    查询时所有分量的多线性插值一次向量化完成
+    """
+
+    def __init__(self, levels, coefficients, offsets):
+        """
+        参数:
+            levels: 各分量的层级 (C, d)
+            coefficients: 组合系数 (C,)
+            offsets: 各分量在values中的起始行 (C,)
+        """
+        self.levels = np.asarray(levels, dtype=np.int64).reshape(-1, np.shape(levels)[-1])
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.cells = 2 ** self.levels                                       # 各分量各维的单元数
+        shapes = self.cells + 1
+        # C顺序步长：strides[:, i] = prod(shapes[:, i+1:])
+        self.strides = np.ones_like(shapes)
+        for i in range(shapes.shape[1] - 2, -1, -1):
+            self.strides[:, i] = self.strides[:, i + 1] * shapes[:, i + 1]
+        self.corner_offsets = _corner_bits(shapes.shape[1]) @ self.strides.T  # (2^d, C)
+
+    def evaluate(self, Z, values, transposed=False):
+        """
+        多线性插值加权求和
+
+        参数:
+            Z: 归一化到[0, 1]的查询点 (n, d)
+            values: 所有分量网格节点上的输出，按C顺序展平后拼接 (N, T)；也可传入按目标转置的 (T, N)
+                    连续数组并设置transposed=True，避免每次查询转置
+
+        返回:
+            (n, T)
+        """
+        values_t = values if transposed else np.ascontiguousarray(np.asarray(values).T)
+        results = []
+        for start in range(0, len(Z), QUERY_CHUNK_ROWS):
+            chunk = Z[start:start + QUERY_CHUNK_ROWS]
+            position = chunk[:, None, :] * self.cells[None]                 # (n, C, d)
+            index = np.minimum(position.astype(np.int64), self.cells - 1)
+            frac = position - index
+            base = self.offsets + (index * self.strides).sum(axis=-1)       # (n, C)
+            # 角点权重逐维外积展开；从最后一维开始拼接，使第一维为最高位，与_corner_bits的顺序一致
+            weights = self.coefficients[None, :, None] * np.ones((len(chunk), 1, 1))
+            for dim in range(frac.shape[-1] - 1, -1, -1):
+                f = frac[:, :, dim, None]
+                weights = np.concatenate([weights * (1.0 - f), weights * f], axis=-1)
+            flat = (base[:, :, None] + self.corner_offsets.T[None]).reshape(len(chunk), -1)
+            weights = weights.reshape(len(chunk), 1, -1)
+            # 按目标逐个一维取值（比二维花式索引快得多）
+            results.append(np.column_stack([
+                (weights @ np.take(target_values, flat)[:, :, None])[:, 0, 0] for target_values in values_t
+            ]))
+        return np.concatenate(results, axis=0) if results else np.empty((0, len(values_t)))
+
+
+class _NodeEvaluator:
+    """按最细分辨率下的整数坐标缓存模型在网格节点上的输出，不同分量网格的公共节点只计算一次"""
+
+    def __init__(self, predict_fn, lower, span, finest_level):
+        self.predict_fn = predict_fn
+        self.lower = lower
+        self.span = span
+        self.resolution = 2 ** finest_level
+        self.finest_level = finest_level
+        self.cache = {}
+        self.model_calls = 0
+
+    def component_values(self, levels):
+        """分量网格所有节点上的模型输出 (prod(shape), T)，按C顺序展平"""
+        axes = [np.arange(2 ** l + 1) * 2 ** (self.finest_level - l) for l in levels]
+        nodes = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, len(levels))
+        keys = [node.tobytes() for node in nodes]
+        new = [i for i, key in enumerate(keys) if key not in self.cache]
+        if new:
+            X = self.lower + nodes[new] / self.resolution * self.span
+            outputs = np.asarray(self.predict_fn(X), dtype=np.float64).reshape(len(new), -1)
+            for i, output in zip(new, outputs):
+                self.cache[keys[i]] = output
+            self.model_calls += len(new)
+        return np.array([self.cache[key] for key in keys])
+
+
+class GridSurrogate:
+    """稀疏/自适应/张量网格上的多线性插值代理模型"""
+
+    def __init__(self, feature_names, lower, upper, levels, coefficients, offsets, values,
+                 target_names=None, errors=None, kind="sparse", model_calls=None, source=None,
+                 source_digest=None, created_at=None):
+        self.feature_names = list(feature_names)
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.span = np.where(self.upper > self.lower, self.upper - self.lower, 1.0)
+        self.levels = np.asarray(levels, dtype=np.int64)
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.target_names = list(target_names) if target_names is not None else \
+            [f"y{i}" for i in range(self.values.shape[1])]
+        self.errors = {name: np.asarray(v, dtype=np.float64) for name, v in (errors or {}).items()}
+        self.kind = kind
+        self.model_calls = model_calls
+        self.source = source
+        self.source_digest = source_digest
+        self.created_at = created_at
+        self.components = ComponentSet(self.levels, self.coefficients, self.offsets)
+        self._values_t = np.ascontiguousarray(self.values.T)
+        self.schema = compile_schema(self.feature_names, defaults={
+            name: (low + high) / 2.0 for name, low, high in zip(self.feature_names, self.lower, self.upper)
+        })
+
+    # ---------- 构建 ----------
+
+    @classmethod
+    def _from_index_set(cls, evaluator, index_set, feature_names, lower, upper, **kwargs):
+        coefficients = combination_coefficients(index_set)
+        components = sorted(coefficients)
+        blocks, offsets, offset = [], [], 0
+        for levels in components:
+            block = evaluator.component_values(levels)
+            blocks.append(block)
+            offsets.append(offset)
+            offset += len(block)
+        return cls(feature_names, lower, upper, components, [coefficients[l] for l in components], offsets,
+                   np.concatenate(blocks, axis=0), model_calls=evaluator.model_calls, **kwargs)
+
+    @classmethod
+    def build(cls, predict_fn, feature_names, feature_ranges, kind="sparse", level=4, caps=None,
+              tensor_levels=None, budget=20000, max_level=6, n_holdout=2000, seed=0, **kwargs):
+        """
+        在训练范围内构建代理模型
+
+        参数:
+            predict_fn: 接受 (n, d) 数组（按feature_names顺序）并返回预测的函数
+            feature_ranges: {特征: {'min': .., 'max': ..}}
+            kind: "sparse" / "adaptive" / "tensor"
+            level: 稀疏网格总层级（|l|_1 <= level）
+            caps: 稀疏网格各特征的最大层级
+            tensor_levels: 张量网格各特征的层级
+            budget: 自适应网格的模型调用次数预算
+            max_level: 自适应网格单个特征的最大层级
+            n_holdout: 误差评估留出点数
+        """
+        lower = np.array([feature_ranges[name]['min'] for name in feature_names], dtype=np.float64)
+        upper = np.array([feature_ranges[name]['max'] for name in feature_names], dtype=np.float64)
+        span = np.where(upper > lower, upper - lower, 1.0)
+        n_dims = len(feature_names)
+        common = dict(kind=kind, created_at=datetime.now().isoformat(timespec="seconds"), **kwargs)
+
+        if kind == "tensor":
+            tensor_levels = tuple(int(l) for l in (tensor_levels or [2] * n_dims))
+            evaluator = _NodeEvaluator(predict_fn, lower, span, max(tensor_levels))
+            surrogate = cls._from_index_set(evaluator, [tensor_levels], feature_names, lower, upper, **common)
+        elif kind == "sparse":
+            index_set = smolyak_index_set(n_dims, level, caps)
+            evaluator = _NodeEvaluator(predict_fn, lower, span, max(max(l) for l in index_set))
+            surrogate = cls._from_index_set(evaluator, index_set, feature_names, lower, upper, **common)
+        elif kind == "adaptive":
+            evaluator = _NodeEvaluator(predict_fn, lower, span, max_level)
+            index_set = cls._adaptive_index_set(evaluator, n_dims, budget, max_level, seed)
+            surrogate = cls._from_index_set(evaluator, index_set, feature_names, lower, upper, **common)
+        else:
+            raise ValueError(f"未知的网格类型: {kind}")
+
+        if n_holdout > 0:
+            X_holdout = latin_hypercube(feature_ranges, feature_names, n_holdout, seed + 1).to_numpy()
+            truth = np.asarray(predict_fn(X_holdout), dtype=np.float64).reshape(n_holdout, -1)
+            error = np.abs(surrogate.predict_matrix(X_holdout) - truth)
+            surrogate.errors = {
+                "max_abs_error": error.max(axis=0),
+                "p99_abs_error": np.quantile(error, 0.99, axis=0),
+                "mae": error.mean(axis=0),
+                "target_std": truth.std(axis=0),
+            }
+        return surrogate
+
+    @staticmethod
+    def _adaptive_index_set(evaluator, n_dims, budget, max_level, seed, n_indicator=256):
+        """
+        维度自适应选择层级集合（Gerstner-Griebel）
+        误差指标：加入层级l后插值在指示点上的平均变化 |Δ_l|，Δ_l = Σ_z (-1)^|z| f_{l-z}
+        """
+        rng = np.random.default_rng(seed)
+        Z_indicator = rng.random((n_indicator, n_dims))
+        bits = _corner_bits(n_dims)
+        component_cache = {}
+
+        def component_on_indicator(levels):
+            if levels not in component_cache:
+                values = evaluator.component_values(levels)
+                component_cache[levels] = ComponentSet([levels], [1.0], [0]).evaluate(Z_indicator, values)
+            return component_cache[levels]
+
+        def indicator(levels):
+            delta = 0.0
+            for z in bits:
+                lower_levels = tuple(int(l - b) for l, b in zip(levels, z))
+                if min(lower_levels) < 0:
+                    continue
+                sign = -1.0 if z.sum() % 2 else 1.0
+                delta = delta + sign * component_on_indicator(lower_levels)
+            return float(np.mean(np.abs(delta)))
+
+        root = (0,) * n_dims
+        old, active = set(), {root: indicator(root)}
+        while active and evaluator.model_calls < budget:
+            levels = max(active, key=active.get)
+            del active[levels]
+            old.add(levels)
+            for dim in range(n_dims):
+                candidate = tuple(l + (1 if i == dim else 0) for i, l in enumerate(levels))
+                if candidate[dim] > max_level or candidate in active or candidate in old:
+                    continue
+                # 只有所有后向邻居都已选入时才可加入（保持集合向下封闭）
+                backward = [tuple(l - (1 if i == k else 0) for i, l in enumerate(candidate))
+                            for k in range(n_dims) if candidate[k] > 0]
+                if all(b in old for b in backward):
+                    active[candidate] = indicator(candidate)
+                if evaluator.model_calls >= budget:
+                    break
+        return old | set(active)
+
+    # ---------- 查询 ----------
+
+    def predict_matrix(self, X):
+        """按feature_names顺序排列的数组 (n, d) -> (n, T)；超出范围的输入截断到边界"""
+        Z = np.clip((np.asarray(X, dtype=np.float64) - self.lower) / self.span, 0.0, 1.0)
+        if Z.ndim == 1:
+            Z = Z.reshape(1, -1)
+        return self.components.evaluate(Z, self._values_t, transposed=True)
+
+    def predict(self, X):
+        """
+        代理预测（单目标时返回一维数组，与sklearn模型一致）
+
+        参数:
+            X: 单行字典、DataFrame（任意列顺序）或按特征顺序排列的数组
+        """
+        predictions = self.predict_matrix(self.schema.transform(X))
+        return predictions[:, 0] if predictions.shape[1] == 1 else predictions
+
+    def error_summary(self, decimals=4):
+        """留出点误差说明，如 'Cd: 最大 1.2 / P99 0.8 / 平均 0.1'"""
+        if "max_abs_error" not in self.errors:
+            return "未评估"
+        return "; ".join(
+            f"{name}: 最大 {self.errors['max_abs_error'][i]:.{decimals}f} / "
+            f"P99 {self.errors['p99_abs_error'][i]:.{decimals}f} / 平均 {self.errors['mae'][i]:.{decimals}f}"
+            for i, name in enumerate(self.target_names)
+        )
+
+    # ---------- 保存/加载 ----------
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {f"error_{name}": values for name, values in self.errors.items()}
+        np.savez_compressed(
+            path,
+            version=np.array(SURROGATE_VERSION),
+            kind=np.array(self.kind),
+            feature_names=np.array(self.feature_names),
+            target_names=np.array(self.target_names),
+            lower=self.lower,
+            upper=self.upper,
+            levels=self.levels.astype(np.int8),
+            coefficients=self.coefficients,
+            offsets=self.offsets,
+            values=self.values.astype(np.float32),
+            model_calls=np.array(self.model_calls if self.model_calls is not None else -1),
+            source=np.array(self.source or ""),
+            source_digest=np.array(self.source_digest or ""),
+            created_at=np.array(self.created_at or ""),
+            **arrays
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["version"])
+            if version != SURROGATE_VERSION:
+                raise ValueError(f"代理模型版本不兼容: {version}（需要 {SURROGATE_VERSION}），请重新生成")
+            errors = {key[len("error_"):]: data[key] for key in data.files if key.startswith("error_")}
+            model_calls = int(data["model_calls"])
+            return cls(
+                data["feature_names"].tolist(), data["lower"], data["upper"], data["levels"],
+                data["coefficients"], data["offsets"], data["values"],
+                target_names=data["target_names"].tolist(), errors=errors, kind=str(data["kind"]),
+                model_calls=model_calls if model_calls >= 0 else None,
+                source=str(data["source"]) or None, source_digest=str(data["source_digest"]) or None,
+                created_at=str(data["created_at"]) or None,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为重金属模型构建网格插值代理模型")
+    parser.add_argument("--models", nargs="+", required=True, help="joblib模型文件（支持通配符）")
+    parser.add_argument("--ranges", required=True, help="特征范围JSON（{特征: {min, max}}）")
+    parser.add_argument("--targets", nargs="+", help="多输出模型的目标名称，如 Cd Pb Hg（单目标模型按文件名推断）")
+    parser.add_argument("--kind", choices=["sparse", "adaptive", "tensor"], default="adaptive", help="网格类型")
+    parser.add_argument("--level", type=int, default=4, help="稀疏网格总层级")
+    parser.add_argument("--tensor-levels", type=int, nargs="+", help="张量网格各特征层级（按特征顺序）")
+    parser.add_argument("--budget", type=int, default=20000, help="自适应网格的模型调用次数预算")
+    parser.add_argument("--max-level", type=int, default=6, help="自适应网格单个特征的最大层级")
+    parser.add_argument("--holdout", type=int, default=2000, help="误差评估留出点数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output-dir", default=SURROGATE_DIR, help="代理模型输出目录")
+    args = parser.parse_args()
+
+    with open(args.ranges, 'r', encoding='utf-8') as f:
+        feature_ranges = json.load(f)
+    feature_ranges = feature_ranges.get('feature_ranges', feature_ranges)
+
+    model_files = sorted({path for pattern in args.models for path in (glob.glob(pattern) or [pattern])})
+    for model_file in model_files:
+        try:
+            model = load_joblib(model_file)
+        except Exception as e:
+            print(f"跳过 {model_file}: 模型加载失败 ({type(e).__name__}: {str(e)})")
+            continue
+        names = getattr(model, 'feature_names_in_', None)
+        feature_names = list(names) if names is not None else list(feature_ranges)
+        missing = [name for name in feature_names if name not in feature_ranges]
+        if missing:
+            print(f"跳过 {model_file}: 缺少以下特征的范围 {missing}")
+            continue
+
+        parts = os.path.basename(model_file).split('_')
+        target_names = [parts[1]] if parts[0] == 'single' and len(parts) > 2 else args.targets
+        schema = compile_schema(feature_names)
+
+        def predict_fn(X):
+            return model.predict(schema.to_frame(X))
+
+        start = time.perf_counter()
+        surrogate = GridSurrogate.build(
+            predict_fn, feature_names, feature_ranges, kind=args.kind, level=args.level,
+            tensor_levels=args.tensor_levels, budget=args.budget, max_level=args.max_level,
+            n_holdout=args.holdout, seed=args.seed, target_names=target_names,
+            source=os.path.basename(model_file), source_digest=content_digest(model_file)
+        )
+        build_seconds = time.perf_counter() - start
+        output_path = surrogate_path(model_file, args.output_dir)
+        surrogate.save(output_path)
+
+        # 单点延迟：代理 vs 模型
+        row = latin_hypercube(feature_ranges, feature_names, 1, args.seed + 2).to_numpy()
+        timings = {}
+        for name, fn in (("代理", surrogate.predict_matrix), ("模型", predict_fn)):
+            fn(row)
+            repeats = 200 if name == "代理" else 20
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                fn(row)
+            timings[name] = (time.perf_counter() - t0) / repeats * 1e6
+
+        print(f"{model_file} -> {output_path} ({os.path.getsize(output_path) / 1024:.0f} KB, {args.kind}, "
+              f"{len(surrogate.levels)} 个分量网格, 模型调用 {surrogate.model_calls} 次, 构建 {build_seconds:.1f} 秒)")
+        print(f"  单点延迟: 代理 {timings['代理']:.0f} 微秒, 模型 {timings['模型']:.0f} 微秒")
+        print(f"  留出点误差: {surrogate.error_summary()}")
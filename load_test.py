@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Streamlit应用多会话负载测试
+基于 streamlit.testing.v1.AppTest 在同一进程中模拟N个并发会话（st.cache_resource 等进程级资源
+与真实服务器一样在会话间共享），每个会话循环执行接近真实使用的操作流程:
+    1. 切换预测目标（*_card / *_button / target_* 按钮）
+    2. 修改1~3个输入（表单内的输入只暂存，随提交一起生效；表单外的输入会触发重跑）
+    3. 运行预测
+    4. 打开"模型信息"页面后返回（应用有该导航时）
+报告内容:
+    - 每类操作的重跑延迟分布（P50/P95/P99/最大值）
+    - 进程内存（RSS）随会话数的增长，可选tracemalloc统计Python分配
+    - 模型加载次数（按文件统计joblib.load调用），用于发现会话间没有共享的模型
+    - 失败的重跑次数（脚本异常，或脚本编译失败等原因没有产生任何元素）
+
+用法:
+    python load_test.py "Fraud_detection-689 -1.py" --sessions 8 --iterations 5
+    python load_test.py Fraud_detection-10.py --sessions 4 --iterations 3 --tracemalloc --output load_report.json
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.util import patch_config_options
+
+# 操作 -> 按钮匹配规则
+TARGET_KEY_SUFFIXES = ("_card", "_button")
+TARGET_KEY_PREFIXES = ("target_",)
+PREDICT_LABEL = "运行预测"
+INFO_PAGE = ("nav_info", "模型信息")
+PREDICT_PAGE = ("nav_predict", "预测模型")
+
+
+def rss_bytes():
+    """当前进程常驻内存（Linux读/proc，其他平台用ru_maxrss近似）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ModelLoadCounter:
+    """统计joblib.load调用次数（按文件名），测试结束后恢复原函数"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._original = None
+
+    def __enter__(self):
+        self._original = joblib.load
+        original = self._original
+
+        def counting_load(filename, *args, **kwargs):
+            name = os.path.basename(str(filename)) if isinstance(filename, (str, os.PathLike)) else type(filename).__name__
+            with self._lock:
+                self.counts[name] += 1
+            return original(filename, *args, **kwargs)
+
+        joblib.load = counting_load
+        return self
+
+    def __exit__(self, *exc):
+        joblib.load = self._original
+        return False
+
+
+class SharedScriptCache:
+    """
+    所有会话共用编译后的脚本字节码，测试结束后恢复原方法
+    AppTest每次重跑都新建ScriptCache并重新compile脚本，多个线程同时编译同一个大脚本时
+    CPython会报 "AST constructor recursion depth mismatch"，重跑因此没有任何输出
+    """
+
+    def __init__(self):
+        self._bytecode = {}
+        self._lock = threading.Lock()
+        self._original = None
+
+    def __enter__(self):
+        self._original = ScriptCache.get_bytecode
+        original = self._original
+
+        def shared_get_bytecode(script_cache, script_path):
+            path = os.path.abspath(script_path)
+            with self._lock:
+                if path not in self._bytecode:
+                    self._bytecode[path] = original(script_cache, path)
+                return self._bytecode[path]
+
+        ScriptCache.get_bytecode = shared_get_bytecode
+        return self
+
+    def __exit__(self, *exc):
+        ScriptCache.get_bytecode = self._original
+        return False
+
+
+class SharedRuntime:
+    """
+    测试期间保留最近一次创建的模拟Runtime，测试结束后恢复原方法
+    AppTest每次重跑结束时把全局的Runtime._instance置为None，并发会话中仍在运行的脚本随后
+    找不到Runtime（"Runtime hasn't been created!"），重跑中途失败
+    """
+
+    def __init__(self):
+        self._runtime = None
+        self._original_instance = None
+        self._original_exists = None
+
+    def __enter__(self):
+        self._original_instance = Runtime.__dict__["instance"]
+        self._original_exists = Runtime.__dict__["exists"]
+        shared = self
+
+        def instance(cls):
+            if cls._instance is not None:
+                shared._runtime = cls._instance
+            if shared._runtime is None:
+                raise RuntimeError("Runtime hasn't been created!")
+            return shared._runtime
+
+        def exists(cls):
+            return cls._instance is not None or shared._runtime is not None
+
+        Runtime.instance = classmethod(instance)
+        Runtime.exists = classmethod(exists)
+        return self
+
+    def __exit__(self, *exc):
+        Runtime.instance = self._original_instance
+        Runtime.exists = self._original_exists
+        return False
+
+
+class SessionSimulator:
+    """一个模拟会话：持有自己的AppTest（独立的session_state），记录每次重跑的耗时"""
+
+    def __init__(self, app_path, session_index, timeout, seed):
+        self.app = AppTest.from_file(app_path, default_timeout=timeout)
+        self.name = f"会话{session_index}"
+        self.rng = random.Random(seed)
+        self.timings = []     # (操作, 毫秒)
+        self.failures = Counter()   # 操作 -> 失败次数
+
+    def _timed(self, action, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+            # 脚本编译失败时AppTest不产生exception元素，只是没有任何输出，同样记为失败
+            failed = bool(self.app.exception) or not (self.app.main.children or self.app.sidebar.children)
+        except Exception as e:
+            print(f"{self.name} {action} 失败: {type(e).__name__}: {str(e)}")
+            failed = True
+        self.timings.append((action, (time.perf_counter() - start) * 1000.0))
+        if failed:
+            self.failures[action] += 1
+
+    def _button(self, key_or_label):
+        """按key或标签查找按钮（标签包含匹配）"""
+        for button in self.app.button:
+            if button.key == key_or_label or (button.label and key_or_label in button.label):
+                return button
+        return None
+
+    def start(self):
+        self._timed("首次加载", self.app.run)
+
+    def switch_target(self):
+        candidates = [b for b in self.app.button if b.key and (
+            b.key.endswith(TARGET_KEY_SUFFIXES) or b.key.startswith(TARGET_KEY_PREFIXES))]
+        if candidates:
+            button = self.rng.choice(candidates)
+            self._timed("切换目标", lambda: button.click().run())
+
+    def edit_inputs(self):
+        inputs = list(self.app.number_input)
+        if not inputs:
+            return
+        for widget in self.rng.sample(inputs, k=min(len(inputs), self.rng.randint(1, 3))):
+            value = float(widget.value if widget.value is not None else 0.0)
+            new_value = value * self.rng.uniform(0.9, 1.1) if value else self.rng.uniform(0.0, 1.0)
+            if widget.min is not None:
+                new_value = max(float(widget.min), new_value)
+            if widget.max is not None:
+                new_value = min(float(widget.max), new_value)
+            widget.set_value(round(new_value, 6))
+            # 表单内的输入在浏览器中不会触发重跑，随提交一起生效；表单外的输入每次修改都会重跑
+            if not widget.form_id:
+                self._timed("修改输入", self.app.run)
+
+    def run_prediction(self):
+        button = self._button(PREDICT_LABEL)
+        if button is not None:
+            self._timed("运行预测", lambda: button.click().run())
+
+    def open_model_info(self):
+        info = self._button(INFO_PAGE[0]) or self._button(INFO_PAGE[1])
+        if info is None:
+            return
+        self._timed("打开模型信息", lambda: info.click().run())
+        back = self._button(PREDICT_PAGE[0]) or self._button(PREDICT_PAGE[1])
+        if back is not None:
+            self._timed("返回预测页", lambda: back.click().run())
+
+    def iterate(self):
+        self.switch_target()
+        self.edit_inputs()
+        self.run_prediction()
+        self.open_model_info()
+
+
+def summarize_timings(timings):
+    """每类操作的延迟分布"""
+    df = pd.DataFrame(timings, columns=["操作", "耗时(ms)"])
+    if df.empty:
+        return df
+    grouped = df.groupby("操作", sort=False)["耗时(ms)"]
+    summary = grouped.agg(
+        次数="count",
+        P50=lambda x: np.percentile(x, 50),
+        P95=lambda x: np.percentile(x, 95),
+        P99=lambda x: np.percentile(x, 99),
+        最大="max",
+    )
+    overall = df["耗时(ms)"]
+    summary.loc["全部"] = [len(overall), np.percentile(overall, 50), np.percentile(overall, 95),
+                          np.percentile(overall, 99), overall.max()]
+    return summary.round(1)
+
+
+def run_load_test(app_path, sessions=4, iterations=5, timeout=180, seed=0, use_tracemalloc=False):
+    """
+    运行负载测试
+
+    返回:
+        报告字典：latency（DataFrame）、memory、model_loads、failures
+    """
+    app_path = os.path.abspath(app_path)
+    if use_tracemalloc:
+        tracemalloc.start()
+
+    rss_start = rss_bytes()
+    # AppTest.run()在每次重跑期间临时打开global.appTest，某个会话的重跑结束时会把它关掉，并发会话中的
+    # selectbox等控件随即不再登记测试所需的信息；测试期间整体保持打开
+    with ModelLoadCounter() as loads, SharedScriptCache(), SharedRuntime(), \
+            patch_config_options({"global.appTest": True}):
+        simulators = [SessionSimulator(app_path, i, timeout, seed + i) for i in range(sessions)]
+        # 第一个会话单独加载：编译脚本并填充进程级缓存，其余会话再并发启动
+        simulators[0].start()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            list(executor.map(lambda s: s.start(), simulators[1:]))
+        rss_after_start = rss_bytes()
+        loads_after_start = sum(loads.counts.values())
+
+        def session_loop(simulator):
+            for _ in range(iterations):
+                simulator.iterate()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            list(executor.map(session_loop, simulators))
+        elapsed = time.perf_counter() - start
+        rss_end = rss_bytes()
+
+    memory = {
+        "启动前RSS(MB)": rss_start / 1e6,
+        "会话启动后RSS(MB)": rss_after_start / 1e6,
+        "结束时RSS(MB)": rss_end / 1e6,
+        "每会话启动增长(MB)": (rss_after_start - rss_start) / 1e6 / max(sessions, 1),
+        "每会话每轮增长(MB)": (rss_end - rss_after_start) / 1e6 / max(sessions * iterations, 1),
+    }
+    if use_tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory["tracemalloc当前(MB)"] = current / 1e6
+        memory["tracemalloc峰值(MB)"] = peak / 1e6
+
+    all_timings = [timing for simulator in simulators for timing in simulator.timings]
+    return {
+        "app": os.path.basename(app_path),
+        "sessions": sessions,
+        "iterations": iterations,
+        "elapsed_s": elapsed,
+        "latency": summarize_timings(all_timings),
+        "memory": memory,
+        "model_loads": dict(loads.counts),
+        "model_loads_at_start": loads_after_start,
+        "failures": {simulator.name: dict(simulator.failures) for simulator in simulators if simulator.failures},
+    }
+
+
+def print_report(report):
+    print(f"应用: {report['app']} | 会话数: {report['sessions']} | 每会话轮数: {report['iterations']} | "
+          f"总耗时: {report['elapsed_s']:.1f} 秒")
+    print("\n重跑延迟 (ms):")
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(report["latency"].to_string())
+    print("\n内存:")
+    for key, value in report["memory"].items():
+        print(f"  {key}: {value:.1f}")
+    print(f"\n模型加载次数（会话启动阶段 {report['model_loads_at_start']} 次）:")
+    for name, count in sorted(report["model_loads"].items(), key=lambda item: -item[1]):
+        flag = "  <- 多次加载" if count > 1 else ""
+        print(f"  {name}: {count}{flag}")
+    if report["failures"]:
+        print(f"\n失败的重跑（脚本异常或没有输出）: {report['failures']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streamlit应用多会话负载测试（AppTest）")
+    parser.add_argument("app", help="应用文件，如 \"Fraud_detection-689 -1.py\"")
+    parser.add_argument("--sessions", type=int, default=4, help="并发会话数")
+    parser.add_argument("--iterations", type=int, default=5, help="每个会话执行操作流程的轮数")
+    parser.add_argument("--timeout", type=float, default=180, help="单次重跑超时（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--tracemalloc", action="store_true", help="用tracemalloc统计Python内存分配（明显变慢）")
+    parser.add_argument("--output", help="把报告保存为JSON")
+    args = parser.parse_args()
+
+    report = run_load_test(args.app, args.sessions, args.iterations, args.timeout, args.seed, args.tracemalloc)
+    print_report(report)
+
+    if args.output:
+        serializable = dict(report)
+        serializable["latency"] = report["latency"].reset_index().to_dict(orient="records")
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(serializable, f, ensure_ascii=False, indent=4)
+        print(f"报告已保存: {args.output}")
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+共享模型注册表与热更新
+进程内所有会话共用同一份已加载的模型；后台线程按间隔轮询模型文件（或模型目录）的
+修改时间和大小，发现变化且文件稳定后计算内容哈希，在后台加载并验证新版本，
+验证通过后原子替换注册表中的引用。正在进行的预测持有旧对象的引用，会在旧版本上完成；
+新请求立即拿到新版本，不需要重启应用，也不会出现冷加载停顿。
+内容相同的模型文件（如 single_Cu_GBDT.joblib 与 single_Hg_GBDT.joblib）按内容哈希共用同一个已加载对象，
+启动时可用 find_duplicates 报告仓库中重复的模型文件。
+"""
+
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import warnings
+from collections import deque
+
+import joblib
+import numpy as np
+
+
+def load_joblib(path):
+    """默认加载器：抑制版本兼容性警告后用joblib加载"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return joblib.load(path)
+
+
+def load_ensemble_dir(model_dir):
+    """
+    加载*_Yield%_Model目录中的全部子模型、子模型标准化器、最终标准化器、权重和元数据
+    缺少的文件对应None（由调用方决定回退方式）；不访问Streamlit会话状态，可在注册表的后台线程中调用
+
+    异常:
+        FileNotFoundError: models/ 下没有子模型
+    """
+    model_files = sorted(glob.glob(os.path.join(model_dir, 'models', 'model_*.joblib')))
+    if not model_files:
+        raise FileNotFoundError(f"未找到模型文件在 {os.path.join(model_dir, 'models')}")
+    scaler_files = sorted(glob.glob(os.path.join(model_dir, 'scalers', 'scaler_*.joblib')))
+    final_scaler_path = os.path.join(model_dir, 'final_scaler.joblib')
+    weights_path = os.path.join(model_dir, 'model_weights.npy')
+    metadata_path = os.path.join(model_dir, 'metadata.json')
+    metadata = None
+    if os.path.exists(metadata_path):
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+
+    return {
+        'models': [load_joblib(f) for f in model_files],
+        'model_files': [os.path.basename(f) for f in model_files],
+        'scalers': [load_joblib(f) for f in scaler_files],
+        'scaler_files': [os.path.basename(f) for f in scaler_files],
+        'final_scaler': load_joblib(final_scaler_path) if os.path.exists(final_scaler_path) else None,
+        'model_weights': np.load(weights_path) if os.path.exists(weights_path) else None,
+        'metadata': metadata,
+    }
+
+
+def _iter_files(path):
+    """列出文件或目录下的所有文件（按相对路径排序）"""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+def file_signature(path):
+    """
+    文件（或目录）的快速签名：各文件的相对路径、修改时间和大小
+    路径不存在时返回None
+    """
+    if not os.path.exists(path):
+        return None
+    signature = []
+    for file_path in _iter_files(path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        signature.append((os.path.relpath(file_path, path), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def content_digest(path, chunk_size=1 << 20):
+    """文件（或目录下所有文件）内容的SHA-256哈希"""
+    hasher = hashlib.sha256()
+    for file_path in _iter_files(path):
+        hasher.update(os.path.relpath(file_path, path).encode("utf-8"))
+        hasher.update(b"\0")
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def find_duplicates(paths):
+    """
+    按内容查找重复的模型文件/目录：先按总大小分组，只对大小相同的候选计算SHA-256
+
+    返回:
+        [[路径, ...], ...]，每组内的文件内容完全相同
+    """
+    by_size = {}
+    for path in dict.fromkeys(paths):
+        signature = file_signature(path)
+        if signature:
+            by_size.setdefault(sum(size for _, _, size in signature), []).append(path)
+
+    groups = {}
+    for candidates in by_size.values():
+        if len(candidates) > 1:
+            for path in candidates:
+                groups.setdefault(content_digest(path), []).append(path)
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+def report_duplicates(paths):
+    """打印重复的模型文件（启动时调用），返回find_duplicates的结果"""
+    duplicates = find_duplicates(paths)
+    for group in duplicates:
+        names = ", ".join(os.path.basename(os.path.normpath(path)) for path in group)
+        print(f"模型注册表 发现内容相同的模型文件（加载时共用同一对象）: {names}")
+    return duplicates
+
+
+def _loader_id(loader):
+    """加载器标识：Streamlit每次重跑都会重新定义脚本中的函数，按模块和限定名比较"""
+    return getattr(loader, "__module__", None), getattr(loader, "__qualname__", repr(loader))
+
+
+class ModelVersion:
+    """注册表中某个模型的一个已加载版本"""
+
+    def __init__(self, path, model, signature, digest, number):
+        self.path = path
+        self.model = model
+        self.signature = signature
+        self.digest = digest
+        self.number = number
+        self.loaded_at = time.time()
+
+
+class _Entry:
+    """注册表条目：当前版本、加载器、验证函数和热更新状态"""
+
+    def __init__(self, version, loader, verifier):
+        self.current = version
+        self.loader = loader
+        self.verifier = verifier
+        self.pending_signature = None   # 已发现变化、等待下一次轮询确认稳定的签名
+        self.failed_signature = None    # 加载或验证失败的签名，文件再次变化前不重试
+        self.last_error = None
+
+
+class ModelRegistry:
+    """进程级共享模型注册表，支持后台轮询热更新和原子替换"""
+
+    def __init__(self, loader=load_joblib, verifier=None, poll_interval=5.0):
+        """
+        参数:
+            loader: 默认加载函数 loader(path) -> 模型对象
+            verifier: 默认验证函数 verifier(model)，抛出异常或返回False表示验证失败
+            poll_interval: 轮询文件变化的间隔（秒）
+        """
+        self.loader = loader
+        self.verifier = verifier
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._entries = {}          # 绝对路径 -> _Entry
+        self._aliases = {}          # 别名（如缓存键） -> 绝对路径
+        self._load_locks = {}       # 绝对路径 -> 首次加载锁，避免多个会话同时冷加载同一模型
+        self._stop_event = threading.Event()
+        self._watch_thread = None
+        self.events = deque(maxlen=50)  # 最近的热更新事件
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+
+    def _record(self, path, message):
+        event = f"[{time.strftime('%H:%M:%S')}] {os.path.basename(path)}: {message}"
+        self.events.append(event)
+        print(f"模型注册表 {event}")
+
+    def _find_loaded(self, digest, loader, exclude):
+        """查找用同一加载器加载、内容哈希相同的其他条目"""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if key != exclude and entry.current.digest == digest and \
+                        _loader_id(entry.loader) == _loader_id(loader):
+                    return key, entry
+        return None, None
+
+    def _load_version(self, key, loader, verifier, number):
+        """
+        加载并验证一个版本；加载期间文件发生变化时抛出异常，等待下一轮重试
+        内容与已注册的其他模型相同时直接共用其对象，不再重复加载
+        """
+        signature = file_signature(key)
+        if signature is None:
+            raise FileNotFoundError(f"模型文件不存在: {key}")
+        digest = content_digest(key)
+        shared_key, shared = self._find_loaded(digest, loader, key)
+        if shared is not None:
+            model = shared.current.model
+            self._record(key, f"内容与 {os.path.basename(shared_key)} 相同，共用已加载的模型")
+        else:
+            model = loader(key)
+        if verifier is not None and (shared is None or shared.verifier is not verifier) and verifier(model) is False:
+            raise ValueError("模型验证未通过")
+        if file_signature(key) != signature:
+            raise RuntimeError("加载期间模型文件发生变化")
+        return ModelVersion(key, model, signature, digest, number)
+
+    def load(self, path, loader=None, verifier=None, alias=None):
+        """
+        获取模型：已注册时直接返回当前版本，否则同步加载、验证并注册
+
+        参数:
+            path: 模型文件或模型目录
+            loader: 加载函数（默认使用注册表的加载器）
+            verifier: 验证函数（默认使用注册表的验证函数）
+            alias: 可选别名，之后可通过resolve(alias)找到该路径
+
+        返回:
+            模型对象；加载或验证失败时抛出异常
+        """
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if alias is not None:
+                self._aliases[alias] = key
+            if entry is not None:
+                return entry.current.model
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry.current.model
+
+            loader = loader or self.loader
+            verifier = verifier if verifier is not None else self.verifier
+            version = self._load_version(key, loader, verifier, number=1)
+            with self._lock:
+                self._entries[key] = _Entry(version, loader, verifier)
+            self._record(key, f"已加载 (sha256 {version.digest[:10]})")
+            return version.model
+
+    def get(self, path, default=None):
+        """获取已注册模型的当前版本（不触发加载）"""
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+        return entry.current.model if entry is not None else default
+
+    def get_version(self, path):
+        """获取已注册模型的当前版本信息"""
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+        return entry.current if entry is not None else None
+
+    def resolve(self, alias):
+        """根据别名查找已注册的模型路径，未注册时返回None"""
+        with self._lock:
+            key = self._aliases.get(alias)
+            return key if key in self._entries else None
+
+    def check_for_updates(self):
+        """
+        检查一轮所有已注册模型的文件变化，对内容确实变化的模型在当前线程加载新版本并原子替换
+
+        返回:
+            本轮完成替换的模型路径列表
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+
+        swapped = []
+        for key, entry in entries:
+            signature = file_signature(key)
+            if signature is None or signature == entry.current.signature:
+                entry.pending_signature = None
+                continue
+            if signature == entry.failed_signature:
+                continue
+
+            # 第一次发现变化时只记录，下一轮签名保持不变才认为写入已完成
+            if signature != entry.pending_signature:
+                entry.pending_signature = signature
+                continue
+            entry.pending_signature = None
+
+            try:
+                digest = content_digest(key)
+                if digest == entry.current.digest:
+                    # 只有修改时间变化（如touch或重新复制相同文件），无需重新加载
+                    entry.current.signature = signature
+                    continue
+
+                version = self._load_version(key, entry.loader, entry.verifier, entry.current.number + 1)
+            except Exception as e:
+                entry.last_error = str(e)
+                entry.failed_signature = signature
+                self._record(key, f"新版本加载失败，继续使用版本 {entry.current.number}: {e}")
+                print(traceback.format_exc())
+                continue
+
+            with self._lock:
+                entry.current = version
+                entry.last_error = None
+                entry.failed_signature = None
+            swapped.append(key)
+            self._record(key, f"已热更新到版本 {version.number} (sha256 {version.digest[:10]})")
+
+        return swapped
+
+    def _watch_loop(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.check_for_updates()
+            except Exception as e:
+                print(f"模型注册表轮询出错: {e}")
+
+    def start_watching(self):
+        """启动后台轮询线程（重复调用无副作用）"""
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._watch_thread = threading.Thread(target=self._watch_loop, name="model-registry-watch", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        """停止后台轮询线程"""
+        self._stop_event.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join(timeout=self.poll_interval + 1)
+            self._watch_thread = None
+
+    def duplicates(self):
+        """已注册模型中内容相同（共用同一对象）的路径分组"""
+        with self._lock:
+            entries = list(self._entries.items())
+        groups = {}
+        for key, entry in entries:
+            groups.setdefault(entry.current.digest, []).append(key)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+    def status(self):
+        """返回所有已注册模型的状态列表，供界面显示"""
+        with self._lock:
+            entries = list(self._entries.items())
+        shared = {}
+        for key, entry in entries:
+            shared.setdefault(id(entry.current.model), []).append(os.path.basename(key) or key)
+        rows = []
+        for key, entry in entries:
+            aliases = [name for name in shared[id(entry.current.model)] if name != (os.path.basename(key) or key)]
+            rows.append({
+                "模型": os.path.basename(key) or key,
+                "路径": key,
+                "版本": entry.current.number,
+                "SHA-256": entry.current.digest[:10],
+                "加载时间": time.strftime("%H:%M:%S", time.localtime(entry.current.loaded_at)),
+                "共用对象": ", ".join(aliases),
+                "最近错误": entry.last_error or "",
+            })
+        return rows
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+原生多输出随机森林
+multi_RF.joblib 是 RobustScaler + MultiOutputRegressor(RandomForestRegressor)：Cd、Pb、Hg 各有一片独立的森林，
+每行预测要遍历三遍。sklearn的RandomForestRegressor原生支持多输出（叶子值为各目标组成的向量），
+本脚本用与原模型相同的预处理和超参数重新训练一片多输出森林，每行只遍历一次。
+
+训练数据:
+    --data 提供包含特征列和目标列的真实数据（.csv / .xlsx）时，按 --test-size 划分训练/测试集，
+    在测试集上比较原模型与新模型对真实值的精度（原模型可能见过这些行，其测试分数偏乐观）；
+    没有真实数据时，在特征范围内做拉丁超立方采样并用原模型打标签（蒸馏），报告新模型相对原模型的保真度。
+
+导出的 <文件名>_native.joblib 仍是 Pipeline(scaler, model)，predict 输出 (行数, 目标数)，
+与原模型通过同一个ModelPredictor加载和预测；tree_compiler.py 也可以编译它。
+
+用法:
+    python multioutput_forest.py --model multi_RF.joblib --ranges heavy_metal_ranges.json
+    python multioutput_forest.py --model multi_RF.joblib --data heavy_metal_data.xlsx --targets Cd Pb Hg
+"""
+
+import argparse
+import json
+import os
+import time
+import warnings
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.pipeline import Pipeline
+
+from batch_jobs import read_table
+from distill_student import fidelity_report, latin_hypercube, measure_row_latency, measure_throughput
+from model_registry import load_joblib
+
+DEFAULT_TARGETS = ["Cd", "Pb", "Hg"]
+NATIVE_SUFFIX = "_native"
+
+
+def native_paths(model_file):
+    """原生多输出模型和报告的保存路径"""
+    stem = os.path.splitext(model_file)[0]
+    return f"{stem}{NATIVE_SUFFIX}.joblib", f"{stem}{NATIVE_SUFFIX}.json"
+
+
+def is_native_multioutput(model):
+    """模型（或Pipeline的最后一步）是否为原生多输出的森林"""
+    estimator = model.steps[-1][1] if isinstance(model, Pipeline) else model
+    return isinstance(estimator, (RandomForestRegressor, ExtraTreesRegressor)) and \
+        getattr(estimator, "n_outputs_", 1) > 1
+
+
+def build_native_pipeline(model, n_jobs=None):
+    """
+    按原模型构造未训练的原生多输出Pipeline：预处理步骤和森林超参数与原模型相同
+
+    异常:
+        ValueError: 原模型不是 MultiOutputRegressor 包装的随机森林 / ExtraTrees
+    """
+    steps = model.steps[:-1] if isinstance(model, Pipeline) else []
+    estimator = model.steps[-1][1] if isinstance(model, Pipeline) else model
+    if not isinstance(estimator, MultiOutputRegressor) or \
+            not isinstance(estimator.estimator, (RandomForestRegressor, ExtraTreesRegressor)):
+        raise ValueError(f"只支持MultiOutputRegressor包装的随机森林，当前为: {type(estimator).__name__}")
+    forest = clone(estimator.estimator)
+    if n_jobs is not None:
+        forest.set_params(n_jobs=n_jobs)
+    step_name = model.steps[-1][0] if isinstance(model, Pipeline) else "model"
+    return Pipeline([(name, clone(step)) for name, step in steps] + [(step_name, forest)])
+
+
+def _predict(model, X):
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=".*feature names.*")
+        return np.asarray(model.predict(X), dtype=np.float64).reshape(len(X), -1)
+
+
+def _per_target(reference, predictions, target_names):
+    return {name: fidelity_report(reference[:, i], predictions[:, i]) for i, name in enumerate(target_names)}
+
+
+def _latency(model, X):
+    """单行延迟（毫秒）和批量吞吐量（行/秒）"""
+    predict_fn = lambda rows: _predict(model, rows)
+    return {"row_ms": measure_row_latency(predict_fn, X), "rows_per_s": float(measure_throughput(predict_fn, X))}
+
+
+def _tree_count(model):
+    estimator = model.steps[-1][1] if isinstance(model, Pipeline) else model
+    if isinstance(estimator, MultiOutputRegressor):
+        return sum(len(sub.estimators_) for sub in estimator.estimators_)
+    return len(estimator.estimators_)
+
+
+def retrain_native(model, feature_names, target_names=None, feature_ranges=None, data=None, n_samples=20000,
+                   n_holdout=5000, test_size=0.2, seed=0, n_jobs=None):
+    """
+    训练原生多输出森林并与原模型比较
+
+    参数:
+        model: 原模型（Pipeline(scaler, MultiOutputRegressor(RandomForestRegressor))）
+        feature_ranges: {特征: {'min': .., 'max': ..}}，没有真实数据时用于采样
+        data: 包含特征列和目标列的真实数据（DataFrame），有则优先使用
+        n_samples / n_holdout: 蒸馏时的训练/评估采样点数
+
+    返回:
+        (native_model, report)
+    """
+    target_names = list(target_names or DEFAULT_TARGETS)
+    if data is not None and all(name in data.columns for name in target_names):
+        data = data[feature_names + target_names].dropna()
+        X_train, X_test, y_train, y_test = train_test_split(
+            data[feature_names], data[target_names].to_numpy(dtype=np.float64), test_size=test_size,
+            random_state=seed)
+        mode = "data"
+        label_seconds = 0.0
+    else:
+        if feature_ranges is None:
+            raise ValueError("没有包含目标列的真实数据时需要特征范围（--ranges）")
+        X_train = latin_hypercube(feature_ranges, feature_names, n_samples, seed)
+        if data is not None:
+            X_train = pd.concat([X_train, data[feature_names].dropna()], ignore_index=True)
+        X_test = latin_hypercube(feature_ranges, feature_names, n_holdout, seed + 1)
+        mode = "distill"
+        start = time.perf_counter()
+        y_train = _predict(model, X_train)
+        label_seconds = time.perf_counter() - start
+        y_test = None
+
+    native = build_native_pipeline(model, n_jobs)
+    start = time.perf_counter()
+    native.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    original_test = _predict(model, X_test)
+    native_test = _predict(native, X_test)
+    if mode == "data":
+        accuracy = {
+            "original": _per_target(y_test, original_test, target_names),
+            "native": _per_target(y_test, native_test, target_names),
+        }
+    else:
+        accuracy = {"native_vs_original": _per_target(original_test, native_test, target_names)}
+
+    latency = {"original": _latency(model, X_test), "native": _latency(native, X_test)}
+    latency["row_speedup"] = latency["original"]["row_ms"] / latency["native"]["row_ms"]
+    latency["throughput_speedup"] = latency["native"]["rows_per_s"] / latency["original"]["rows_per_s"]
+
+    report = {
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "mode": mode,
+        "feature_names": list(feature_names),
+        "target_names": target_names,
+        "train_rows": int(len(X_train)),
+        "test_rows": int(len(X_test)),
+        "forest": {key: value for key, value in native.steps[-1][1].get_params().items()
+                   if isinstance(value, (int, float, str, bool)) or value is None},
+        "trees_per_row": {"original": _tree_count(model), "native": _tree_count(native)},
+        "accuracy": accuracy,
+        "latency": latency,
+        "timing_s": {"label": label_seconds, "fit": fit_seconds},
+    }
+    return native, report
+
+
+def print_report(report):
+    print(f"模式: {'真实数据' if report['mode'] == 'data' else '蒸馏（原模型打标签）'} | "
+          f"训练 {report['train_rows']} 行, 测试 {report['test_rows']} 行 | "
+          f"每行遍历的树: {report['trees_per_row']['original']} -> {report['trees_per_row']['native']}")
+    for label, metrics in report["accuracy"].items():
+        print(f"  {label}: " + ", ".join(f"{name} RMSE={m['rmse']:.4f} R²={m['r2']:.4f}" for name, m in metrics.items()))
+    latency = report["latency"]
+    print(f"  单行延迟: {latency['original']['row_ms']:.2f} ms -> {latency['native']['row_ms']:.2f} ms "
+          f"({latency['row_speedup']:.1f}x)")
+    print(f"  批量吞吐: {latency['original']['rows_per_s']:.0f} -> {latency['native']['rows_per_s']:.0f} 行/秒 "
+          f"({latency['throughput_speedup']:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把MultiOutputRegressor包装的随机森林重新训练为原生多输出森林")
+    parser.add_argument("--model", default="multi_RF.joblib", help="原模型文件")
+    parser.add_argument("--data", help="真实数据（.csv / .xlsx），包含特征列和目标列时用于训练和精度比较")
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS, help="目标列名（与模型输出顺序一致）")
+    parser.add_argument("--ranges", help="特征范围JSON（{特征: {min, max}}），蒸馏采样用")
+    parser.add_argument("--samples", type=int, default=20000, help="蒸馏训练采样点数")
+    parser.add_argument("--holdout", type=int, default=5000, help="蒸馏评估采样点数")
+    parser.add_argument("--test-size", type=float, default=0.2, help="真实数据的测试集比例")
+    parser.add_argument("--n-jobs", type=int, help="训练线程数（默认沿用原模型设置）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="输出模型文件（默认 <原文件名>_native.joblib）")
+    args = parser.parse_args()
+
+    model = load_joblib(args.model)
+    feature_names = list(getattr(model, "feature_names_in_", []))
+    if not feature_names:
+        raise SystemExit(f"{args.model} 没有记录特征名（feature_names_in_）")
+
+    feature_ranges = None
+    if args.ranges:
+        with open(args.ranges, 'r', encoding='utf-8') as f:
+            feature_ranges = json.load(f)
+        feature_ranges = feature_ranges.get('feature_ranges', feature_ranges)
+    data = read_table(args.data) if args.data else None
+
+    native, report = retrain_native(model, feature_names, args.targets, feature_ranges, data, args.samples,
+                                    args.holdout, args.test_size, args.seed, args.n_jobs)
+    report["source"] = os.path.basename(args.model)
+    print_report(report)
+
+    model_path, report_path = native_paths(args.model)
+    if args.output:
+        model_path, report_path = args.output, os.path.splitext(args.output)[0] + ".json"
+    joblib.dump(native, model_path)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"已保存: {model_path} ({os.path.getsize(model_path) / 1e6:.1f} MB)，报告: {report_path}")
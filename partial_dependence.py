@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+部分依赖（PDP）与个体条件期望（ICE）
+在批量预测路径（float32_inference.make_array_predict 返回的 score_fn）之上计算:
+    - 单特征: 背景数据 n 行 × 网格 g 个点组成一个 (n*g, 特征数) 的设计矩阵，一次批量打分，
+      得到每行的ICE曲线 (n, g[, 输出数]) 和平均后的PDP曲线 (g[, 输出数])
+    - 双特征交互: 两个网格的笛卡尔积 (g1*g2 个点) 与背景数据组成一个设计矩阵，同样一次打分，
+      代价只随 n*g1*g2 行数线性增长，没有逐网格点的调用开销（超过 max_batch_rows 时分块）
+结果按（模型哈希, 特征, 网格, 背景数据哈希）缓存在进程内（LRU），同一分析重复请求直接返回。
+
+用法:
+    python partial_dependence.py --model multi_GBDT.joblib --ranges heavy_metal_ranges.json --feature T
+    python partial_dependence.py --model-dir "Char_Yield%_Model" --data fraud.xlsx --feature "PT(°C)" --feature2 "RT(min)"
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from batch_jobs import read_table
+from fingerprint import artifact_fingerprint, fingerprint
+from float32_inference import EnsembleDirModel, make_array_predict
+from model_registry import load_joblib
+
+DEFAULT_GRID_POINTS = 20
+DEFAULT_MAX_BATCH_ROWS = 200000
+
+
+def make_grid(values=None, n_points=DEFAULT_GRID_POINTS, feature_range=None, kind="quantile"):
+    """
+    特征网格
+
+    参数:
+        values: 背景数据中该特征的取值（quantile网格使用）
+        feature_range: {'min': .., 'max': ..}，没有背景取值或kind="uniform"时使用
+        kind: "quantile"（按背景数据分位数，稀疏区域点少）或 "uniform"（等间距）
+    """
+    if kind == "quantile" and values is not None and len(values):
+        grid = np.unique(np.quantile(np.asarray(values, dtype=np.float64), np.linspace(0.0, 1.0, n_points)))
+        if len(grid) > 1:
+            return grid
+    if feature_range is not None:
+        return np.linspace(feature_range['min'], feature_range['max'], n_points)
+    values = np.asarray(values, dtype=np.float64)
+    return np.linspace(values.min(), values.max(), n_points)
+
+
+def array_digest(array):
+    """数组内容（含形状和dtype）的短哈希，用作缓存键"""
+    array = np.ascontiguousarray(array)
+    hasher = hashlib.sha256(f"{array.shape}|{array.dtype}".encode("utf-8"))
+    hasher.update(array.tobytes())
+    return hasher.hexdigest()[:16]
+
+
+class DependenceResult:
+    """一次PDP/ICE计算的结果"""
+
+    def __init__(self, features, grids, average, ice=None, output_names=None, seconds=0.0, rows_scored=0):
+        self.features = list(features)
+        self.grids = [np.asarray(grid) for grid in grids]
+        self.average = average          # 单特征 (g[, 输出数])；双特征 (g1, g2[, 输出数])
+        self.ice = ice                  # 单特征 (n, g[, 输出数])；双特征默认不保留
+        self.output_names = list(output_names) if output_names is not None else None
+        self.seconds = seconds
+        self.rows_scored = rows_scored
+
+    def average_frame(self):
+        """单特征PDP曲线表（索引为网格值，每个输出一列）"""
+        if len(self.features) != 1:
+            raise ValueError("average_frame只适用于单特征结果，双特征请使用surface_frame")
+        values = self.average.reshape(len(self.grids[0]), -1)
+        return pd.DataFrame(values, index=pd.Index(self.grids[0], name=self.features[0]),
+                            columns=self.output_names or [f"输出{i}" for i in range(values.shape[1])])
+
+    def surface_frame(self, output=0):
+        """双特征交互曲面表（行为第一个特征的网格，列为第二个特征的网格）"""
+        if len(self.features) != 2:
+            raise ValueError("surface_frame只适用于双特征结果")
+        surface = self.average if self.average.ndim == 2 else self.average[:, :, output]
+        return pd.DataFrame(surface, index=pd.Index(self.grids[0], name=self.features[0]),
+                            columns=pd.Index(self.grids[1], name=self.features[1]))
+
+
+class PartialDependence:
+    """基于批量打分函数的PDP/ICE计算器，结果按模型哈希、特征、网格和背景数据缓存"""
+
+    def __init__(self, max_batch_rows=DEFAULT_MAX_BATCH_ROWS, cache_size=64):
+        """
+        参数:
+            max_batch_rows: 单次打分的最大行数，设计矩阵更大时分块打分（限制内存）
+            cache_size: 进程内缓存的结果个数
+        """
+        self.max_batch_rows = max_batch_rows
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+        result = compute()
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _score(self, score_fn, design):
+        """分块打分，返回 (行数[, 输出数])"""
+        chunks = [np.asarray(score_fn(design[start:start + self.max_batch_rows]), dtype=np.float64)
+                  for start in range(0, len(design), self.max_batch_rows)]
+        prediction = np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+        return prediction.reshape(len(design), -1) if prediction.ndim > 1 else prediction
+
+    @staticmethod
+    def _design(background, columns, grid_points):
+        """
+        背景数据每行重复 len(grid_points) 次，并把指定列替换为网格值
+        grid_points: (网格点数, 列数)
+        """
+        n_points = len(grid_points)
+        design = np.repeat(background, n_points, axis=0)
+        design[:, columns] = np.tile(grid_points, (len(background), 1))
+        return design
+
+    def ice(self, score_fn, background, feature_names, feature, grid, model_hash, output_names=None):
+        """
+        单特征ICE曲线和PDP
+
+        参数:
+            score_fn: 批量打分函数 score_fn(X) -> (行数[, 输出数])
+            background: 背景数据 (n, 特征数)，按feature_names排列
+            feature: 要分析的特征名
+            grid: 网格值
+            model_hash: 模型内容哈希（缓存键的一部分）
+        """
+        background = np.ascontiguousarray(background, dtype=np.float64)
+        grid = np.asarray(grid, dtype=np.float64)
+        key = fingerprint(model_hash, feature, array_digest(grid), array_digest(background))
+
+        def compute():
+            start = time.perf_counter()
+            column = list(feature_names).index(feature)
+            design = self._design(background, [column], grid.reshape(-1, 1))
+            prediction = self._score(score_fn, design)
+            ice = prediction.reshape((len(background), len(grid)) + prediction.shape[1:])
+            return DependenceResult([feature], [grid], ice.mean(axis=0), ice, output_names,
+                                    time.perf_counter() - start, len(design))
+
+        return self._cached(key, compute)
+
+    def interaction(self, score_fn, background, feature_names, features, grids, model_hash, output_names=None):
+        """
+        双特征交互曲面（平均值），两个网格的笛卡尔积与背景数据在同一个设计矩阵中打分
+        """
+        background = np.ascontiguousarray(background, dtype=np.float64)
+        grid_a, grid_b = (np.asarray(grid, dtype=np.float64) for grid in grids)
+        key = fingerprint(model_hash, *features, array_digest(grid_a), array_digest(grid_b),
+                          array_digest(background))
+
+        def compute():
+            start = time.perf_counter()
+            columns = [list(feature_names).index(name) for name in features]
+            mesh = np.stack(np.meshgrid(grid_a, grid_b, indexing="ij"), axis=-1).reshape(-1, 2)
+            # 背景数据按块参与，设计矩阵不超过max_batch_rows行
+            rows_per_block = max(1, self.max_batch_rows // len(mesh))
+            rows_scored = 0
+            total = None
+            for start_row in range(0, len(background), rows_per_block):
+                block = background[start_row:start_row + rows_per_block]
+                design = self._design(block, columns, mesh)
+                prediction = self._score(score_fn, design)
+                block_sum = prediction.reshape((len(block), len(mesh)) + prediction.shape[1:]).sum(axis=0)
+                total = block_sum if total is None else total + block_sum
+                rows_scored += len(design)
+            average = (total / len(background)).reshape((len(grid_a), len(grid_b)) + total.shape[1:])
+            return DependenceResult(list(features), [grid_a, grid_b], average, None, output_names,
+                                    time.perf_counter() - start, rows_scored)
+
+        return self._cached(key, compute)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="部分依赖（PDP）/ ICE 曲线与双特征交互曲面")
+    parser.add_argument("--model", help="joblib模型文件")
+    parser.add_argument("--model-dir", help="*_Yield%%_Model目录")
+    parser.add_argument("--feature", required=True, help="要分析的特征")
+    parser.add_argument("--feature2", help="第二个特征（计算交互曲面）")
+    parser.add_argument("--ranges", help="特征范围JSON（{特征: {min, max}}），没有背景数据时在范围内采样")
+    parser.add_argument("--data", help="背景数据（.csv / .xlsx）")
+    parser.add_argument("--background-rows", type=int, default=500, help="背景数据最多使用的行数")
+    parser.add_argument("--grid-points", type=int, default=DEFAULT_GRID_POINTS, help="网格点数")
+    parser.add_argument("--grid", choices=["quantile", "uniform"], default="quantile", help="网格类型")
+    parser.add_argument("--dtype", choices=["float64", "float32"], default="float64", help="打分路径")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="把平均曲线/曲面保存为CSV")
+    args = parser.parse_args()
+
+    if args.model_dir:
+        model = EnsembleDirModel(args.model_dir)
+        feature_names = model.feature_names
+        ranges = model.metadata.get('feature_ranges')
+        model_hash = artifact_fingerprint(args.model_dir)
+    elif args.model:
+        model = load_joblib(args.model)
+        feature_names = list(getattr(model, 'feature_names_in_', []))
+        ranges = None
+        model_hash = artifact_fingerprint(args.model)
+    else:
+        raise SystemExit("需要 --model 或 --model-dir")
+    if args.ranges:
+        with open(args.ranges, 'r', encoding='utf-8') as f:
+            ranges = json.load(f)
+        ranges = ranges.get('feature_ranges', ranges)
+        feature_names = feature_names or list(ranges)
+
+    rng = np.random.default_rng(args.seed)
+    if args.data:
+        data = read_table(args.data)
+        background = data[feature_names].dropna().to_numpy(dtype=np.float64)
+        if len(background) > args.background_rows:
+            background = background[rng.choice(len(background), args.background_rows, replace=False)]
+    elif ranges:
+        background = np.column_stack([rng.uniform(ranges[n]['min'], ranges[n]['max'], args.background_rows)
+                                      for n in feature_names])
+    else:
+        raise SystemExit("需要背景数据（--data）或特征范围（--ranges）")
+
+    def grid_for(name):
+        column = background[:, feature_names.index(name)]
+        return make_grid(column, args.grid_points, (ranges or {}).get(name), args.grid)
+
+    engine = PartialDependence()
+    score_fn = make_array_predict(model, args.dtype)
+    if args.feature2:
+        result = engine.interaction(score_fn, background, feature_names, [args.feature, args.feature2],
+                                    [grid_for(args.feature), grid_for(args.feature2)], model_hash)
+        table = result.surface_frame()
+    else:
+        result = engine.ice(score_fn, background, feature_names, args.feature, grid_for(args.feature), model_hash)
+        table = result.average_frame()
+    print(f"{' × '.join(result.features)}: 背景 {len(background)} 行, 打分 {result.rows_scored} 行, "
+          f"耗时 {result.seconds:.2f} 秒 ({result.rows_scored / max(result.seconds, 1e-9):.0f} 行/秒)")
+    with pd.option_context("display.max_columns", 12, "display.width", 200):
+        print(table.round(4).to_string())
+
+    # 同一分析再次请求直接命中缓存
+    start = time.perf_counter()
+    if args.feature2:
+        engine.interaction(score_fn, background, feature_names, [args.feature, args.feature2],
+                           [grid_for(args.feature), grid_for(args.feature2)], model_hash)
+    else:
+        engine.ice(score_fn, background, feature_names, args.feature, grid_for(args.feature), model_hash)
+    print(f"重复请求: {(time.perf_counter() - start) * 1000:.2f} ms (缓存命中 {engine.hits} 次)")
+
+    if args.output:
+        table.to_csv(args.output, encoding='utf-8-sig')
+        print(f"已保存: {args.output}")
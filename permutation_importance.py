@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+与模型无关的置换特征重要性
+现有的特征重要性只有静态的 feature_importance.csv 和 Fraud_detection-10.py 中按 model_weights 加权的
+CatBoost get_feature_importance()，sklearn / XGBoost 的重金属和吸附模型没有可比较的重要性。
+本模块对任意可预测的产物（joblib模型文件或 *_Yield%_Model 目录）计算置换重要性:
+    - 每个特征的所有重复置换放在一个预先分配的 (重复次数*行数, 特征数) 缓冲区中，一次批量打分；
+      缓冲区在各特征间复用，只改写被置换的那一列
+    - 特征分配到进程池中并行计算，每个工作进程在初始化时加载一次模型和数据，按 --threads-per-worker 限制模型线程
+    - 有真实目标值时以RMSE增量衡量；没有目标值时以模型自身的未置换预测为参照（预测偏离量）
+    - 各输出的RMSE增量除以参照值的标准差后取平均（importance），再归一化为占比（share），
+      不同产物、不同目标之间可以直接比较
+结果按（模型内容哈希, 数据哈希, 参数）缓存在 importance_cache/ 目录，同一产物重复计算直接读取。
+
+用法:
+    python permutation_importance.py --models "multi_*.joblib" "single_*.joblib" --ranges heavy_metal_ranges.json
+    python permutation_importance.py --model-dir "Char_Yield%_Model" --data fraud.xlsx --target "Char Yield(%)" --jobs 4
+    python permutation_importance.py --models "*.joblib" --model-dir "*_Model" --output importance_summary.csv
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+from batch_jobs import read_table
+from fingerprint import artifact_fingerprint, fingerprint
+from float32_inference import EnsembleDirModel, predict_array
+from model_registry import load_joblib
+from partial_dependence import array_digest
+
+IMPORTANCE_VERSION = 1
+CACHE_DIR = "importance_cache"
+
+# 工作进程的全局状态（由_init_worker设置，每个进程只加载一次模型和数据）
+_WORKER = {}
+
+
+def load_artifact(path):
+    """加载joblib模型文件或 *_Yield%_Model 目录（返回EnsembleDirModel）"""
+    return EnsembleDirModel(path) if os.path.isdir(path) else load_joblib(path)
+
+
+def artifact_features(model):
+    """产物的特征名，没有记录时返回None"""
+    names = getattr(model, 'feature_names', None)
+    if names is None:
+        names = getattr(model, 'feature_names_in_', None)
+    return list(names) if names is not None else None
+
+
+def artifact_ranges(model, feature_names):
+    """
+    产物自带的特征范围：模型目录取metadata.json中的feature_ranges；
+    Pipeline以RobustScaler/StandardScaler开头时按 中心 ± 2倍尺度 推断（近似，报告中标注为inferred）
+    """
+    metadata = getattr(model, 'metadata', None)
+    if metadata and metadata.get('feature_ranges'):
+        return metadata['feature_ranges'], "metadata"
+    if isinstance(model, Pipeline) and len(model.steps) > 1:
+        scaler = model.steps[0][1]
+        center = getattr(scaler, 'center_', getattr(scaler, 'mean_', None))
+        scale = getattr(scaler, 'scale_', None)
+        if center is not None and scale is not None:
+            return {name: {'min': float(c - 2.0 * s), 'max': float(c + 2.0 * s)}
+                    for name, c, s in zip(feature_names, center, scale)}, "inferred"
+    return None, None
+
+
+def _init_worker(model_path, X, reference, n_repeats, seed, threads, model=None):
+    model = model if model is not None else load_artifact(model_path)
+    _WORKER.update(model=model, X=X, reference=reference, n_repeats=n_repeats, seed=seed, threads=threads,
+                   buffer=np.empty((n_repeats * len(X), X.shape[1]), dtype=X.dtype))
+    # 未置换的缓冲区：各重复块都是原始数据，之后每个特征只改写一列再恢复
+    _WORKER["buffer"].reshape(n_repeats, len(X), X.shape[1])[:] = X
+
+
+def _rmse_per_output(prediction, reference):
+    error = prediction.reshape(len(reference), -1) - reference
+    return np.sqrt(np.mean(error ** 2, axis=0))
+
+
+def _score_feature(column):
+    """工作进程中：对一个特征做n_repeats次置换，一次批量打分，返回每次重复各输出的RMSE"""
+    X, reference, buffer = _WORKER["X"], _WORKER["reference"], _WORKER["buffer"]
+    n_repeats, n_rows = _WORKER["n_repeats"], len(X)
+    rng = np.random.default_rng([_WORKER["seed"], column])
+    for repeat in range(n_repeats):
+        buffer[repeat * n_rows:(repeat + 1) * n_rows, column] = X[rng.permutation(n_rows), column]
+    prediction = predict_array(_WORKER["model"], buffer, _WORKER["threads"]).reshape(n_repeats, n_rows, -1)
+    buffer[:, column] = np.tile(X[:, column], n_repeats)
+    return column, np.stack([_rmse_per_output(prediction[repeat], reference) for repeat in range(n_repeats)])
+
+
+def permutation_importance(model_path, X, feature_names, y=None, n_repeats=5, seed=0, n_jobs=1,
+                           threads_per_worker=1, output_names=None, model=None):
+    """
+    计算一个产物的置换重要性
+
+    参数:
+        model_path: joblib模型文件或模型目录（工作进程各自加载）
+        X: 评估数据 (行数, 特征数)，按feature_names排列
+        y: 真实目标值 (行数[, 输出数])；为None时以未置换的预测为参照
+        n_jobs: 进程数（1时在当前进程中计算）
+        threads_per_worker: 每个进程中模型预测使用的线程数
+        model: 已加载的产物（可选，当前进程中复用，工作进程仍按路径加载）
+
+    返回:
+        (DataFrame, 元信息字典)
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    start = time.perf_counter()
+    model = model if model is not None else load_artifact(model_path)
+    base = predict_array(model, X, threads_per_worker).reshape(len(X), -1)
+    reference = base if y is None else np.asarray(y, dtype=np.float64).reshape(len(X), -1)
+    base_rmse = _rmse_per_output(base, reference)
+    reference_std = np.maximum(reference.std(axis=0), 1e-12)
+
+    init_args = (model_path, X, reference, n_repeats, seed, threads_per_worker)
+    columns = range(X.shape[1])
+    if n_jobs == 1:
+        _init_worker(*init_args, model=model)
+        results = dict(_score_feature(column) for column in columns)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=init_args) as executor:
+            results = dict(executor.map(_score_feature, columns))
+
+    output_names = list(output_names or [f"输出{i}" for i in range(reference.shape[1])])
+    rows = []
+    for column, name in enumerate(feature_names):
+        increase = results[column] - base_rmse                  # (重复次数, 输出数)
+        normalized = (increase / reference_std).mean(axis=1)    # 各输出按参照标准差归一化后取平均
+        row = {"特征": name, "importance": float(normalized.mean()), "importance_std": float(normalized.std())}
+        for index, output in enumerate(output_names):
+            row[f"RMSE增量[{output}]"] = float(increase[:, index].mean())
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    positive = table["importance"].clip(lower=0.0)
+    table["share"] = positive / positive.sum() if positive.sum() > 0 else 0.0
+    table = table.sort_values("importance", ascending=False, ignore_index=True)
+
+    meta = {
+        "reference": "target" if y is not None else "model",
+        "rows": int(len(X)),
+        "n_repeats": n_repeats,
+        "rows_scored": int(len(X) * (1 + n_repeats * X.shape[1])),
+        "base_rmse": dict(zip(output_names, base_rmse.tolist())),
+        "seconds": time.perf_counter() - start,
+    }
+    return table, meta
+
+
+def cached_permutation_importance(model_path, X, feature_names, y=None, n_repeats=5, seed=0, n_jobs=1,
+                                  threads_per_worker=1, output_names=None, model=None, cache_dir=CACHE_DIR):
+    """
+    带磁盘缓存的permutation_importance：缓存键为模型内容哈希、数据哈希和参数
+
+    返回:
+        (DataFrame, 元信息字典)，元信息中cached表示是否命中缓存
+    """
+    key = fingerprint(IMPORTANCE_VERSION, artifact_fingerprint(model_path), array_digest(np.asarray(X, dtype=np.float64)),
+                      array_digest(np.asarray(y, dtype=np.float64)) if y is not None else "model", n_repeats, seed)
+    stem = os.path.splitext(os.path.basename(os.path.normpath(model_path)))[0]
+    path = os.path.join(cache_dir, f"{stem}-{key}.json")
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        return pd.DataFrame(cached["table"]), dict(cached["meta"], cached=True)
+
+    table, meta = permutation_importance(model_path, X, feature_names, y, n_repeats, seed, n_jobs,
+                                         threads_per_worker, output_names, model)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"model": stem, "meta": meta, "table": table.to_dict(orient="records")}, f,
+                  ensure_ascii=False, indent=4)
+    return table, dict(meta, cached=False)
+
+
+def evaluation_data(model, feature_names, data=None, targets=None, ranges=None, n_rows=2000, seed=0):
+    """
+    评估数据：优先使用真实数据（含目标列时一并返回y），否则在特征范围内均匀采样
+
+    返回:
+        (X, y, 数据来源)；无法得到数据时返回(None, None, 原因)
+    """
+    rng = np.random.default_rng(seed)
+    if data is not None and all(name in data.columns for name in feature_names):
+        columns = feature_names + [t for t in (targets or []) if t in data.columns]
+        frame = data[columns].dropna()
+        if len(frame) > n_rows:
+            frame = frame.iloc[rng.choice(len(frame), n_rows, replace=False)]
+        y = frame[targets].to_numpy(dtype=np.float64) if targets and all(t in frame.columns for t in targets) else None
+        return frame[feature_names].to_numpy(dtype=np.float64), y, "data"
+    source = "ranges"
+    if ranges is None or not all(name in ranges for name in feature_names):
+        ranges, source = artifact_ranges(model, feature_names)
+    if ranges is None:
+        return None, None, "没有数据和特征范围"
+    X = np.column_stack([rng.uniform(ranges[n]['min'], ranges[n]['max'], n_rows) for n in feature_names])
+    return X, None, source
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="与模型无关的置换特征重要性（进程池并行，按模型哈希缓存）")
+    parser.add_argument("--models", nargs="*", default=[], help="joblib模型文件（支持通配符）")
+    parser.add_argument("--model-dir", nargs="*", default=[], help="*_Yield%%_Model目录（支持通配符）")
+    parser.add_argument("--data", help="评估数据（.csv / .xlsx）")
+    parser.add_argument("--target", nargs="*", default=[], help="数据中的目标列（有则以真实值为参照）")
+    parser.add_argument("--ranges", help="特征范围JSON（{特征: {min, max}}），没有数据时在范围内采样")
+    parser.add_argument("--rows", type=int, default=2000, help="评估行数")
+    parser.add_argument("--repeats", type=int, default=5, help="每个特征的置换次数")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="进程数")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="每个进程的模型线程数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="结果缓存目录")
+    parser.add_argument("--output", help="把所有产物的重要性占比汇总保存为CSV")
+    args = parser.parse_args()
+
+    data = None
+    if args.data:
+        data = read_table(args.data)
+    ranges = None
+    if args.ranges:
+        with open(args.ranges, 'r', encoding='utf-8') as f:
+            ranges = json.load(f)
+        ranges = ranges.get('feature_ranges', ranges)
+
+    paths = sorted({p for pattern in args.models for p in (glob.glob(pattern) or [pattern]) if os.path.isfile(p)})
+    paths += sorted({p for pattern in args.model_dir for p in (glob.glob(pattern) or [pattern]) if os.path.isdir(p)})
+
+    summary = []
+    for model_path in paths:
+        name = os.path.basename(os.path.normpath(model_path))
+        try:
+            model = load_artifact(model_path)
+        except Exception as e:
+            print(f"跳过 {name}: 无法加载 ({type(e).__name__}: {str(e)[:80]})")
+            continue
+        feature_names = artifact_features(model)
+        if not feature_names:
+            print(f"跳过 {name}: 没有记录特征名")
+            continue
+        X, y, source = evaluation_data(model, feature_names, data, args.target, ranges, args.rows, args.seed)
+        if X is None:
+            print(f"跳过 {name}: {source}")
+            continue
+
+        table, meta = cached_permutation_importance(model_path, X, feature_names, y, args.repeats, args.seed,
+                                                    args.jobs, args.threads_per_worker,
+                                                    args.target if y is not None else None, model, args.cache_dir)
+        timing = "命中缓存" if meta['cached'] else f"耗时 {meta['seconds']:.2f} 秒"
+        print(f"\n{name}: {meta['rows']} 行（{source}）, 参照={meta['reference']}, 重复 {meta['n_repeats']} 次, {timing}")
+        print(table[["特征", "importance", "importance_std", "share"]].round(4).to_string(index=False))
+        summary.append(table.set_index("特征")["share"].rename(name))
+
+    if args.output and summary:
+        pd.concat(summary, axis=1).round(4).to_csv(args.output, encoding='utf-8-sig')
+        print(f"\n已保存: {args.output}")
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+预测历史存储（SQLite）
+每次预测（模型哈希、目标、输入、输出、耗时、警告）追加到本地SQLite数据库。写入先进入内存缓冲，
+达到批量大小或超过刷新间隔后在一个事务中批量插入；数据库使用WAL模式，读取不阻塞写入。
+表上建有目标和输入哈希索引：
+    - 相同模型、相同目标、相同输入的重复查询（包括应用重启后）只需一次索引查找
+    - 用户可以按目标分页浏览、导出历史，不需要重新计算
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+DEFAULT_DB_PATH = "prediction_history.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    app TEXT,
+    session_id TEXT,
+    model_name TEXT,
+    model_hash TEXT,
+    target TEXT,
+    input_hash TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    latency_ms REAL,
+    warnings TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_target ON predictions (target, id);
+CREATE INDEX IF NOT EXISTS idx_predictions_input ON predictions (input_hash, model_hash, target);
+"""
+
+_COLUMNS = ("created_at", "app", "session_id", "model_name", "model_hash", "target",
+            "input_hash", "inputs", "outputs", "latency_ms", "warnings")
+
+# 历史页面显示和导出使用的列
+HISTORY_COLUMNS = ["id", "created_at", "model_name", "model_hash", "target",
+                   "inputs", "outputs", "latency_ms", "warnings"]
+
+
+def compute_input_hash(inputs, decimals=9):
+    """
+    计算输入特征的哈希值（与特征顺序无关）
+    数值四舍五入到decimals位，避免浮点表示差异导致相同输入哈希不同
+    """
+    canonical = {
+        str(name): round(float(value), decimals) if isinstance(value, (int, float)) else value
+        for name, value in inputs.items()
+    }
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _to_jsonable(value):
+    """把numpy数组/标量转换为可JSON序列化的Python对象"""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {str(k): _to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(v) for v in value]
+    return value
+
+
+class PredictionStore:
+    """带批量写入缓冲的SQLite预测历史存储，进程内共享，线程安全"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, batch_size=50, flush_interval=1.0):
+        """
+        参数:
+            db_path: 数据库文件路径
+            batch_size: 缓冲记录达到该数量时立即写入
+            flush_interval: 后台线程每隔该秒数写入一次缓冲中的记录
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._stop_event = threading.Event()
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+        connection.commit()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="prediction-store-flush", daemon=True)
+        self._flusher.start()
+
+    def _connection(self):
+        """每个线程使用自己的连接（sqlite3连接不能跨线程共享）"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def record(self, inputs, outputs, target, model_name=None, model_hash=None,
+               latency_ms=None, warnings=None, app=None, session_id=None):
+        """
+        追加一条预测记录（写入缓冲，批量提交）
+
+        参数:
+            inputs: 输入特征字典
+            outputs: 预测输出（标量、列表或{目标: 值}字典）
+            target: 预测目标
+            model_name / model_hash: 模型名称和内容哈希
+            latency_ms: 预测耗时（毫秒）
+            warnings: 警告文本列表
+
+        返回:
+            输入哈希
+        """
+        input_hash = compute_input_hash(inputs)
+        row = (
+            time.time(), app, session_id, model_name, model_hash, target, input_hash,
+            json.dumps(_to_jsonable(inputs), ensure_ascii=False),
+            json.dumps(_to_jsonable(outputs), ensure_ascii=False),
+            None if latency_ms is None else float(latency_ms),
+            json.dumps(list(warnings or []), ensure_ascii=False),
+        )
+        with self._buffer_lock:
+            self._buffer.append(row)
+            should_flush = len(self._buffer) >= self.batch_size
+        if should_flush:
+            self.flush()
+        return input_hash
+
+    def flush(self):
+        """把缓冲中的记录在一个事务中写入数据库"""
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with self._write_lock:
+            connection = self._connection()
+            with connection:
+                connection.executemany(
+                    f"INSERT INTO predictions ({', '.join(_COLUMNS)}) VALUES ({placeholders})", rows
+                )
+        return len(rows)
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"预测历史写入失败: {e}")
+
+    def lookup(self, inputs, target, model_hash):
+        """
+        查找相同模型、相同目标、相同输入的最近一次预测
+
+        返回:
+            记录字典（outputs/inputs/warnings已解析），没有时返回None
+        """
+        input_hash = compute_input_hash(inputs)
+
+        # 先查还在缓冲中的记录
+        with self._buffer_lock:
+            for row in reversed(self._buffer):
+                if row[6] == input_hash and row[5] == target and row[4] == model_hash:
+                    return self._decode(dict(zip(("id",) + _COLUMNS, (None,) + row)))
+
+        cursor = self._connection().execute(
+            f"SELECT id, {', '.join(_COLUMNS)} FROM predictions "
+            "WHERE input_hash = ? AND model_hash IS ? AND target IS ? ORDER BY id DESC LIMIT 1",
+            (input_hash, model_hash, target)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return self._decode(dict(zip(("id",) + _COLUMNS, row)))
+
+    @staticmethod
+    def _decode(record):
+        for key in ("inputs", "outputs", "warnings"):
+            if record.get(key) is not None:
+                record[key] = json.loads(record[key])
+        return record
+
+    def _where(self, target):
+        if target is None:
+            return "", ()
+        return "WHERE target = ?", (target,)
+
+    def count(self, target=None):
+        """历史记录数（可按目标筛选）"""
+        self.flush()
+        where, params = self._where(target)
+        return self._connection().execute(f"SELECT COUNT(*) FROM predictions {where}", params).fetchone()[0]
+
+    def targets(self):
+        """历史中出现过的目标列表"""
+        self.flush()
+        rows = self._connection().execute("SELECT DISTINCT target FROM predictions ORDER BY target").fetchall()
+        return [row[0] for row in rows if row[0] is not None]
+
+    def page(self, page=0, page_size=50, target=None):
+        """
+        分页读取历史（最新的在前）
+
+        返回:
+            DataFrame，列见HISTORY_COLUMNS，created_at为UTC时间
+        """
+        self.flush()
+        where, params = self._where(target)
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(HISTORY_COLUMNS)} FROM predictions {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            self._connection(), params=params + (int(page_size), int(page) * int(page_size))
+        )
+        df["created_at"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.tz_convert(None)
+        return df
+
+    def iter_batches(self, target=None, batch_size=5000, columns=None):
+        """
+        按id顺序分批读取历史（每批一个DataFrame），用于大结果集的流式导出
+
+        参数:
+            target: 按目标筛选
+            batch_size: 每批行数
+            columns: 读取的列（默认HISTORY_COLUMNS，总是包含id）
+        """
+        self.flush()
+        columns = list(columns or HISTORY_COLUMNS)
+        if "id" not in columns:
+            columns.insert(0, "id")
+        where, params = self._where(target)
+        where = f"{where} AND id > ?" if where else "WHERE id > ?"
+        last_id = 0
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            while True:
+                df = pd.read_sql_query(
+                    f"SELECT {', '.join(columns)} FROM predictions {where} ORDER BY id LIMIT ?",
+                    connection, params=params + (last_id, int(batch_size))
+                )
+                if df.empty:
+                    break
+                last_id = int(df["id"].iloc[-1])
+                yield df
+                if len(df) < batch_size:
+                    break
+        finally:
+            connection.close()
+
+    def close(self):
+        """停止后台刷新并写入剩余记录"""
+        self._stop_event.set()
+        self._flusher.join(timeout=self.flush_interval + 1)
+        self.flush()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+批量预测结果导出（CSV / Parquet / XLSX）
+结果按批次流式写入临时文件，不在内存中构建完整的工作簿或字符串：
+    - CSV: 逐批追加（utf-8-sig，Excel可直接打开）
+    - Parquet: 需要pyarrow（可选依赖），逐批写入同一个文件的多个row group
+    - XLSX: openpyxl只写模式（write_only），逐行追加，超过Excel行数上限时自动分表
+数据源可以是DataFrame（按行切片）、PredictionStore（按id分批读取）或任意DataFrame批次迭代器。
+配合 st.download_button(data=callable) 使用时，文件只在用户点击下载时生成。
+
+用法:
+    python result_export.py --db heavy_metal_predictions.db --format xlsx --output history.xlsx
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# 格式 -> (扩展名, MIME类型)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+DEFAULT_BATCH_SIZE = 20000
+
+# Excel单个工作表最多1048576行（含表头）
+XLSX_MAX_ROWS = 1048575
+
+# 导出文件缓存目录（相同结果、相同格式只生成一次）
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "prediction_exports")
+
+# 导出文件缓存的总大小上限，超过时按最近使用时间淘汰最旧的文件
+EXPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def available_formats():
+    """当前环境可用的导出格式"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != "parquet" or PARQUET_AVAILABLE]
+
+
+def iter_frames(source, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    把数据源统一为DataFrame批次迭代器
+
+    参数:
+        source: DataFrame、带iter_batches方法的对象（如PredictionStore）或DataFrame迭代器
+    """
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, max(len(source), 1), batch_size):
+            yield source.iloc[start:start + batch_size]
+    elif hasattr(source, "iter_batches"):
+        yield from source.iter_batches(batch_size=batch_size)
+    else:
+        yield from source
+
+
+def _write_csv(frames, path):
+    rows = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        for i, frame in enumerate(frames):
+            frame.to_csv(f, header=(i == 0), index=False)
+            rows += len(frame)
+    return rows
+
+
+def _write_parquet(frames, path):
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquet导出需要安装pyarrow")
+    rows = 0
+    writer = None
+    try:
+        for frame in frames:
+            if writer is None:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                # 后续批次按第一批的schema转换，避免某批全为空值时类型推断不一致
+                table = pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            rows += len(frame)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _xlsx_value(value):
+    """openpyxl只接受Python原生类型，NaN写为空单元格"""
+    if value is None:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+        return None if isinstance(value, float) and np.isnan(value) else value
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+
+def _write_xlsx(frames, path, sheet_name="结果"):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    sheet_count = 0
+    rows = 0
+    header = None
+    for frame in frames:
+        if header is None:
+            header = [str(column) for column in frame.columns]
+        for values in frame.itertuples(index=False, name=None):
+            if sheet is None or sheet_rows >= XLSX_MAX_ROWS:
+                sheet_count += 1
+                sheet = workbook.create_sheet(sheet_name if sheet_count == 1 else f"{sheet_name}_{sheet_count}")
+                sheet.append(header)
+                sheet_rows = 0
+            sheet.append([_xlsx_value(value) for value in values])
+            sheet_rows += 1
+        rows += len(frame)
+    if sheet is None:
+        sheet = workbook.create_sheet(sheet_name)
+        if header:
+            sheet.append(header)
+    workbook.save(path)
+    return rows
+
+
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "xlsx": _write_xlsx}
+
+
+def export_to_file(source, fmt, path=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    把数据源按批次流式写入文件
+
+    参数:
+        source: 见iter_frames
+        fmt: "csv" / "parquet" / "xlsx"
+        path: 输出路径，默认在EXPORT_DIR中创建临时文件
+
+    返回:
+        (文件路径, 行数, 耗时秒)
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"不支持的导出格式: {fmt}（可选: {', '.join(EXPORT_FORMATS)}）")
+    if path is None:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=EXPORT_FORMATS[fmt][0], dir=EXPORT_DIR)
+        os.close(fd)
+
+    start = time.perf_counter()
+    # 先写入临时文件再改名，避免并发下载读到写了一半的文件
+    partial_path = f"{path}.partial"
+    try:
+        rows = _WRITERS[fmt](iter_frames(source, batch_size), partial_path)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return path, rows, time.perf_counter() - start
+
+
+def cached_export_path(key, fmt):
+    """按结果标识和格式得到导出文件缓存路径"""
+    digest = hashlib.sha256(str(key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(EXPORT_DIR, f"{digest}{EXPORT_FORMATS[fmt][0]}")
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def prune_export_cache(max_bytes=EXPORT_CACHE_MAX_BYTES):
+    """
+    按最近使用时间（mtime，命中时更新）淘汰导出缓存，直到总大小不超过max_bytes
+    最新的文件不淘汰（可能正被刚生成它的请求读取）
+
+    返回:
+        删除的文件数
+    """
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+    entries = []
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.is_file() and not entry.name.endswith(".partial"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in entries[:-1]:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def deferred_download(source_fn, fmt, cache_key=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    返回供 st.download_button(data=...) 使用的无参函数：点击下载时才生成文件并返回文件内容（bytes）
+
+    参数:
+        source_fn: 无参函数，返回数据源（见iter_frames）；在点击下载时才调用
+        fmt: 导出格式
+        cache_key: 结果标识（如批量任务的输入哈希）；提供时相同结果相同格式只生成一次，
+                   缓存总大小超过EXPORT_CACHE_MAX_BYTES时淘汰最久未使用的文件；不提供时读取后删除临时文件
+    """
+    def generate():
+        if cache_key is None:
+            path, _, _ = export_to_file(source_fn(), fmt, batch_size=batch_size)
+            try:
+                return _read_bytes(path)
+            finally:
+                os.remove(path)
+
+        path = cached_export_path(cache_key, fmt)
+        try:
+            os.utime(path)  # 记录最近使用时间
+            return _read_bytes(path)
+        except FileNotFoundError:
+            pass
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        export_to_file(source_fn(), fmt, path, batch_size)
+        data = _read_bytes(path)
+        prune_export_cache()
+        return data
+
+    return generate
+
+
+if __name__ == "__main__":
+    from prediction_store import PredictionStore
+
+    parser = argparse.ArgumentParser(description="导出预测历史")
+    parser.add_argument("--db", required=True, help="预测历史数据库（SQLite）")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv", help="导出格式")
+    parser.add_argument("--target", help="只导出指定目标")
+    parser.add_argument("--output", required=True, help="输出文件")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每批读取行数")
+    args = parser.parse_args()
+
+    store = PredictionStore(args.db)
+    path, rows, elapsed = export_to_file(
+        store.iter_batches(target=args.target, batch_size=args.batch_size), args.format, args.output, args.batch_size
+    )
+    store.close()
+    print(f"已导出 {rows} 行到 {path}（{elapsed:.2f} 秒）")
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+候选模型影子评估
+每次线上预测完成后，把输入和线上结果放入队列，由后台线程用配置的候选模型再评分一次，
+把两个模型的耗时和输出差值追加写入紧凑的JSONL指标日志。用户只拿到线上模型的结果，
+候选模型的加载和评分都不在请求路径上；队列满时直接丢弃（计数），不会阻塞预测。
+
+汇总指标日志:
+    python shadow_eval.py shadow_metrics.jsonl
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from model_registry import load_joblib
+
+DEFAULT_METRICS_PATH = "shadow_metrics.jsonl"
+
+
+class ShadowEvaluator:
+    """在后台线程中用候选模型对线上请求做影子评分，并记录耗时和输出差值"""
+
+    def __init__(self, candidate_path, metrics_path=DEFAULT_METRICS_PATH, max_queue=1000, loader=load_joblib):
+        """
+        参数:
+            candidate_path: 候选模型文件
+            metrics_path: 指标日志路径（JSONL，追加写入）
+            max_queue: 等待评分的最大请求数，超出时丢弃
+            loader: 候选模型加载函数
+        """
+        self.candidate_path = candidate_path
+        self.candidate_name = os.path.basename(candidate_path)
+        self.metrics_path = metrics_path
+        self.loader = loader
+        self.recorded = 0
+        self.dropped = 0
+        self.failed = 0
+        self._candidate = None
+        self._load_error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._write_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="shadow-eval", daemon=True)
+        self._worker.start()
+
+    def submit(self, features_df, live_prediction, live_ms, live_name):
+        """
+        提交一次影子评分（非阻塞）
+
+        参数:
+            features_df: 线上模型使用的特征DataFrame（列名为模型特征名）
+            live_prediction: 线上模型的预测值（标量或数组）
+            live_ms: 线上模型预测耗时（毫秒）
+            live_name: 线上模型名称
+
+        返回:
+            是否成功放入队列
+        """
+        try:
+            self._queue.put_nowait((time.time(), features_df.copy(), live_prediction, live_ms, live_name))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _load_candidate(self):
+        """在工作线程中首次使用时加载候选模型"""
+        if self._candidate is None and self._load_error is None:
+            try:
+                self._candidate = self.loader(self.candidate_path)
+                print(f"影子评估: 已加载候选模型 {self.candidate_path}")
+            except Exception as e:
+                self._load_error = str(e)
+                print(f"影子评估: 候选模型加载失败 {self.candidate_path}: {e}")
+        return self._candidate
+
+    def _candidate_input(self, features_df):
+        """按候选模型训练时的特征名整理输入；缺少特征时返回(None, 缺失列表)"""
+        expected = getattr(self._candidate, 'feature_names_in_', None)
+        if expected is None:
+            return features_df, []
+        missing = [name for name in expected if name not in features_df.columns]
+        if missing:
+            return None, missing
+        return features_df[list(expected)], []
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(self._evaluate(*item))
+            except Exception as e:
+                self.failed += 1
+                print(f"影子评估失败: {e}\n{traceback.format_exc()}")
+            finally:
+                self._queue.task_done()
+
+    def _evaluate(self, timestamp, features_df, live_prediction, live_ms, live_name):
+        """对一条请求做候选模型评分，返回指标记录"""
+        live = np.asarray(live_prediction, dtype=float).ravel()
+        record = {
+            "ts": round(timestamp, 3),
+            "live": live_name,
+            "cand": self.candidate_name,
+            "hash": hashlib.sha1(np.ascontiguousarray(features_df.to_numpy(dtype=float)).tobytes()).hexdigest()[:12],
+            "live_ms": round(float(live_ms), 3),
+            "live_y": [round(float(v), 6) for v in live],
+        }
+
+        candidate = self._load_candidate()
+        if candidate is None:
+            record["skip"] = f"load: {self._load_error}"
+            return record
+
+        candidate_input, missing = self._candidate_input(features_df)
+        if candidate_input is None:
+            record["skip"] = "missing: " + ",".join(missing)
+            return record
+
+        start = time.perf_counter()
+        candidate_prediction = candidate.predict(candidate_input)
+        record["cand_ms"] = round((time.perf_counter() - start) * 1000.0, 3)
+
+        cand = np.asarray(candidate_prediction, dtype=float).ravel()[:len(live)]
+        record["cand_y"] = [round(float(v), 6) for v in cand]
+        record["delta"] = [round(float(c - l), 6) for c, l in zip(cand, live)]
+        return record
+
+    def _write(self, record):
+        """追加写入一行指标记录"""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._write_lock:
+            with open(self.metrics_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        self.recorded += 1
+
+    def flush(self, timeout=None):
+        """等待队列中的影子评分全部完成（主要用于脚本和调试）"""
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def close(self):
+        """停止后台线程"""
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def status(self):
+        """返回影子评估的运行状态"""
+        return {
+            "候选模型": self.candidate_name,
+            "已记录": self.recorded,
+            "排队中": self._queue.qsize(),
+            "已丢弃": self.dropped,
+            "失败": self.failed,
+        }
+
+
+def summarize_metrics(metrics_path=DEFAULT_METRICS_PATH):
+    """
+    汇总影子评估指标日志
+
+    返回:
+        DataFrame，每对(线上模型, 候选模型)一行：记录数、跳过数、两个模型的平均/P95耗时、
+        平均差值、平均绝对差值和最大绝对差值
+    """
+    if not os.path.exists(metrics_path):
+        return pd.DataFrame()
+
+    records = []
+    with open(metrics_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    if not records:
+        return pd.DataFrame()
+
+    rows = []
+    df = pd.DataFrame(records)
+    for (live, cand), group in df.groupby(["live", "cand"]):
+        scored = group[group["delta"].notna()] if "delta" in group else group.iloc[0:0]
+        deltas = np.concatenate([np.asarray(d, dtype=float) for d in scored["delta"]]) if len(scored) else np.array([])
+        rows.append({
+            "线上模型": live,
+            "候选模型": cand,
+            "记录数": len(group),
+            "跳过数": len(group) - len(scored),
+            "线上平均耗时(ms)": group["live_ms"].mean(),
+            "线上P95耗时(ms)": group["live_ms"].quantile(0.95),
+            "候选平均耗时(ms)": scored["cand_ms"].mean() if len(scored) else np.nan,
+            "候选P95耗时(ms)": scored["cand_ms"].quantile(0.95) if len(scored) else np.nan,
+            "平均差值": deltas.mean() if len(deltas) else np.nan,
+            "平均绝对差值": np.abs(deltas).mean() if len(deltas) else np.nan,
+            "最大绝对差值": np.abs(deltas).max() if len(deltas) else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="汇总影子评估指标日志")
+    parser.add_argument("metrics_path", nargs="?", default=DEFAULT_METRICS_PATH, help="指标日志路径（JSONL）")
+    args = parser.parse_args()
+
+    summary = summarize_metrics(args.metrics_path)
+    if summary.empty:
+        print(f"没有可汇总的记录: {args.metrics_path}")
+    else:
+        with pd.option_context("display.max_columns", None, "display.width", 200):
+            print(summary.round(4).to_string(index=False))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+训练集近邻相似度索引
+在标准化后的训练特征上建立KD树，预测时返回输入点到训练集k个最近邻的平均距离
+和相似度分数，用于识别位于训练数据稀疏区域的外推预测（min/max范围检查无法发现）。
+
+索引保存在模型目录旁（<模型目录>-similarity_index.joblib），不写入模型目录本身，
+避免改变注册表的内容哈希和缓存指纹（否则构建索引会触发整个集成的热重载）。由训练数据离线构建:
+    python similarity_index.py --data 训练数据.xlsx --model-dir "Char_Yield%_Model"
+    python similarity_index.py --data 重金属训练数据.csv --output heavy_metal_similarity_index.joblib \
+        --features pH V T LD Ap f SP
+"""
+
+import argparse
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from batch_jobs import read_table
+
+INDEX_SUFFIX = "-similarity_index.joblib"
+INDEX_VERSION = 1
+
+
+def similarity_index_path(path):
+    """模型目录对应的索引文件路径（目录旁的<模型目录>-similarity_index.joblib）；文件路径原样返回"""
+    if os.path.isdir(path):
+        return os.path.normpath(path) + INDEX_SUFFIX
+    return path
+
+
+class SimilarityIndex:
+    """基于KD树的训练集近邻相似度索引"""
+
+    def __init__(self, feature_names, mean, scale, tree, train_distances, k=5, threshold_quantile=0.99):
+        self.feature_names = list(feature_names)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.tree = tree
+        # 训练样本自身的k近邻平均距离（已排序），作为相似度分数的参照分布
+        self.train_distances = np.sort(np.asarray(train_distances, dtype=np.float64))
+        self.k = int(k)
+        self.threshold_quantile = threshold_quantile
+        self.threshold = float(np.quantile(self.train_distances, threshold_quantile))
+        self.version = INDEX_VERSION
+
+    @classmethod
+    def build(cls, X, feature_names, k=5, leaf_size=40, threshold_quantile=0.99):
+        """
+        由训练特征矩阵构建索引
+
+        参数:
+            X: 训练特征（DataFrame或数组，列顺序与feature_names一致）
+            feature_names: 特征名称
+            k: 近邻数
+            leaf_size: KD树叶节点大小
+            threshold_quantile: 判定外推的距离分位数
+        """
+        if isinstance(X, pd.DataFrame):
+            X = X[list(feature_names)]
+        X = np.asarray(X, dtype=np.float64)
+        X = X[~np.isnan(X).any(axis=1)]
+        if len(X) <= k:
+            raise ValueError(f"训练样本数 ({len(X)}) 必须大于近邻数 k={k}")
+
+        mean = X.mean(axis=0)
+        scale = X.std(axis=0)
+        scale[scale == 0] = 1.0
+        scaled = (X - mean) / scale
+        tree = KDTree(scaled, leaf_size=leaf_size)
+
+        # 查询k+1个近邻并去掉自身，得到训练样本之间的典型距离
+        distances, _ = tree.query(scaled, k=k + 1)
+        train_distances = distances[:, 1:].mean(axis=1)
+        return cls(feature_names, mean, scale, tree, train_distances, k, threshold_quantile)
+
+    def _to_matrix(self, data):
+        """把字典、DataFrame或数组转换为按feature_names排列的二维数组"""
+        if isinstance(data, dict):
+            data = pd.DataFrame([data])
+        if isinstance(data, pd.DataFrame):
+            missing = [name for name in self.feature_names if name not in data.columns]
+            if missing:
+                raise ValueError(f"输入缺少以下特征: {missing}")
+            data = data[self.feature_names].apply(pd.to_numeric, errors='coerce')
+        matrix = np.asarray(data, dtype=np.float64)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        if matrix.shape[1] != len(self.feature_names):
+            raise ValueError(f"输入列数 {matrix.shape[1]} 与特征数量 {len(self.feature_names)} 不一致")
+        return matrix
+
+    def query(self, data):
+        """
+        查询输入点与训练集的相似度
+
+        参数:
+            data: 单行字典、DataFrame或 (n_rows, n_features) 数组
+
+        返回:
+            DataFrame，列为:
+                knn_distance: 到k个最近训练样本的平均标准化距离
+                similarity: 相似度分数（0~1，训练样本中近邻距离不小于该值的比例）
+                extrapolation: 距离超过阈值（训练分布的threshold_quantile分位数）时为True
+            含NaN的行结果为NaN / False
+        """
+        matrix = self._to_matrix(data)
+        n_rows = matrix.shape[0]
+        knn_distance = np.full(n_rows, np.nan)
+
+        valid = ~np.isnan(matrix).any(axis=1)
+        if valid.any():
+            scaled = (matrix[valid] - self.mean) / self.scale
+            distances, _ = self.tree.query(scaled, k=self.k)
+            knn_distance[valid] = distances.mean(axis=1)
+
+        similarity = np.full(n_rows, np.nan)
+        if valid.any():
+            rank = np.searchsorted(self.train_distances, knn_distance[valid], side='left')
+            similarity[valid] = 1.0 - rank / len(self.train_distances)
+
+        return pd.DataFrame({
+            "knn_distance": knn_distance,
+            "similarity": similarity,
+            "extrapolation": valid & (knn_distance > self.threshold),
+        })
+
+    def save(self, path):
+        """
+        保存索引；path为模型目录时保存为目录旁的<模型目录>-similarity_index.joblib
+        只保存数组和KD树（不序列化类本身），命令行构建的索引在应用中也能加载
+        """
+        path = similarity_index_path(path)
+        joblib.dump({
+            "version": self.version,
+            "feature_names": self.feature_names,
+            "mean": self.mean,
+            "scale": self.scale,
+            "tree": self.tree,
+            "train_distances": self.train_distances,
+            "k": self.k,
+            "threshold_quantile": self.threshold_quantile,
+        }, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """加载索引；path为模型目录时读取目录旁的索引文件，文件不存在或无效时返回None"""
+        path = similarity_index_path(path)
+        if not os.path.exists(path):
+            return None
+        try:
+            state = joblib.load(path)
+        except Exception as e:
+            print(f"加载相似度索引失败 {path}: {e}")
+            return None
+        if not isinstance(state, dict) or state.get("version") != INDEX_VERSION:
+            print(f"相似度索引版本不匹配，忽略: {path}")
+            return None
+        return cls(state["feature_names"], state["mean"], state["scale"], state["tree"],
+                   state["train_distances"], state["k"], state["threshold_quantile"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由训练数据构建近邻相似度索引")
+    parser.add_argument("--data", required=True, help="训练数据文件（.csv / .xlsx）")
+    parser.add_argument("--model-dir", help="模型目录（读取metadata.json中的特征名，索引保存在目录旁）")
+    parser.add_argument("--output", help="索引输出路径（默认为 <模型目录>-similarity_index.joblib）")
+    parser.add_argument("--features", nargs="+", help="特征列名（默认取metadata.json中的feature_names）")
+    parser.add_argument("--k", type=int, default=5, help="近邻数")
+    args = parser.parse_args()
+
+    feature_names = args.features
+    if feature_names is None:
+        if not args.model_dir:
+            parser.error("未指定 --features 时必须提供 --model-dir")
+        with open(os.path.join(args.model_dir, "metadata.json"), "r", encoding="utf-8") as f:
+            feature_names = json.load(f)["feature_names"]
+
+    output = args.output or args.model_dir
+    if not output:
+        parser.error("必须提供 --output 或 --model-dir")
+
+    data = read_table(args.data)
+    index = SimilarityIndex.build(data, feature_names, k=args.k)
+    saved_path = index.save(output)
+    print(f"相似度索引已保存: {saved_path}")
+    print(f"训练样本数: {len(index.train_distances)}，k={index.k}，外推阈值距离: {index.threshold:.4f}")
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+静态资源地址解析
+根据 build_static_assets.py 生成的 static/asset_manifest.json，把源图片名（如"背景.png"）
+解析为本应用静态目录下带内容哈希的文件地址；清单缺失或未开启静态文件服务时回退到GitHub原始地址。
+
+缓存: Streamlit 1.66 的 app/static 路由（Starlette）不发送Cache-Control，浏览器只能按启发式缓存并重新验证。
+文件名带内容哈希、内容变化即换名，因此可以放心长期缓存，但响应头需要由前置代理/CDN添加，例如nginx:
+    location /app/static/ {
+        proxy_pass http://127.0.0.1:8501;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+Streamlit Cloud 上无法配置响应头，仍按Streamlit默认行为缓存。
+"""
+
+import json
+import os
+from functools import lru_cache
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+MANIFEST_PATH = os.path.join(STATIC_DIR, "asset_manifest.json")
+GITHUB_RAW_BASE = "https://raw.githubusercontent.com/HwyzsyHwy/APP-/main/"
+
+
+@lru_cache(maxsize=1)
+def load_asset_manifest():
+    """加载静态资源清单（进程内只读取一次）"""
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取静态资源清单失败: {e}")
+        return {}
+
+
+def static_serving_enabled():
+    """检查Streamlit是否开启了静态文件服务（server.enableStaticServing）"""
+    try:
+        import streamlit as st
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+
+def _pick_variant(variants, width, fmt):
+    """选择指定格式中不小于目标宽度的最小变体；没有则取最大的一个"""
+    candidates = sorted((v for v in variants if v["format"] == fmt), key=lambda v: v["width"])
+    if not candidates:
+        return None
+    if width is None:
+        return candidates[-1]
+    for variant in candidates:
+        if variant["width"] >= width:
+            return variant
+    return candidates[-1]
+
+
+def asset_url(source_name, width=None, fmt="webp"):
+    """
+    获取静态资源地址
+
+    参数:
+        source_name: 仓库中的源图片文件名，如"背景.png"
+        width: 期望显示宽度（像素），None表示最大尺寸
+        fmt: "webp" 或 "png"
+
+    返回:
+        app/static/下的相对地址（文件名带内容哈希，内容变化即换名），或GitHub回退地址
+    """
+    entry = load_asset_manifest().get(source_name)
+    if not entry or not static_serving_enabled():
+        return GITHUB_RAW_BASE + source_name
+
+    variant = _pick_variant(entry["variants"], width, fmt)
+    if variant is None:
+        return GITHUB_RAW_BASE + source_name
+    return f"app/static/{variant['file']}"
+
+
+def background_image_declarations(source_name, width=None):
+    """生成背景图CSS声明：PNG作为兜底，支持image-set的浏览器优先使用WebP"""
+    png_url = asset_url(source_name, width, fmt="png")
+    webp_url = asset_url(source_name, width, fmt="webp")
+    declarations = f"background-image: url('{png_url}');"
+    if webp_url != png_url:
+        declarations += (
+            f"\n        background-image: image-set(url('{webp_url}') type('image/webp'),"
+            f" url('{png_url}') type('image/png'));"
+        )
+    return declarations
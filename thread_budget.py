@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+线程预算管理
+多个会话同时预测时，CatBoost/XGBoost默认每次调用都使用全部CPU核心，NumPy/BLAS还有自己的线程池，
+结果是严重的线程超订，P99延迟反而比串行执行更差。ThreadBudget在进程内统计正在进行的预测数，
+每次预测按 总线程数 / 并发数 分配线程，并把线程数传给模型：
+    - CatBoost: predict(..., thread_count=n)（按调用传参，不修改共享模型）
+    - XGBoost: nthread 是booster上的参数，而注册表在会话间共享同一个模型对象，因此不修改共享的booster，
+      每次调用从该模型的副本池借出一个独立的booster副本设置nthread后预测，用完归还（池大小等于峰值并发，
+      并发调用互不等待）；取值只会降低，不超过模型原有的线程数
+    - sklearn 随机森林等: 按模型自身的n_jobs执行。这些模型按串行训练（n_jobs=None），joblib.parallel_config
+      只能把n_jobs=None的估计器提升为多线程（单行预测实测慢3-4倍），对显式n_jobs又不生效，因此不再包装
+    - BLAS: threadpoolctl（可选依赖，未安装时跳过）；BLAS线程数是进程级设置，因此在并发数变化时
+      统一设为当前每次调用的份额，而不是每次调用各自设置再恢复
+Pipeline、StackingRegressor、MultiOutputRegressor逐层展开，子模型同样按预算执行。
+
+配置（环境变量）:
+    THREAD_BUDGET_TOTAL          所有并发预测共享的线程总数（默认CPU核心数）
+    THREAD_BUDGET_MIN_PER_CALL   单次预测最少线程数（默认1）
+    THREAD_BUDGET_MAX_PER_CALL   单次预测最多线程数（默认等于总数）
+
+基准测试（1/8/32个并发预测器的P99延迟，默认线程 vs 线程预算）:
+    python thread_budget.py --model "Char_Yield%_Model" --concurrency 1 8 32
+    python thread_budget.py --model "XGBoost-TC-model.joblib" --requests 400
+"""
+
+import argparse
+import copy
+import os
+import threading
+import time
+import warnings
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from sklearn.ensemble import StackingRegressor
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.pipeline import Pipeline
+
+try:
+    from threadpoolctl import ThreadpoolController
+    THREADPOOLCTL_AVAILABLE = True
+except ImportError:
+    THREADPOOLCTL_AVAILABLE = False
+
+
+def _is_catboost(model):
+    return type(model).__module__.startswith("catboost")
+
+
+def _is_xgboost(model):
+    return type(model).__module__.startswith("xgboost")
+
+
+# XGBoost模型 -> 空闲的副本列表；模型被释放（例如热更新替换）后对应的副本池随之释放
+_xgboost_replicas = weakref.WeakKeyDictionary()
+_xgboost_replicas_guard = threading.Lock()
+
+
+@contextmanager
+def _xgboost_replica(model):
+    """借出一个与model共享参数、但booster独立的浅拷贝，用完归还到副本池"""
+    with _xgboost_replicas_guard:
+        pool = _xgboost_replicas.setdefault(model, [])
+        replica = pool.pop() if pool else None
+    if replica is None:
+        replica = copy.copy(model)
+        replica._Booster = model.get_booster().copy()
+        replica.budget_nthread = None
+    try:
+        yield replica
+    finally:
+        with _xgboost_replicas_guard:
+            pool.append(replica)
+
+
+def predict_with_threads(model, X, thread_count=None):
+    """
+    用指定线程数预测（thread_count为None时使用各库的默认线程数）
+
+    参数:
+        model: Pipeline、StackingRegressor、MultiOutputRegressor、CatBoost/XGBoost/sklearn估计器
+        X: 特征矩阵或DataFrame（Pipeline的预处理步骤会先执行）
+    """
+    if isinstance(model, Pipeline):
+        for _, step in model.steps[:-1]:
+            if step is None or step == "passthrough":
+                continue
+            X = step.transform(X)
+        return predict_with_threads(model.steps[-1][1], X, thread_count)
+
+    if thread_count is None:
+        return model.predict(X)
+
+    if _is_catboost(model):
+        return model.predict(X, thread_count=thread_count)
+
+    if _is_xgboost(model):
+        # 直接设置副本booster的nthread（旧版本保存的模型缺少新参数，set_params会失败）；只降低不提升线程数。
+        # set_param会让下一次预测重新配置booster，因此线程数不变时不重复设置
+        own = getattr(model, "n_jobs", None)
+        thread_count = min(thread_count, own if own and own > 0 else os.cpu_count() or 1)
+        with _xgboost_replica(model) as replica:
+            if replica.budget_nthread != thread_count:
+                replica.get_booster().set_param({"nthread": thread_count})
+                replica.budget_nthread = thread_count
+            return replica.predict(X)
+
+    if isinstance(model, StackingRegressor):
+        # 与StackingRegressor.predict相同：各基模型的预测拼接（passthrough时附加原始特征）后交给元模型
+        stacked = [np.asarray(predict_with_threads(estimator, X, thread_count)).reshape(len(X), -1)
+                   for estimator in model.estimators_]
+        if model.passthrough:
+            stacked.append(np.asarray(X))
+        return predict_with_threads(model.final_estimator_, np.hstack(stacked), thread_count)
+
+    if isinstance(model, MultiOutputRegressor):
+        return np.column_stack([predict_with_threads(estimator, X, thread_count) for estimator in model.estimators_])
+
+    return model.predict(X)
+
+
+class ThreadBudget:
+    """进程内共享的线程预算：按当前并发预测数为每次调用分配线程"""
+
+    def __init__(self, total_threads=None, min_per_call=1, max_per_call=None):
+        """
+        参数:
+            total_threads: 所有并发预测共享的线程总数（默认CPU核心数）
+            min_per_call: 单次预测最少线程数
+            max_per_call: 单次预测最多线程数（默认等于total_threads）
+        """
+        self.total_threads = max(1, int(total_threads or os.cpu_count() or 1))
+        self.min_per_call = max(1, int(min_per_call))
+        self.max_per_call = max(self.min_per_call, int(max_per_call or self.total_threads))
+        self._active = 0
+        self._peak = 0
+        self._calls = 0
+        self._lock = threading.Lock()
+        # 扫描已加载的BLAS库只做一次（threadpool_limits每次调用都会重新扫描，耗时数毫秒）
+        self._blas = ThreadpoolController().select(user_api="blas") if THREADPOOLCTL_AVAILABLE else None
+        self._blas_threads = None
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取预算配置"""
+        return cls(
+            total_threads=os.environ.get("THREAD_BUDGET_TOTAL") or None,
+            min_per_call=os.environ.get("THREAD_BUDGET_MIN_PER_CALL") or 1,
+            max_per_call=os.environ.get("THREAD_BUDGET_MAX_PER_CALL") or None,
+        )
+
+    def _threads_for(self, active):
+        return max(self.min_per_call, min(self.max_per_call, self.total_threads // max(active, 1)))
+
+    def _apply_blas(self, thread_count):
+        """把进程级BLAS线程数设为当前份额（在持有锁时调用，取值不变时跳过）"""
+        if self._blas is not None and thread_count != self._blas_threads:
+            self._blas.limit(limits=thread_count)
+            self._blas_threads = thread_count
+
+    @contextmanager
+    def reserve(self):
+        """
+        登记一次预测并返回本次可用的线程数（BLAS线程数随并发数调整）
+
+        用法:
+            with budget.reserve() as thread_count:
+                prediction = predict_with_threads(model, X, thread_count)
+        """
+        with self._lock:
+            self._active += 1
+            self._calls += 1
+            self._peak = max(self._peak, self._active)
+            thread_count = self._threads_for(self._active)
+            self._apply_blas(thread_count)
+        try:
+            yield thread_count
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._apply_blas(self._threads_for(self._active))
+
+    def predict(self, model, X):
+        """按预算线程数执行一次预测"""
+        with self.reserve() as thread_count:
+            return predict_with_threads(model, X, thread_count)
+
+    def status(self):
+        """返回线程预算的运行状态"""
+        with self._lock:
+            return {
+                "线程总数": self.total_threads,
+                "单次线程范围": f"{self.min_per_call}-{self.max_per_call}",
+                "进行中预测": self._active,
+                "峰值并发": self._peak,
+                "累计预测": self._calls,
+                "BLAS线程": self._blas_threads if self._blas is not None else "未安装threadpoolctl",
+            }
+
+
+def _benchmark(predict_fn, rows, concurrency, requests):
+    """concurrency个线程同时发送单行预测请求，返回每个请求的延迟（毫秒）和总耗时"""
+    latencies = np.zeros(requests)
+
+    def one(i):
+        start = time.perf_counter()
+        predict_fn(rows[i % len(rows)])
+        latencies[i] = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return latencies, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    from float32_inference import EnsembleDirModel
+    from model_registry import load_joblib
+
+    parser = argparse.ArgumentParser(description="对比默认线程与线程预算在并发预测下的延迟")
+    parser.add_argument("--model", required=True, help="joblib模型文件或*_Yield%%_Model目录")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="并发预测器数量")
+    parser.add_argument("--requests", type=int, default=320, help="每种配置的请求数")
+    parser.add_argument("--total-threads", type=int, help="线程预算总数（默认CPU核心数）")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.model):
+        ensemble = EnsembleDirModel(args.model)
+        members = list(zip(ensemble.models, ensemble.scalers, ensemble.weights))
+        n_features = len(ensemble.feature_names)
+
+        def predict_default(x):
+            return sum(w * float(predict_with_threads(m, s.transform(x) if s is not None else x)[0])
+                       for m, s, w in members)
+
+        def make_budget_predict(budget):
+            def predict(x):
+                with budget.reserve() as thread_count:
+                    return sum(w * float(predict_with_threads(m, s.transform(x) if s is not None else x, thread_count)[0])
+                               for m, s, w in members)
+            return predict
+    else:
+        model = load_joblib(args.model)
+        n_features = int(getattr(model, "n_features_in_", 0)) or len(getattr(model, "feature_names_in_", []))
+
+        def predict_default(x):
+            return predict_with_threads(model, x)
+
+        def make_budget_predict(budget):
+            return lambda x: budget.predict(model, x)
+
+    rng = np.random.default_rng(0)
+    rows = [rng.normal(size=(1, n_features)) for _ in range(64)]
+    warnings.filterwarnings("ignore", message=".*feature names.*")
+
+    print(f"CPU核心数: {os.cpu_count()}, threadpoolctl: {'已安装' if THREADPOOLCTL_AVAILABLE else '未安装'}")
+    print(f"{'并发':>6} {'策略':>8} {'P50(ms)':>10} {'P99(ms)':>10} {'吞吐(次/秒)':>12}")
+    for concurrency in args.concurrency:
+        budget = ThreadBudget(total_threads=args.total_threads)
+        for name, predict_fn in (("默认", predict_default), ("线程预算", make_budget_predict(budget))):
+            _benchmark(predict_fn, rows, concurrency, concurrency)  # 按目标并发预热（XGBoost副本池在此建立）
+            latencies, elapsed = _benchmark(predict_fn, rows, concurrency, args.requests)
+            print(f"{concurrency:>6} {name:>8} {np.percentile(latencies, 50):>10.2f} "
+                  f"{np.percentile(latencies, 99):>10.2f} {args.requests / elapsed:>12.1f}")
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+*_Yield%_Model 集成并行训练
+按预测器加载的目录结构训练并写出10成员CatBoost加权集成：
+    <目标>_Model/models/model_0..9.joblib      子模型
+    <目标>_Model/scalers/scaler_0..9.joblib    子模型各自的StandardScaler
+    <目标>_Model/final_scaler.joblib           训练集上的StandardScaler（备用）
+    <目标>_Model/model_weights.npy             子模型权重（和为1）
+    <目标>_Model/metadata.json                 特征名、目标名、性能、特征范围、SHAP期望值
+    <目标>_Model/feature_importance.csv        加权特征重要性
+
+训练方式（与现有目录一致）: 按 --test-size 划分训练/测试集；0号子模型使用完整训练集（其标准化器与final_scaler相同），
+其余子模型使用训练集的自助采样；权重与各子模型在袋外样本上的RMSE成反比（0号子模型没有袋外样本，取其余权重的均值）。
+所有目标的全部子模型作为独立任务提交到同一个进程池，每个子模型的CatBoost线程数限制为 CPU核心数 / 进程数，
+避免多个训练任务同时占满全部核心造成线程超订。
+
+写出时只替换 models/、scalers/ 和上述文件，目录中的图片、simple_predictor.py 等保留；
+旧 metadata.json 中的预测档位（ensemble_tiers.py）随重新训练失效，需要时重新生成。
+
+用法:
+    python train_yield_ensemble.py --data pyrolysis_data.xlsx --targets "Char Yield(%)" "Oil Yield(%)" "Gas Yield(%)"
+    python train_yield_ensemble.py --data data.csv --targets "Char Yield(%)" --jobs 10 --output-root retrained
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+from batch_jobs import read_table
+
+DEFAULT_MEMBERS = 10
+# 与现有 *_Yield%_Model 子模型相同的超参数
+DEFAULT_PARAMS = {
+    "iterations": 1000,
+    "learning_rate": 0.03,
+    "depth": 4,
+    "l2_leaf_reg": 3.0,
+    "loss_function": "RMSE",
+    "random_strength": 1.0,
+    "bagging_temperature": 1.0,
+    "bootstrap_type": "Bayesian",
+    "min_data_in_leaf": 3,
+}
+
+
+def model_dir_name(target_name):
+    """目标列名对应的模型目录名，例如 'Char Yield(%)' -> 'Char_Yield%_Model'"""
+    return target_name.replace(" ", "_").replace("(", "").replace(")", "") + "_Model"
+
+
+def _rmse(y_true, y_pred):
+    return float(np.sqrt(mean_squared_error(y_true, y_pred)))
+
+
+def _train_member(task):
+    """进程池任务：训练一个子模型，返回 (目标名, 序号, 模型, 标准化器, 袋外RMSE, 耗时秒)"""
+    from catboost import CatBoostRegressor
+
+    start = time.perf_counter()
+    X, y = task["X"], task["y"]
+    rng = np.random.RandomState(task["seed"])
+    if task["bootstrap"]:
+        rows = rng.randint(0, len(X), len(X))
+        oob = np.setdiff1d(np.arange(len(X)), rows)
+    else:
+        rows, oob = np.arange(len(X)), np.array([], dtype=int)
+
+    X_member = pd.DataFrame(X[rows], columns=task["feature_names"])
+    scaler = StandardScaler().fit(X_member)
+    model = CatBoostRegressor(**task["params"], random_seed=task["seed"], thread_count=task["thread_count"],
+                              verbose=False, allow_writing_files=False)
+    model.fit(scaler.transform(X_member), y[rows])
+
+    oob_rmse = None
+    if len(oob) > 0:
+        X_oob = scaler.transform(pd.DataFrame(X[oob], columns=task["feature_names"]))
+        oob_rmse = _rmse(y[oob], model.predict(X_oob))
+    return task["target"], task["index"], model, scaler, oob_rmse, time.perf_counter() - start
+
+
+def member_weights(oob_rmses):
+    """权重与袋外RMSE成反比并归一化；没有袋外RMSE的子模型取其余原始权重的均值"""
+    raw = np.array([1.0 / rmse if rmse else np.nan for rmse in oob_rmses], dtype=np.float64)
+    fill = np.nanmean(raw) if np.isfinite(raw).any() else 1.0
+    raw = np.where(np.isfinite(raw), raw, fill)
+    return raw / raw.sum()
+
+
+def ensemble_predict(models, scalers, weights, X):
+    """与预测器相同的推理方式：每个子模型使用各自的标准化器，再按权重加权"""
+    result = np.zeros(len(X))
+    for model, scaler, weight in zip(models, scalers, weights):
+        result += weight * np.asarray(model.predict(scaler.transform(X)), dtype=np.float64).ravel()
+    return result
+
+
+def train_ensembles(data, targets, feature_names=None, n_members=DEFAULT_MEMBERS, params=None, test_size=0.2,
+                    seed=42, n_jobs=None, threads_per_member=None):
+    """
+    并行训练多个目标的加权集成
+
+    参数:
+        data: 包含特征列和目标列的DataFrame
+        targets: 目标列名列表，每个目标训练一个集成
+        feature_names: 特征列（默认为除所有目标列外的数值列）
+        n_jobs: 进程数（默认CPU核心数）
+        threads_per_member: 每个子模型的CatBoost线程数（默认 CPU核心数 / 进程数，至少1）
+
+    返回:
+        {目标名: 集成字典（models、scalers、final_scaler、weights、metadata、importance、member_seconds）}
+    """
+    missing = [target for target in targets if target not in data.columns]
+    if missing:
+        raise ValueError(f"数据缺少目标列: {missing}")
+    if feature_names is None:
+        feature_names = [c for c in data.select_dtypes(include="number").columns if c not in targets]
+    missing = [name for name in feature_names if name not in data.columns]
+    if missing:
+        raise ValueError(f"数据缺少特征列: {missing}")
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    n_jobs = n_jobs or os.cpu_count() or 1
+    threads_per_member = threads_per_member or max(1, (os.cpu_count() or 1) // n_jobs)
+
+    splits = {}
+    tasks = []
+    for target in targets:
+        frame = data[feature_names + [target]].dropna()
+        X = frame[feature_names].to_numpy(dtype=np.float64)
+        y = frame[target].to_numpy(dtype=np.float64)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=seed)
+        splits[target] = (frame, X_train, X_test, y_train, y_test)
+        for index in range(n_members):
+            tasks.append({"target": target, "index": index, "X": X_train, "y": y_train,
+                          "feature_names": feature_names, "params": params, "seed": seed + index,
+                          "bootstrap": index > 0, "thread_count": threads_per_member})
+
+    print(f"训练 {len(targets)} 个目标 x {n_members} 个子模型: {n_jobs} 个进程, 每个子模型 {threads_per_member} 个线程")
+    members = {target: [None] * n_members for target in targets}
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(_train_member, task) for task in tasks]
+        for future in as_completed(futures):
+            target, index, model, scaler, oob_rmse, seconds = future.result()
+            members[target][index] = (model, scaler, oob_rmse, seconds)
+            oob_text = f"袋外RMSE={oob_rmse:.4f}" if oob_rmse is not None else "完整训练集"
+            print(f"  {target} model_{index}: {seconds:.1f} 秒, {oob_text}")
+
+    ensembles = {}
+    for target in targets:
+        frame, X_train, X_test, y_train, y_test = splits[target]
+        models = [member[0] for member in members[target]]
+        scalers = [member[1] for member in members[target]]
+        weights = member_weights([member[2] for member in members[target]])
+        final_scaler = StandardScaler().fit(pd.DataFrame(X_train, columns=feature_names))
+
+        def predict(X):
+            return ensemble_predict(models, scalers, weights, pd.DataFrame(X, columns=feature_names))
+
+        train_pred, test_pred = predict(X_train), predict(X_test)
+        y_all = frame[target]
+        importance = sum(weight * np.asarray(model.get_feature_importance(), dtype=np.float64)
+                         for model, weight in zip(models, weights))
+        metadata = {
+            "creation_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "version": "1.0",
+            "description": "CatBoost模型集成系统",
+            "feature_names": list(feature_names),
+            "target_name": target,
+            "performance": {
+                "train_rmse": _rmse(y_train, train_pred),
+                "train_r2": float(r2_score(y_train, train_pred)),
+                "test_rmse": _rmse(y_test, test_pred),
+                "test_r2": float(r2_score(y_test, test_pred)),
+                "target_info": {
+                    "mean": float(y_all.mean()),
+                    "median": float(y_all.median()),
+                    "min": float(y_all.min()),
+                    "max": float(y_all.max()),
+                    "std": float(y_all.std()),
+                },
+            },
+            "feature_ranges": {name: {"min": float(frame[name].min()), "max": float(frame[name].max())}
+                               for name in feature_names},
+            "shap_compatibility": {"expected_value": float(y_all.mean()), "feature_names": list(feature_names)},
+            "training": {
+                "members": n_members,
+                "params": params,
+                "seed": seed,
+                "test_size": test_size,
+                "train_rows": int(len(X_train)),
+                "test_rows": int(len(X_test)),
+                "oob_rmse": [member[2] for member in members[target]],
+            },
+        }
+        ensembles[target] = {
+            "models": models,
+            "scalers": scalers,
+            "final_scaler": final_scaler,
+            "weights": weights,
+            "metadata": metadata,
+            "importance": pd.DataFrame({"Feature": feature_names, "Importance": importance})
+                .sort_values("Importance", ascending=False),
+            "member_seconds": [member[3] for member in members[target]],
+        }
+    return ensembles
+
+
+def write_model_dir(ensemble, model_dir):
+    """
+    按预测器加载的结构写出集成目录
+    先写入同级临时目录，完成后再替换 models/、scalers/ 和各文件，写出中途失败不会留下新旧混合的目录
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=model_dir)
+    try:
+        os.makedirs(os.path.join(staging, "models"))
+        os.makedirs(os.path.join(staging, "scalers"))
+        for i, (model, scaler) in enumerate(zip(ensemble["models"], ensemble["scalers"])):
+            joblib.dump(model, os.path.join(staging, "models", f"model_{i}.joblib"))
+            joblib.dump(scaler, os.path.join(staging, "scalers", f"scaler_{i}.joblib"))
+        joblib.dump(ensemble["final_scaler"], os.path.join(staging, "final_scaler.joblib"))
+        np.save(os.path.join(staging, "model_weights.npy"), ensemble["weights"])
+        with open(os.path.join(staging, "metadata.json"), 'w', encoding='utf-8') as f:
+            json.dump(ensemble["metadata"], f, indent=4)
+        ensemble["importance"].to_csv(os.path.join(staging, "feature_importance.csv"), index=False)
+
+        for name in ("models", "scalers"):
+            target_path = os.path.join(model_dir, name)
+            if os.path.isdir(target_path):
+                shutil.rmtree(target_path)
+            os.replace(os.path.join(staging, name), target_path)
+        for name in ("final_scaler.joblib", "model_weights.npy", "feature_importance.csv", "metadata.json"):
+            os.replace(os.path.join(staging, name), os.path.join(model_dir, name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并行训练 *_Yield%_Model 加权CatBoost集成")
+    parser.add_argument("--data", required=True, help="训练数据（.csv / .xlsx），包含特征列和目标列")
+    parser.add_argument("--targets", nargs="+", required=True, help="目标列，每个目标写出一个 <目标>_Model 目录")
+    parser.add_argument("--features", nargs="+", help="特征列（默认沿用已有模型目录metadata.json中的特征，否则为其余数值列）")
+    parser.add_argument("--members", type=int, default=DEFAULT_MEMBERS, help="每个集成的子模型数")
+    parser.add_argument("--iterations", type=int, help="覆盖子模型迭代次数")
+    parser.add_argument("--learning-rate", type=float, help="覆盖子模型学习率")
+    parser.add_argument("--depth", type=int, help="覆盖子模型树深度")
+    parser.add_argument("--test-size", type=float, default=0.2, help="测试集比例")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子（子模型i使用seed+i）")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="进程数")
+    parser.add_argument("--threads-per-member", type=int, help="每个子模型的CatBoost线程数（默认 CPU核心数/进程数）")
+    parser.add_argument("--output-root", default=".", help="模型目录的上级目录")
+    args = parser.parse_args()
+
+    feature_names = args.features
+    if feature_names is None:
+        for target in args.targets:
+            metadata_path = os.path.join(args.output_root, model_dir_name(target), "metadata.json")
+            if os.path.exists(metadata_path):
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    feature_names = json.load(f).get("feature_names")
+                print(f"沿用 {metadata_path} 中的特征: {', '.join(feature_names)}")
+                break
+    overrides = {key: value for key, value in (("iterations", args.iterations), ("learning_rate", args.learning_rate),
+                                               ("depth", args.depth)) if value is not None}
+
+    start = time.perf_counter()
+    ensembles = train_ensembles(read_table(args.data), args.targets, feature_names, args.members, overrides,
+                                args.test_size, args.seed, args.jobs, args.threads_per_member)
+    elapsed = time.perf_counter() - start
+
+    for target, ensemble in ensembles.items():
+        model_dir = os.path.join(args.output_root, model_dir_name(target))
+        write_model_dir(ensemble, model_dir)
+        performance = ensemble["metadata"]["performance"]
+        print(f"{target}: 训练 RMSE={performance['train_rmse']:.4f} R²={performance['train_r2']:.4f}, "
+              f"测试 RMSE={performance['test_rmse']:.4f} R²={performance['test_r2']:.4f}, "
+              f"权重 {np.round(ensemble['weights'], 4).tolist()} -> {model_dir}")
+    serial = sum(sum(ensemble["member_seconds"]) for ensemble in ensembles.values())
+    print(f"总耗时 {elapsed:.1f} 秒（子模型训练时间合计 {serial:.1f} 秒）")